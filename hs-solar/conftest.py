@@ -0,0 +1 @@
+# Makes `src` importable from the tests, which live in tests/ next to the ad-hoc scripts.
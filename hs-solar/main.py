@@ -1,4 +1,6 @@
 import argparse
+import os
+from itertools import islice
 import yaml
 
 import logging
@@ -8,8 +10,9 @@ from src import panel_insight as pn
 from src import solar_insight as si
 from src import address_insight as ai
 
-from src.encoder import load_stage_result
-from src.template import render_ranking_template, render_csv_template
+from src.encoder import iter_stage_result, load_stage_result, open_stage_result
+from src.map import BUILDING_MAP_FIELDS, SOLAR_MAP_FIELDS
+from src.template import TEMPLATE_FIELDS, render_ranking_template, render_csv_template
 
 
 if __name__ == "__main__":
@@ -27,6 +30,17 @@ if __name__ == "__main__":
 
     buildings_parser = subparsers.add_parser("buildings", help="get buildings geo info")
     buildings_parser.add_argument("--file", type=str, help="save file")
+    buildings_parser.add_argument("--map", type=str, help="also save an interactive map of the buildings")
+    buildings_parser.add_argument(
+        "--extract", type=str, help="local .osm or .osm.pbf extract to read instead of Overpass"
+    )
+
+    map_parser = subparsers.add_parser("map", help="render an interactive map of the buildings")
+    map_parser.add_argument("--file", type=str, help="save file")
+    map_parser.add_argument(
+        "--buildings", type=str, help="buildings info file (makes outbound requests if not provided)"
+    )
+    map_parser.add_argument("--solar", type=str, help="solar info file whose panels are clustered over the buildings")
 
     panels_parser = subparsers.add_parser("panels", help="filter buildings with solar panels")
     panels_parser.add_argument("--file", type=str, help="save file")
@@ -41,20 +55,51 @@ if __name__ == "__main__":
     rank_parser = subparsers.add_parser("rank", help="rank solar insights")
     rank_parser.add_argument("--file", type=str, help="save file")
     rank_parser.add_argument("--solar", type=str, help="solar info file (makes outbound requests if not provided)")
+    rank_parser.add_argument("--top-k", type=int, help="only keep the K best ranked buildings")
 
     address_parser = subparsers.add_parser("address", help="get buildings address info")
     address_parser.add_argument("--file", type=str, help="save file")
     address_parser.add_argument("--solar", type=str, help="solar info file (makes outbound requests if not provided)")
+    address_parser.add_argument("--top-k", type=int, help="only geocode the K best ranked buildings")
 
     render_parser = subparsers.add_parser("render", help="render ranking template")
     render_parser.add_argument("--html_file", type=str, help="save file")
     render_parser.add_argument("--addresses", type=str, help="addresses file (makes outbound requests if not provided)")
+    render_parser.add_argument("--top-k", type=int, help="only render the K best ranked buildings")
+    render_parser.add_argument("--page-size", type=int, help="split the HTML report into pages of this many rows")
+
+    run_parser = subparsers.add_parser("run", help="run every stage in a single streaming pipeline")
+    run_parser.add_argument("--dir", type=str, help="directory to save every stage result")
+    run_parser.add_argument("--html_file", type=str, help="save file")
+    run_parser.add_argument("--top-k", type=int, help="only geocode and render the K best ranked buildings")
+    run_parser.add_argument("--page-size", type=int, help="split the HTML report into pages of this many rows")
+    run_parser.add_argument(
+        "--previous", type=str, help="directory of a previous run, whose results are reused for unchanged buildings"
+    )
 
     args = parser.parse_args()
     if args.command == "buildings":
+        if args.extract is not None:
+            solar_pipeline.osm_extract = args.extract
         output_file = "buildings_insights.json" if args.file is None else args.file
         buildings_insights = solar_pipeline.fetch_buildings(output_file)
         logging.info(f"Saved {len(buildings_insights)} building insights to {output_file}")
+        if args.map is not None:
+            solar_pipeline.render_map(buildings_insights, args.map)
+
+    elif args.command == "map":
+        if (buildings_file := args.buildings) is None:
+            buildings_insights = solar_pipeline.fetch_buildings(None)
+        else:
+            metadata, buildings_insights = iter_stage_result(buildings_file, bd.BuildingInsight, BUILDING_MAP_FIELDS)
+            logging.info(f"Rendering map with buildings result from {buildings_file} ran at {metadata['timestamp']}")
+        solar_insights = None
+        if (solar_file := args.solar) is not None:
+            metadata, solar_insights = iter_stage_result(solar_file, si.SolarInsight, SOLAR_MAP_FIELDS)
+            logging.info(f"Clustering solar panels from {solar_file} ran at {metadata['timestamp']}")
+        solar_pipeline.render_map(
+            buildings_insights, "buildings.html" if args.file is None else args.file, solar_insights
+        )
 
     elif args.command == "panels":
         if (buildings_file := args.buildings) is None:
@@ -96,11 +141,12 @@ if __name__ == "__main__":
             solar_insights = solar_pipeline.fetch_solar_data(panels_insights)
             logging.info(f"Got {len(solar_insights)} solar insights")
         else:
-            metadata, solar_insights = load_stage_result(solar_file, si.SolarInsight)
+            # .columns stages are ranked from their columns, decoding only the rows kept
+            metadata, solar_insights = open_stage_result(solar_file, si.SolarInsight)
             logging.info(f"Running rank stage with result from {solar_file} ran at {metadata['timestamp']}")
 
         output_file = "rank_insights.json" if args.file is None else args.file
-        solar_insights = solar_pipeline.rank(solar_insights, output_file)
+        solar_insights = solar_pipeline.rank(solar_insights, output_file, args.top_k)
         logging.info(f"Saved {len(solar_insights)} rank insights to {output_file}")
 
     elif args.command == "address":
@@ -112,9 +158,13 @@ if __name__ == "__main__":
             solar_insights = solar_pipeline.fetch_solar_data(panels_insights)
             logging.info(f"Got {len(solar_insights)} solar insights")
         else:
-            metadata, solar_insights = load_stage_result(solar_file, si.SolarInsight)
+            metadata, solar_insights = open_stage_result(solar_file, si.SolarInsight)
             logging.info(f"Running address stage with result from {solar_file} ran at {metadata['timestamp']}")
 
+        if args.top_k is not None:
+            solar_insights = solar_pipeline.rank(solar_insights, None, args.top_k)
+            logging.info(f"Geocoding the {len(solar_insights)} best ranked buildings")
+
         output_file = "addresses_insights.json" if args.file is None else args.file
         address_insights = solar_pipeline.get_addresses(solar_insights, output_file)
         logging.info(f"Saved {len(address_insights)} address insights to {output_file}")
@@ -127,14 +177,64 @@ if __name__ == "__main__":
             logging.info(f"Got {len(panels_insights)} panel insights")
             solar_insights = solar_pipeline.fetch_solar_data(panels_insights)
             logging.info(f"Got {len(solar_insights)} solar insights")
-            rank_insights = solar_pipeline.rank(solar_insights)
+            rank_insights = solar_pipeline.rank(solar_insights, top_k=args.top_k)
             logging.info(f"Got {len(rank_insights)} rank insights")
             address_insights = solar_pipeline.get_addresses(rank_insights)
             logging.info(f"Got {len(address_insights)} address insights")
+
+        output_file = "ranking.html" if args.html_file is None else args.html_file
+        if addresses_file is None:
+            render_ranking_template(config, address_insights, output_file, args.page_size)
+            render_csv_template(config, address_insights, output_file.replace(".html", ".csv"))
         else:
-            metadata, address_insights = load_stage_result(addresses_file, ai.AddressInsight)
+            # stream the file once per report rather than holding every address insight in memory
+            metadata, address_insights = iter_stage_result(addresses_file, ai.AddressInsight, TEMPLATE_FIELDS)
             logging.info(f"Running render stage with result from {addresses_file} ran at {metadata['timestamp']}")
+            # the addresses file is already ranked
+            render_ranking_template(config, islice(address_insights, args.top_k), output_file, args.page_size)
+            _, address_insights = iter_stage_result(addresses_file, ai.AddressInsight, TEMPLATE_FIELDS)
+            render_csv_template(config, islice(address_insights, args.top_k), output_file.replace(".html", ".csv"))
+
+    elif args.command == "run":
+        output_dir = "results" if args.dir is None else args.dir
+        # the stage files of this run would overwrite the previous ones before they are read, and the
+        # checkpoints would resume the previous results of modified buildings too
+        if args.previous is not None and os.path.realpath(args.previous) == os.path.realpath(output_dir):
+            run_parser.error(f"--previous must be another directory than --dir ({output_dir})")
+        os.makedirs(output_dir, exist_ok=True)
+
+        def previous_file(name: str):
+            # stage file of the previous run, if it got that far
+            if args.previous is None or not os.path.exists(path := os.path.join(args.previous, name)):
+                return None
+            return path
+
+        buildings_insights = solar_pipeline.fetch_buildings(os.path.join(output_dir, "buildings.json"))
+        logging.info(f"Got {len(buildings_insights)} building insights")
+        unchanged = ()
+        if (previous_buildings := previous_file("buildings.json")) is not None:
+            unchanged = solar_pipeline.diff_buildings(buildings_insights, previous_buildings)
+
+        solar_insights = solar_pipeline.stream_solar_data(
+            buildings_insights,
+            os.path.join(output_dir, "panels.jsonl"),
+            os.path.join(output_dir, "solar.jsonl"),
+            previous_file("panels.jsonl"),
+            previous_file("solar.jsonl"),
+            unchanged,
+        )
+        logging.info(f"Got {len(solar_insights)} solar insights")
+        rank_insights = solar_pipeline.rank(solar_insights, os.path.join(output_dir, "rank.json"))
+        logging.info(f"Got {len(rank_insights)} rank insights")
+        # the ranking is saved in full, only the rendered rows are geocoded
+        address_insights = solar_pipeline.get_addresses(
+            rank_insights[: args.top_k],
+            os.path.join(output_dir, "addresses.jsonl"),
+            previous_file("addresses.jsonl"),
+            unchanged,
+        )
+        logging.info(f"Got {len(address_insights)} address insights")
 
-        output_file = "ranking.html" if args.html_file is None else args.html_file
-        render_ranking_template(config, address_insights, output_file)
+        output_file = os.path.join(output_dir, "ranking.html") if args.html_file is None else args.html_file
+        render_ranking_template(config, address_insights, output_file, args.page_size)
         render_csv_template(config, address_insights, output_file.replace(".html", ".csv"))
@@ -1,19 +1,75 @@
-from typing import List, Tuple
+from collections.abc import Sequence
 from datetime import datetime
 
-from shapely.geometry import Polygon
-from functools import cached_property
-
 from dataclasses import dataclass
 
+import numpy as np
+
+from src.encoder import register_encoder
+from src.geometry import polygon_metrics
+
 
-@dataclass
+@dataclass(slots=True)
 class Coordinate:
     lat: float
     lon: float
 
 
-@dataclass
+class CoordinateArray(Sequence):
+    """
+    Sequence of Coordinates backed by a (n, 2) array of (lat, lon), usually a view into one buffer
+    shared by all the buildings of a stage.
+    Coordinate objects are only created when items are accessed, so code iterating over
+    a building geometry keeps working.
+    """
+
+    __slots__ = ("array",)
+
+    def __init__(self, coordinates=(), dtype=None):
+        """Wraps a (n, 2) array without copying it, or packs Coordinates or lat/lon dicts into float64 by default."""
+        if isinstance(coordinates, CoordinateArray):
+            coordinates = coordinates.array
+        elif not isinstance(coordinates, np.ndarray):
+            coordinates = [(c["lat"], c["lon"]) if isinstance(c, dict) else (c.lat, c.lon) for c in coordinates]
+            dtype = dtype or np.float64
+        self.array = np.asarray(coordinates, dtype=dtype).reshape(-1, 2)
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return CoordinateArray(self.array[i])
+        lat, lon = self.array[i].tolist()
+        return Coordinate(lat=lat, lon=lon)
+
+    def __iter__(self):
+        for lat, lon in self.array.tolist():
+            yield Coordinate(lat=lat, lon=lon)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CoordinateArray):
+            return np.array_equal(self.array, other.array)
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"CoordinateArray({self.array.tolist()})"
+
+    def to_json(self) -> list[dict]:
+        return [{"lat": lat, "lon": lon} for lat, lon in self.array.tolist()]
+
+
+register_encoder(CoordinateArray, CoordinateArray.to_json)
+
+
+@dataclass(slots=True)
 class Bounds:
     minlat: float
     minlon: float
@@ -31,14 +87,21 @@ class Bounds:
         ]
 
 
-@dataclass
+@dataclass(slots=True)
 class BuildingInsight:
     building_id: int
     bounds: Bounds
-    geometry: List[Coordinate]
+    geometry: CoordinateArray
     tags: dict
+    # derived from geometry, saved with the stage so later stages don't recompute them
+    centroid: Coordinate | None = None
+    area: float | None = None  # square meters
 
-    @cached_property
-    def centroid(self) -> Coordinate:
-        centroid = Polygon([(c.lon, c.lat) for c in self.geometry]).centroid
-        return Coordinate(lon=centroid.x, lat=centroid.y)
+    def __post_init__(self):
+        if not isinstance(self.geometry, CoordinateArray):
+            self.geometry = CoordinateArray(self.geometry)
+        # buildings from stage files written before these fields existed
+        if self.centroid is None or self.area is None:
+            lat, lon, area = polygon_metrics(self.geometry.array.tolist())
+            self.centroid = self.centroid or Coordinate(lat=lat, lon=lon)
+            self.area = area if self.area is None else self.area
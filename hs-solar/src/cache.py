@@ -0,0 +1,176 @@
+# Persistent cache of external API responses, shared by every pipeline stage.
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from functools import wraps
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_TTL = 30 * 24 * 60 * 60  # 30 days
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of successful HTTP responses.
+    Entries are keyed by API name plus the request function arguments, with floats (coordinates)
+    rounded to `coordinate_precision` decimal places, so nearby requests share an entry.
+    Each API has its own TTL and the least recently used entries are evicted past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        ttl: dict | None = None,
+        max_bytes: int = 1024**3,
+        coordinate_precision: int = 6,
+    ):
+        self.path = path
+        self.ttl = ttl or {}
+        self.max_bytes = max_bytes
+        self.coordinate_precision = coordinate_precision
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+        self.__lock = threading.Lock()
+        self.__db = None
+        self.__size = 0
+        if path:
+            self.__db = sqlite3.connect(path, check_same_thread=False)
+            self.__db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    api TEXT NOT NULL,
+                    status_code INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    content BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self.__db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self.__db.commit()
+            self.__size = self.__db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def cached(
+        self, api: str, cacheable: Callable[[requests.Response], bool] | None = lambda rsp: rsp.status_code == 200
+    ):
+        """
+        Caches the responses returned by the decorated request function, if `cacheable`.
+        Without `cacheable`, as for streamed responses whose body is not read yet, the caller caches them
+        with `store` once it has read and checked them. Responses served from the cache have `from_cache` set.
+        """
+
+        def decorator(f):
+            if self.__db is None:
+                return f
+
+            @wraps(f)
+            def wrapper(*args):
+                key = self.key(api, args)
+                rsp = self.get(api, key)
+                if rsp is not None:
+                    self.hits[api] += 1
+                    return rsp
+
+                self.misses[api] += 1
+                rsp = f(*args)
+                if cacheable is not None and cacheable(rsp):
+                    self.set(api, key, rsp)
+                return rsp
+
+            return wrapper
+
+        return decorator
+
+    @property
+    def enabled(self) -> bool:
+        return self.__db is not None
+
+    def store(self, api: str, args: tuple, rsp: requests.Response, content: bytes) -> None:
+        """Caches a response returned by a request function decorated without `cacheable`, and its body."""
+        if self.__db is not None and not getattr(rsp, "from_cache", False):
+            self.set(api, self.key(api, args), rsp, content)
+
+    def key(self, api: str, args: tuple) -> str:
+        def normalize(v):
+            if isinstance(v, float):
+                return round(v, self.coordinate_precision)
+            return v
+
+        return f"{api}:{json.dumps([normalize(a) for a in args])}"
+
+    def get(self, api: str, key: str) -> requests.Response | None:
+        now = time.time()
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT status_code, headers, content, size, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            status_code, headers, content, size, created_at = row
+            if now - created_at > self.ttl.get(api, DEFAULT_TTL):
+                self.__db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.__db.commit()
+                self.__size -= size
+                return None
+
+            self.__db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.__db.commit()
+
+        rsp = requests.Response()
+        rsp.status_code = status_code
+        rsp.headers = CaseInsensitiveDict(json.loads(headers))
+        rsp._content = content
+        rsp._content_consumed = True  # iter_content reads the cached body instead of a connection
+        rsp.from_cache = True
+        rsp.encoding = requests.utils.get_encoding_from_headers(rsp.headers)
+        return rsp
+
+    def set(self, api: str, key: str, rsp: requests.Response, content: bytes | None = None) -> None:
+        now = time.time()
+        if content is None:
+            content = rsp.content
+        headers = {k: v for k, v in rsp.headers.items() if k.lower() == "content-type"}
+        with self.__lock:
+            old = self.__db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.__db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, api, rsp.status_code, json.dumps(headers), content, len(content), now, now),
+            )
+            self.__size += len(content) - (old[0] if old else 0)
+            self.__evict()
+            self.__db.commit()
+
+    def __evict(self) -> None:
+        # drop least recently used entries until the cache fits in max_bytes
+        while self.__size > self.max_bytes:
+            rows = self.__db.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100").fetchall()
+            if len(rows) == 0:
+                self.__size = 0
+                return
+            for key, size in rows:
+                self.__db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.__size -= size
+                if self.__size <= self.max_bytes:
+                    return
+
+    def log_stats(self, api: str) -> None:
+        if self.__db is None:
+            return
+        logging.info(
+            "Response cache for %s: %d hits, %d misses (%.1f MB cached)",
+            api,
+            self.hits[api],
+            self.misses[api],
+            self.__size / 1024**2,
+        )
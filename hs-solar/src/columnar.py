@@ -0,0 +1,306 @@
+# Columnar binary format for pipeline stage results.
+#
+# Every scalar field of the result dataclasses becomes one typed NumPy column, named after its path
+# (e.g. "building.bounds.minlat"). List fields store an offsets table, so the items of row i are rows
+# offsets[i]:offsets[i + 1] of the child columns (e.g. "building.geometry[].lat").
+# Array-backed types (e.g. CoordinateArray) are stored as one concatenated array plus offsets, and decoded
+# as views into it. Strings are stored as one UTF-8 buffer plus offsets, and values without a typed column
+# (dicts, mixed types) as JSON strings.
+
+import json
+import os
+import shutil
+from collections.abc import Callable, Collection, Iterator, Sequence
+from dataclasses import MISSING, fields, is_dataclass
+from types import NoneType, UnionType
+from typing import Any, Union, get_args, get_origin, get_type_hints
+
+import numpy as np
+
+STAGE_METADATA = "__stage_metadata__"
+LENGTH = "__length__"
+
+NULL = ".__null__"  # bool mask of None values
+OFFSETS = ".__offsets__"  # list item offsets
+ROW = ".__row__"  # row of an optional dataclass in its child columns, -1 for None
+STR = ".__str__"  # UTF-8 buffer, with STR + OFFSETS
+JSON = ".__json__"  # UTF-8 JSON buffer, with JSON + OFFSETS
+ARRAY = ".__array__"  # concatenated arrays of an array-backed type, with OFFSETS
+
+
+def unwrap_optional(tp: Any) -> tuple[Any, bool]:
+    if get_origin(tp) in (Union, UnionType):
+        args = [a for a in get_args(tp) if a is not NoneType]
+        if len(args) == 1:
+            return args[0], True
+    return tp, False
+
+
+def encode_strings(columns: dict, path: str, values: list) -> None:
+    encoded = [v.encode() for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    columns[path] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    columns[path + OFFSETS] = offsets
+
+
+def encode_value(columns: dict, tp: Any, path: str, values: list) -> None:
+    tp, _ = unwrap_optional(tp)
+
+    if is_dataclass(tp):
+        if any(v is None for v in values):
+            present = [v for v in values if v is not None]
+            rows = np.cumsum([v is not None for v in values], dtype=np.int64) - 1
+            columns[path + ROW] = np.where([v is None for v in values], -1, rows)
+            values = present
+        for f in fields(tp):
+            encode_value(columns, get_type_hints(tp)[f.name], f"{path}.{f.name}", [getattr(v, f.name) for v in values])
+        return
+
+    nulls = [v is None for v in values]
+    present = [v for v in values if v is not None]
+
+    # lists and arrays store None as an empty value flagged in the null mask
+    if isinstance(tp, type) and hasattr(tp, "__array__"):
+        # values of another type (e.g. a list of dataclasses) would become object arrays np.load refuses
+        arrays = [np.asarray(tp() if v is None else v if isinstance(v, tp) else tp(v)) for v in values]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(a) for a in arrays], out=offsets[1:])
+        if any(nulls):
+            columns[path + NULL] = np.array(nulls, dtype=bool)
+        columns[path + OFFSETS] = offsets
+        columns[path + ARRAY] = np.concatenate(arrays) if arrays else np.empty(0)
+        return
+
+    if get_origin(tp) is list and all(isinstance(v, list) for v in present):
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum([0 if v is None else len(v) for v in values], out=offsets[1:])
+        if any(nulls):
+            columns[path + NULL] = np.array(nulls, dtype=bool)
+        columns[path + OFFSETS] = offsets
+        encode_value(columns, get_args(tp)[0] if get_args(tp) else Any, path + "[]", [i for v in present for i in v])
+        return
+
+    kinds = {type(v) for v in present}
+    if kinds <= {bool} or kinds <= {int} or kinds <= {int, float} or kinds == {str}:
+        if any(nulls):
+            columns[path + NULL] = np.array(nulls, dtype=bool)
+        if kinds == {str}:
+            encode_strings(columns, path + STR, ["" if v is None else v for v in values])
+        else:
+            dtype = bool if kinds <= {bool} else np.int64 if kinds <= {int} else np.float64
+            columns[path] = np.array([0 if v is None else v for v in values], dtype=dtype)
+        return
+
+    # anything without a typed column (dicts, mixed types) round-trips through JSON
+    if any(is_dataclass(v) for v in present):
+        raise TypeError(f"{path}: dataclass values of a {tp} field have no columnar encoding")
+    encode_strings(columns, path + JSON, [json.dumps(v) for v in values])
+
+
+def to_columns(result_type: type, result: list) -> dict[str, np.ndarray]:
+    columns = {LENGTH: np.array([len(result)], dtype=np.int64)}
+    for f in fields(result_type):
+        encode_value(columns, get_type_hints(result_type)[f.name], f.name, [getattr(r, f.name) for r in result])
+    return columns
+
+
+def strings_getter(columns, path: str, materialize: bool) -> Callable[[int], str]:
+    buffer, offsets = columns[path], columns[path + OFFSETS]
+    if materialize:
+        buffer, offsets = bytes(buffer), offsets.tolist()
+        return lambda i: buffer[offsets[i] : offsets[i + 1]].decode()
+    return lambda i: bytes(buffer[offsets[i] : offsets[i + 1]]).decode()
+
+
+def stored_fields(columns, tp: type, prefix: str) -> list:
+    """Fields of a dataclass stored in the columns, leaving out those added since with a default value."""
+
+    def stored(name: str) -> bool:
+        path = prefix + name
+        return any(c == path or c.startswith((path + ".", path + "[")) for c in columns)
+
+    has_default = lambda f: f.default is not MISSING or f.default_factory is not MISSING
+    return [f for f in fields(tp) if not has_default(f) or stored(f.name)]
+
+
+def projection(only: Collection[str] | None, path: str) -> tuple[bool, Collection[str] | None]:
+    """Whether the field at path is decoded with `only` field paths, and the projection of its own value."""
+    if only is None:
+        return True, None
+    names = {o.partition("[:")[0]: o for o in only}
+    if any(path.startswith(name + ".") for name in names) or names.get(path) == path:
+        return True, None
+    # lists sliced with "path[:n]" keep the projection, their decoder reads n from it
+    return path in names or any(name.startswith(path + ".") for name in names), only
+
+
+def empty_decoder(tp: Any) -> Callable[[int], Any]:
+    """Decodes every row as an empty value of tp, for the fields left out of a projection."""
+    tp, _ = unwrap_optional(tp)
+    if isinstance(tp, type) and hasattr(tp, "__array__"):
+        return lambda i: tp()
+    if get_origin(tp) is list:
+        return lambda i: []
+    return lambda i: None
+
+
+def field_decoders(columns, tp: type, prefix: str, materialize: bool, only: Collection[str] | None) -> list:
+    hints = get_type_hints(tp)
+    decoders = []
+    for f in stored_fields(columns, tp, prefix):
+        selected, only_below = projection(only, prefix + f.name)
+        if selected:
+            decoders.append((f.name, value_decoder(columns, hints[f.name], prefix + f.name, materialize, only_below)))
+        else:
+            decoders.append((f.name, empty_decoder(hints[f.name])))
+    return decoders
+
+
+def value_decoder(
+    columns, tp: Any, path: str, materialize: bool, only: Collection[str] | None = None
+) -> Callable[[int], Any]:
+    """
+    Builds a function decoding row i of the value stored at path.
+    With `only`, dataclass fields whose path is neither in it nor leads to one of its paths are left empty:
+    None, or an empty list or array. Lists are decoded whole, or only their first n items for a "path[:n]".
+    """
+    tp, _ = unwrap_optional(tp)
+
+    if is_dataclass(tp):
+        decoders = field_decoders(columns, tp, path + ".", materialize, only)
+
+        def decode_dataclass(i: int):
+            return tp(**{name: decode(i) for name, decode in decoders})
+
+        if path + ROW not in columns:
+            return decode_dataclass
+        rows = columns[path + ROW].tolist() if materialize else columns[path + ROW]
+        return lambda i: None if rows[i] < 0 else decode_dataclass(int(rows[i]))
+
+    if path + ARRAY in columns:
+        array = columns[path + ARRAY]
+        offsets = columns[path + OFFSETS].tolist() if materialize else columns[path + OFFSETS]
+        return nullable(columns, path, materialize, lambda i: tp(array[offsets[i] : offsets[i + 1]]))
+
+    if path + OFFSETS in columns and path + STR not in columns and path + JSON not in columns:
+        offsets = columns[path + OFFSETS].tolist() if materialize else columns[path + OFFSETS]
+        item = value_decoder(columns, get_args(tp)[0] if get_args(tp) else Any, path + "[]", materialize)
+        slices = [o for o in only or () if o.startswith(path + "[:")]
+        if slices:
+            limit = int(slices[0][len(path) + 2 : -1])
+            return nullable(
+                columns,
+                path,
+                materialize,
+                lambda i: [item(j) for j in range(int(offsets[i]), min(int(offsets[i + 1]), int(offsets[i]) + limit))],
+            )
+        return nullable(
+            columns, path, materialize, lambda i: [item(j) for j in range(int(offsets[i]), int(offsets[i + 1]))]
+        )
+
+    if path + JSON in columns:
+        get = strings_getter(columns, path + JSON, materialize)
+        return lambda i: json.loads(get(i))
+
+    if path + STR in columns:
+        get = strings_getter(columns, path + STR, materialize)
+    elif materialize:
+        get = columns[path].tolist().__getitem__
+    else:
+        column = columns[path]
+        get = lambda i: column[i].item()
+    return nullable(columns, path, materialize, get)
+
+
+def nullable(columns, path: str, materialize: bool, get: Callable[[int], Any]) -> Callable[[int], Any]:
+    """Wraps the decoder of the value at path to return None for the rows set in its null mask, if any."""
+    if path + NULL not in columns:
+        return get
+    nulls = columns[path + NULL].tolist() if materialize else columns[path + NULL]
+    return lambda i: None if nulls[i] else get(i)
+
+
+def row_decoder(
+    columns, result_type: type, materialize: bool = True, only: Collection[str] | None = None
+) -> Callable[[int], Any]:
+    decoders = field_decoders(columns, result_type, "", materialize, only)
+    return lambda i: result_type(**{name: decode(i) for name, decode in decoders})
+
+
+def result_columns(result: list) -> dict[str, np.ndarray]:
+    if len(result) == 0:
+        return {LENGTH: np.zeros(1, dtype=np.int64)}
+    return to_columns(type(result[0]), result)
+
+
+def dump_npz(stage_metadata: dict, file_path: str, result: list) -> None:
+    columns = result_columns(result)
+    columns[STAGE_METADATA] = np.frombuffer(json.dumps(stage_metadata).encode(), dtype=np.uint8)
+    np.savez(file_path, **columns)
+
+
+def iter_npz(file_path: str, result_type: type, only: Collection[str] | None = None) -> tuple[dict, Iterator]:
+    """
+    Loads the columns of a stage file and returns its metadata and an iterator decoding one row at a time,
+    only the fields at the `only` paths if given, see `value_decoder`.
+    """
+    with np.load(file_path, allow_pickle=False) as archive:
+        columns = {name: archive[name] for name in archive.files}
+
+    metadata = json.loads(bytes(columns.pop(STAGE_METADATA)).decode())
+    length = int(columns[LENGTH][0])
+    if length == 0:
+        return metadata, iter(())
+    return metadata, map(row_decoder(columns, result_type, only=only), range(length))
+
+
+# A `.columns` stage is a directory holding every column as a raw .npy file, next to a JSON metadata file,
+# so it can be memory-mapped instead of read.
+METADATA_FILE = "stage_metadata.json"
+
+
+def dump_columns(stage_metadata: dict, dir_path: str, result: list) -> None:
+    # start from an empty directory, stale columns of another schema would be decoded as fields
+    shutil.rmtree(dir_path, ignore_errors=True)
+    os.makedirs(dir_path)
+    for name, column in result_columns(result).items():
+        np.save(os.path.join(dir_path, f"{name}.npy"), column)
+    with open(os.path.join(dir_path, METADATA_FILE), "w") as f:
+        json.dump(stage_metadata, f)
+
+
+class StageTable(Sequence):
+    """
+    Rows of a `.columns` stage, decoded on access from memory-mapped columns.
+    Opening a table only maps its files, and reading a row or a column only pages in the data it touches.
+    With `only`, rows only decode the fields at those paths, e.g. "building.geometry", the others are left empty.
+    """
+
+    def __init__(self, dir_path: str, result_type: type, only: Collection[str] | None = None):
+        self.result_type = result_type
+        self.columns = {
+            name.removesuffix(".npy"): np.load(os.path.join(dir_path, name), mmap_mode="r", allow_pickle=False)
+            for name in os.listdir(dir_path)
+            if name.endswith(".npy")
+        }
+        with open(os.path.join(dir_path, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        self.__length = int(self.columns[LENGTH][0])
+        self.__decode = row_decoder(self.columns, result_type, False, only) if self.__length > 0 else None
+
+    def __len__(self) -> int:
+        return self.__length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.__length))]
+        if i < 0:
+            i += self.__length
+        if not 0 <= i < self.__length:
+            raise IndexError(f"row {i} out of range for a table of {self.__length} rows")
+        return self.__decode(i)
+
+    def column(self, path: str) -> np.ndarray:
+        """Raw column, e.g. "solar_potential.max_panels" or "building.geometry.__offsets__"."""
+        return self.columns[path]
@@ -0,0 +1,211 @@
+# Concurrency helpers for the pipeline stages that call external APIs.
+
+import logging
+import math
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from email.utils import parsedate_to_datetime
+from functools import wraps
+from itertools import chain
+from typing import Any
+
+import requests
+
+from src.decorator import TokenBucket
+
+OVERLOAD_STATUS_CODES = (429, 503)
+
+
+def retry_after(rsp: requests.Response) -> float | None:
+    """Seconds to wait according to the response Retry-After header, if any."""
+    value = rsp.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on the number of in-flight requests to one API.
+    The limit grows by one per window of healthy responses while the average latency stays within
+    `latency_tolerance` times the best latency seen, shrinks slightly while it does not, and is halved
+    on HTTP 429/503 and connection errors.
+    Overloaded requests are retried after their Retry-After delay, or an exponential backoff, and so are
+    connection errors, re-raised once `max_retries` is exhausted.
+    With a `rate_limit` token bucket, every attempt, retries included, waits for a token before taking
+    a slot, so retries stay within the API's rate budget and the waits do not read as a slow backend.
+    Requests made with stream=True are decorated with `streaming` instead, which keeps their slot until
+    the response is closed, as their body is only read after the decorated function returns.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int = 1,
+        minimum: int = 1,
+        maximum: int = 8,
+        latency_tolerance: float = 2.0,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        rate_limit: TokenBucket | None = None,
+    ):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limit = rate_limit
+
+        self.__in_flight = 0
+        self.__best_latency = math.inf
+        self.__latency = None  # exponentially weighted moving average
+        self.__last_decrease = 0.0
+        self.__condition = threading.Condition()
+
+    def __call__(self, f: Callable[..., requests.Response]):
+        return self.__limit(f, streaming=False)
+
+    def streaming(self, f: Callable[..., requests.Response]):
+        return self.__limit(f, streaming=True)
+
+    def __limit(self, f: Callable[..., requests.Response], streaming: bool):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limit is not None:
+                    self.rate_limit.wait()
+                self.__acquire()
+                start = time.monotonic()
+                try:
+                    rsp, error = f(*args, **kwargs), None
+                except requests.exceptions.RequestException as e:
+                    rsp, error = None, e
+                except BaseException:
+                    self.__release()
+                    raise
+
+                if streaming and error is None and rsp.status_code not in OVERLOAD_STATUS_CODES:
+                    self.__release_on_close(rsp)
+                else:
+                    self.__release()
+
+                if error is not None:
+                    self.__decrease("connection error")
+                    if attempt == self.max_retries:
+                        raise error
+                    delay = self.backoff * 2**attempt
+                    logging.warning("%s request failed (%s), retrying in %.1f seconds", self.name, error, delay)
+                    time.sleep(delay)
+                    continue
+
+                if rsp.status_code not in OVERLOAD_STATUS_CODES:
+                    self.__observe(time.monotonic() - start)
+                    return rsp
+
+                self.__decrease(f"HTTP {rsp.status_code}")
+                if attempt == self.max_retries:
+                    break
+                delay = retry_after(rsp)
+                if delay is None:
+                    delay = self.backoff * 2**attempt
+                rsp.close()
+                logging.warning("%s overloaded, retrying in %.1f seconds", self.name, delay)
+                time.sleep(delay)
+
+            return rsp
+
+        return wrapper
+
+    def __acquire(self) -> None:
+        with self.__condition:
+            while self.__in_flight >= int(self.limit):
+                self.__condition.wait()
+            self.__in_flight += 1
+
+    def __release(self) -> None:
+        with self.__condition:
+            self.__in_flight -= 1
+            self.__condition.notify_all()
+
+    def __release_on_close(self, rsp: requests.Response) -> None:
+        close, released = rsp.close, threading.Event()
+
+        def release():
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    self.__release()
+
+        rsp.close = release
+
+    def __observe(self, latency: float) -> None:
+        with self.__condition:
+            self.__best_latency = min(self.__best_latency, latency)
+            self.__latency = latency if self.__latency is None else 0.8 * self.__latency + 0.2 * latency
+            if self.__latency > self.latency_tolerance * self.__best_latency:
+                self.__set_limit(self.limit - 0.5 / self.limit, f"average latency {self.__latency:.2f}s")
+            else:
+                # additive increase: one more slot after a full window of healthy responses
+                self.__set_limit(self.limit + 1 / self.limit, "healthy responses")
+
+    def __decrease(self, reason: str) -> None:
+        with self.__condition:
+            # requests in flight together fail together, so back off at most once per round trip
+            now = time.monotonic()
+            if now - self.__last_decrease < (self.__latency or 1.0):
+                return
+            self.__last_decrease = now
+            self.__set_limit(self.limit / 2, reason)
+
+    def __set_limit(self, limit: float, reason: str) -> None:
+        previous = int(self.limit)
+        self.limit = min(max(limit, self.minimum), self.maximum)
+        if int(self.limit) != previous:
+            logging.info("%s concurrency limit %d -> %d (%s)", self.name, previous, int(self.limit), reason)
+        self.__condition.notify_all()
+
+
+def imap_unordered(
+    f: Callable, iterable: Iterable, max_workers: int, discard: Callable[[Any], None] | None = None
+) -> Iterator:
+    """
+    Maps f over iterable on a thread pool, pulling inputs lazily so iterable can be a stream,
+    and yields results as soon as they complete, even while the inputs are still coming in.
+    If the consumer stops early, inputs not started yet are dropped and `discard` is called with the results
+    never yielded, e.g. to close responses still holding resources the running calls wait for.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending, done = set(), []
+        try:
+            for item in iterable:
+                pending.add(executor.submit(f, item))
+                # yield whatever has completed, only blocking while the window of submitted inputs is full
+                full = len(pending) >= 2 * max_workers
+                completed, pending = wait(pending, timeout=None if full else 0, return_when=FIRST_COMPLETED)
+                done.extend(completed)
+                while done:
+                    yield done.pop().result()
+
+            for future in as_completed(pending):
+                pending.discard(future)
+                yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            # results already done first, as the running calls may be waiting on them
+            for future in chain(done, as_completed(pending)):
+                if discard is not None and not future.cancelled() and future.exception() is None:
+                    discard(future.result())
@@ -1,30 +1,87 @@
 from functools import wraps
+import asyncio
+import inspect
+import os
+import struct
+import threading
 import time
 import logging
 
+# the shared state file holds the bucket level and the time it was last refilled
+STATE_FORMAT = "dd"
 
-def rate_limiter(calls, period):
-    call_times = []
+
+class TokenBucket:
+    """
+    Token bucket refilled at `calls / period` tokens per second, holding at most `burst` tokens.
+    Each call reserves a token, going into debt when the bucket is empty, and is told how long to wait
+    for its token, so concurrent callers are paced evenly instead of all waking up at once.
+    With a `state_file` the bucket lives in that file, guarded by a file lock, and is shared by
+    every process pointing at the same file.
+    """
+
+    def __init__(self, calls: int, period: float, burst: int = 1, state_file: str | None = None):
+        self.rate = calls / period
+        self.capacity = max(1, burst)
+        self.state_file = state_file
+        self.__tokens = float(self.capacity)
+        self.__updated = time.time()
+        self.__lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns the number of seconds to wait before using it."""
+        with self.__lock:
+            if self.state_file is None:
+                self.__tokens, self.__updated, wait = self.__take(self.__tokens, self.__updated)
+                return wait
+
+            import fcntl
+
+            fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                raw = os.pread(fd, struct.calcsize(STATE_FORMAT), 0)
+                if len(raw) == struct.calcsize(STATE_FORMAT):
+                    tokens, updated = struct.unpack(STATE_FORMAT, raw)
+                else:
+                    tokens, updated = float(self.capacity), time.time()
+                tokens, updated, wait = self.__take(tokens, updated)
+                os.pwrite(fd, struct.pack(STATE_FORMAT, tokens, updated), 0)
+            finally:
+                os.close(fd)  # closing the descriptor releases the lock
+            return wait
+
+    def wait(self) -> None:
+        """Takes a token, sleeping until it can be used."""
+        if (sleep_time := self.reserve()) > 0:
+            if sleep_time > 1:
+                logging.info(f"Rate limit exceeded. Sleeping for {sleep_time:.2f} seconds.")
+            time.sleep(sleep_time)
+
+    def __take(self, tokens: float, updated: float) -> tuple[float, float, float]:
+        now = time.time()
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate) - 1
+        wait = -tokens / self.rate if tokens < 0 else 0.0
+        return tokens, now, wait
+
+
+def rate_limiter(calls, period, burst=1, state_file=None):
+    bucket = TokenBucket(calls, period, burst, state_file)
 
     def decorator(f):
+        if inspect.iscoroutinefunction(f):
+
+            @wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                if (sleep_time := bucket.reserve()) > 0:
+                    await asyncio.sleep(sleep_time)
+                return await f(*args, **kwargs)
+
+            return async_wrapper
+
         @wraps(f)
         def wrapper(*args, **kwargs):
-            nonlocal call_times
-            now = time.time()
-
-            # Remove timestamps older than `period`
-            call_times[:] = [t for t in call_times if now - t < period]
-
-            if len(call_times) >= calls:
-                sleep_time = period - (now - call_times[0])
-                if sleep_time > 0:
-                    logging.info(f"Rate limit exceeded. Sleeping for {sleep_time:.2f} seconds.")
-                    time.sleep(sleep_time)
-                now = time.time()
-                # Clean again after sleeping
-                call_times[:] = [t for t in call_times if now - t < period]
-
-            call_times.append(now)
+            bucket.wait()
             return f(*args, **kwargs)
 
         return wrapper
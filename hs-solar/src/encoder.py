@@ -1,55 +1,345 @@
-# This module serializes and deserializes pipeline stages results into JSON.
+# This module serializes and deserializes pipeline stages results into JSON,
+# or into the columnar formats of src/columnar.py for `.npz` files and `.columns` directories.
 
 # Please interact with this code with extreme care.
 # This application is only a prototype and the code doesn't follow best practices.
 
-from dataclasses import asdict, is_dataclass
+from dataclasses import fields, is_dataclass
+import functools
 import json
+import logging
+import os
+import shutil
+import threading
 from datetime import datetime
 
-from typing import Any, TypeVar, Type
+from types import NoneType, UnionType
+from typing import Any, Self, TypeVar, Union, get_args, get_origin, get_type_hints
+from collections.abc import Callable, Collection, Container, Hashable, Iterable, Iterator, Sequence
+
+from src.columnar import StageTable, dump_columns, dump_npz, iter_npz
 
 T = TypeVar('T')
 
+@functools.cache
+def field_names(cls: type) -> tuple[str, ...]:
+    return tuple(f.name for f in fields(cls))
+
+ENCODERS: dict[type, Callable[[Any], Any]] = {}
+
+def register_encoder(tp: type, encoder: Callable[[Any], Any]) -> None:
+    """Registers the function converting `tp` objects into JSON-serializable values."""
+    ENCODERS[tp] = encoder
+
 class DataclassJSONEncoder(json.JSONEncoder):
     def default(self, o: Any):
+        if (encode := ENCODERS.get(type(o))) is not None:
+            return encode(o)
         if is_dataclass(o):
-            return asdict(o)
+            # shallow: nested dataclasses come back through default() as they are encoded,
+            # instead of asdict deep-copying the whole tree first
+            return {name: getattr(o, name) for name in field_names(type(o))}
         return super().default(o)
 
-def dump_stage_result(stage_name: str, file_path: str, result: list) -> None:
-    data = {
-        "stage_metadata": {
-            "name": stage_name,
-            "timestamp": datetime.now().isoformat(),
-        },
-        "result": result,
+def stage_metadata(stage_name: str) -> dict:
+    return {
+        "name": stage_name,
+        "timestamp": datetime.now().isoformat(),
     }
 
+def dump_stage_result(stage_name: str, file_path: str, result: Iterable) -> None:
+    """Saves a stage result, encoding one record at a time so `result` can be a generator."""
+    # columns need every value of a field at once
+    if file_path.endswith(".npz"):
+        dump_npz(stage_metadata(stage_name), file_path, list(result))
+        return
+    if file_path.endswith(".columns"):
+        dump_columns(stage_metadata(stage_name), file_path, list(result))
+        return
+
+    encoder = DataclassJSONEncoder()
     with open(file_path, "w") as f:
-        json.dump(data, f, cls=DataclassJSONEncoder, indent=2)
-   
-
-def from_dict(cls: Type[T], data: dict) -> T:
-    fieldtypes = {f.name: f.type for f in cls.__dataclass_fields__.values()}
-    kwargs = {}
-    for k, v in data.items():
-        if is_dataclass(fieldtypes[k]):
-            kwargs[k] = from_dict(fieldtypes[k], v)
-        elif isinstance(v, list) and hasattr(fieldtypes[k], '__args__'):  # List of dataclasses
-            subtype = fieldtypes[k].__args__[0]
-            if is_dataclass(subtype):
-                kwargs[k] = [from_dict(subtype, i) for i in v]
-            else:
-                kwargs[k] = v
+        if file_path.endswith(".jsonl"):
+            f.write(json.dumps({"stage_metadata": stage_metadata(stage_name)}) + "\n")
+            f.writelines(encoder.encode(r) + "\n" for r in result)
+            return
+
+        f.write('{\n"stage_metadata": ' + json.dumps(stage_metadata(stage_name)) + ',\n"result": [')
+        separator = "\n"
+        for r in result:
+            f.write(separator + encoder.encode(r))
+            separator = ",\n"
+        f.write("\n]}\n")
+
+
+DECODERS: dict[Any, Callable[[Any], Any]] = {}
+
+def register_decoder(tp: Any, decoder: Callable[[Any], Any]) -> None:
+    """Registers the function converting JSON values into `tp`, taking precedence over the built-in rules."""
+    DECODERS[tp] = decoder
+    decoder_for.cache_clear()
+
+def identity(v: Any) -> Any:
+    return v
+
+@functools.cache
+def decoder_for(tp: Any) -> Callable[[Any], Any]:
+    """
+    Builds, once per type, the function converting a JSON value into `tp`.
+    Dataclasses only convert the fields that need it, `Optional[X]` lets None through and `list[X]`
+    converts each item, so plain values (numbers, strings, dicts, lists of numbers) are passed as is.
+    """
+    if tp in DECODERS:
+        return DECODERS[tp]
+
+    origin, args = get_origin(tp), get_args(tp)
+    if origin in (Union, UnionType):
+        args = [a for a in args if a is not NoneType]
+        if len(args) != 1:
+            return identity
+        decode_item = decoder_for(args[0])
+        if decode_item is identity:
+            return identity
+        return lambda v: None if v is None else decode_item(v)
+
+    if origin is list and args:
+        decode_item = decoder_for(args[0])
+        if decode_item is identity:
+            return identity
+        return lambda v: [decode_item(i) for i in v]
+
+    if is_dataclass(tp):
+        hints = get_type_hints(tp)
+        field_decoders = [(f.name, d) for f in fields(tp) if (d := decoder_for(hints[f.name])) is not identity]
+
+        def decode(data: dict):
+            if data is None:
+                return None
+            kwargs = dict(data)
+            for name, decode_field in field_decoders:
+                if name in kwargs:
+                    kwargs[name] = decode_field(kwargs[name])
+            return tp(**kwargs)
+
+        return decode
+
+    return identity
+
+def from_dict(cls: type[T], data: dict) -> T:
+    return decoder_for(cls)(data)
+
+def scan_jsonl_stage(path: str) -> Iterator[tuple[dict, int]]:
+    """Yields the raw lines of a JSON Lines stage file, metadata first, with the size of the valid prefix so far."""
+    valid_size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                raw = json.loads(line)
+            except json.JSONDecodeError:
+                # a run killed mid-write leaves a truncated last line behind
+                logging.warning("Ignoring truncated record at the end of %s", path)
+                return
+            valid_size += len(line)
+            yield raw, valid_size
+
+def read_jsonl_stage(path: str) -> tuple[dict, list[dict], int]:
+    """Reads a JSON Lines stage file, returning its metadata, raw records and the size of its valid prefix."""
+    metadata, records, valid_size = None, [], 0
+    for raw, valid_size in scan_jsonl_stage(path):
+        if metadata is None:
+            metadata = raw["stage_metadata"]
         else:
-            kwargs[k] = v
-    return cls(**kwargs)
+            records.append(raw)
+
+    return metadata, records, valid_size
+
+class JSONStream:
+    """Incremental reader of the JSON values in a text file, holding only the value being parsed in memory."""
 
-def load_stage_result(path: str, result_type: Type[T]) -> dict:
+    WHITESPACE = " \t\n\r"
+
+    def __init__(self, f, chunk_size: int = 1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size: int) -> bool:
+        chunk = self.f.read(size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return len(chunk) > 0
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill(self.chunk_size):
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of {self.f.name}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                # incomplete value: read more, growing the reads so large values stay linear
+                if not self.fill(size):
+                    raise
+                size *= 2
+
+def iter_json_stage(path: str) -> Iterator[dict]:
+    """Yields the stage metadata of a JSON stage file and then each raw record of its result."""
     with open(path, "r") as f:
-        raw = json.load(f)
+        stream = JSONStream(f)
+        stream.expect("{")
+        while stream.peek() != "}":
+            key = stream.value()
+            stream.expect(":")
+            if key != "result":
+                value = stream.value()
+                if key == "stage_metadata":
+                    yield value
+            else:
+                stream.expect("[")
+                while stream.peek() != "]":
+                    yield stream.value()
+                    if stream.peek() == ",":
+                        stream.expect(",")
+                stream.expect("]")
+            if stream.peek() == ",":
+                stream.expect(",")
+
+def iter_stage_result(
+    path: str, result_type: type[T], only: Collection[str] | None = None
+) -> tuple[dict, Iterator[T]]:
+    """
+    Opens a stage result for reading one record at a time.
+    The metadata is read right away and the records are decoded lazily as the iterator is consumed.
+    Columnar (`.npz` and `.columns`) records only decode the fields at the `only` paths if given, leaving
+    the others empty, so readers of a few fields skip e.g. the solar panels. JSON records are decoded whole.
+    """
+    if path.endswith(".npz"):
+        return iter_npz(path, result_type, only)
+
+    if path.endswith(".columns"):
+        table = StageTable(path, result_type, only)
+        return table.metadata, iter(table)
+
+    if path.endswith(".jsonl"):
+        records = (raw for raw, _ in scan_jsonl_stage(path))
+        metadata = next(records)["stage_metadata"]
+    else:
+        records = iter_json_stage(path)
+        metadata = next(records)
+    return metadata, map(decoder_for(result_type), records)
+
+def open_stage_result(path: str, result_type: type[T]) -> tuple[dict, Sequence[T]]:
+    """Like load_stage_result, except `.columns` stages are opened as a lazy StageTable."""
+    if path.endswith(".columns"):
+        table = StageTable(path, result_type)
+        return table.metadata, table
+    return load_stage_result(path, result_type)
+
+def load_stage_result(path: str, result_type: type[T]) -> tuple[dict, list[T]]:
+    metadata, records = iter_stage_result(path, result_type)
+    return metadata, list(records)
+
+
+class StageCheckpoint:
+    """
+    Collects a stage's results keyed by building.
+    With a `.jsonl` file each result is appended as soon as it is added, and the results of a
+    previous, interrupted run are loaded back so the stage can skip those buildings.
+    Results of a previous run can be carried over with `reuse`, so the stage also skips those buildings.
+    Once the stage completes, `finish` rewrites the file with the results in input order.
+    """
+
+    def __init__(self, stage_name: str, file_path: str, result_type: type[T], key: Callable[[T], Hashable]):
+        self.stage_name = stage_name
+        self.file_path = file_path
+        self.result_type = result_type
+        self.key = key
+        self.results = {}
+        self.__file = None
+        self.__lock = threading.Lock()
+
+    def __enter__(self) -> Self:
+        if not self.file_path or not self.file_path.endswith(".jsonl"):
+            return self
+
+        valid_size = 0
+        if os.path.exists(self.file_path):
+            _, records, valid_size = read_jsonl_stage(self.file_path)
+            decode = decoder_for(self.result_type)
+            for r in records:
+                result = decode(r)
+                self.results[self.key(result)] = result
+            logging.info(
+                "Resuming %s stage with %d results from %s", self.stage_name, len(self.results), self.file_path
+            )
+
+        self.__file = open(self.file_path, "r+b" if valid_size > 0 else "wb")
+        self.__file.truncate(valid_size)
+        self.__file.seek(valid_size)
+        if valid_size == 0:
+            self.__write({"stage_metadata": stage_metadata(self.stage_name)})
+        return self
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.results
+
+    def __write(self, obj: Any) -> None:
+        self.__file.write((json.dumps(obj, cls=DataclassJSONEncoder) + "\n").encode())
+        self.__file.flush()
+
+    def add(self, result) -> None:
+        with self.__lock:
+            self.results[self.key(result)] = result
+            if self.__file is not None:
+                self.__write(result)
+
+    def reuse(self, file_path: str, keys: Container) -> None:
+        """Adds the results of a previous run's stage file whose key is in `keys`, unless already resumed."""
+        _, results = iter_stage_result(file_path, self.result_type)
+        reused = 0
+        for result in results:
+            key = self.key(result)
+            if key in keys and key not in self.results:
+                self.add(result)
+                reused += 1
+        logging.info("Reusing %d %s results from %s", reused, self.stage_name, file_path)
+
+    def finish(self, keys: Iterable[Hashable]) -> list:
+        """Saves and returns the results in the order of the given keys, skipping keys without a result."""
+        ordered = [self.results[k] for k in keys if k in self.results]
+        self.close()
+        if self.file_path:
+            logging.info("Saving %s stage results to %s", self.stage_name, self.file_path)
+            # write next to the checkpoint and swap, so a crash here still leaves a valid file
+            root, ext = os.path.splitext(self.file_path)
+            tmp_path = f"{root}.tmp{ext}"
+            dump_stage_result(self.stage_name, tmp_path, ordered)
+            if os.path.isdir(self.file_path):
+                # directories can't be replaced while they hold files
+                shutil.rmtree(self.file_path)
+            os.replace(tmp_path, self.file_path)
+        return ordered
 
-    return raw["stage_metadata"], [from_dict(result_type, r) for r in raw["result"]]
+    def close(self) -> None:
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
 
-        
\ No newline at end of file
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
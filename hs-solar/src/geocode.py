@@ -0,0 +1,96 @@
+# Spatial cache of reverse geocoding answers.
+#
+# Neighbouring buildings usually share a street address, so an address geocoded once is reused for any
+# point within a few metres of it, in this run or later ones, instead of calling the Geocoding API again.
+
+import math
+import sqlite3
+import threading
+import time
+
+from src.geometry import EARTH_RADIUS
+
+METERS_PER_DEGREE = math.radians(1.0) * EARTH_RADIUS
+CELL_SIZE = 0.001  # degrees, grid the cached points are indexed by
+
+
+class GeocodeCache:
+    """
+    Addresses of previously geocoded points in SQLite, indexed by grid cell, so the nearest one within
+    `radius` metres of a point is found with one indexed query. Kept in memory for the run without `path`.
+    Points are snapped to a grid of `snap` metres before being geocoded, so close buildings also share
+    the requests kept by the response cache.
+    Addresses are kept forever unless `max_age` is given, in seconds, after which they are dropped and the
+    points around them geocoded again. There is no size limit, the cache holds one row per geocoded point.
+    """
+
+    def __init__(self, path: str | None = None, radius: float = 25.0, snap: float = 10.0, max_age: float | None = None):
+        self.radius = radius
+        self.snap_size = snap
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS addresses "
+            "(cell_lat INTEGER, cell_lon INTEGER, lat REAL, lon REAL, address TEXT, created_at REAL NOT NULL DEFAULT 0)"
+        )
+        if "created_at" not in {row[1] for row in self.__db.execute("PRAGMA table_info(addresses)")}:
+            # caches written before max_age existed, their addresses count as the oldest
+            self.__db.execute("ALTER TABLE addresses ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+        self.__db.execute("CREATE INDEX IF NOT EXISTS addresses_cell ON addresses (cell_lat, cell_lon)")
+        if max_age is not None:
+            self.__db.execute("DELETE FROM addresses WHERE created_at < ?", (time.time() - max_age,))
+        self.__db.commit()
+
+    @staticmethod
+    def cell(lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / CELL_SIZE), math.floor(lon / CELL_SIZE)
+
+    def snap(self, lat: float, lon: float) -> tuple[float, float]:
+        """Nearest point of the `snap` metres grid."""
+        if not self.snap_size:
+            return lat, lon
+        step = self.snap_size / METERS_PER_DEGREE
+        lat = round(round(lat / step) * step, 7)
+        # grid columns are as many metres apart as rows, so wider in degrees away from the equator
+        lon_step = step / max(math.cos(math.radians(lat)), 1e-6)
+        return lat, round(round(lon / lon_step) * lon_step, 7)
+
+    def nearest(self, lat: float, lon: float) -> str | None:
+        """Address of the nearest cached point within `radius` metres, None if there is none."""
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        di = math.ceil(self.radius / METERS_PER_DEGREE / CELL_SIZE)
+        dj = math.ceil(self.radius / (METERS_PER_DEGREE * cos_lat) / CELL_SIZE)
+        i, j = self.cell(lat, lon)
+        oldest = 0.0 if self.max_age is None else time.time() - self.max_age
+        with self.__lock:
+            rows = self.__db.execute(
+                "SELECT lat, lon, address FROM addresses "
+                "WHERE cell_lat BETWEEN ? AND ? AND cell_lon BETWEEN ? AND ? AND created_at >= ?",
+                (i - di, i + di, j - dj, j + dj, oldest),
+            ).fetchall()
+
+        best, address = self.radius, None
+        for other_lat, other_lon, other_address in rows:
+            # equirectangular distance, accurate at these scales
+            distance = METERS_PER_DEGREE * math.hypot(other_lat - lat, (other_lon - lon) * cos_lat)
+            if distance <= best:
+                best, address = distance, other_address
+
+        with self.__lock:
+            if address is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return address
+
+    def add(self, lat: float, lon: float, address: str) -> None:
+        with self.__lock:
+            self.__db.execute(
+                "INSERT INTO addresses VALUES (?, ?, ?, ?, ?, ?)",
+                (*self.cell(lat, lon), lat, lon, address, time.time()),
+            )
+            self.__db.commit()
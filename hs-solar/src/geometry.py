@@ -0,0 +1,125 @@
+# Vectorized footprint geometry: centroids, areas and bounds of many polygons at once.
+#
+# Polygons are given as one ragged array: every vertex of every polygon in a single (n, 2) array of
+# (lat, lon) and an offsets table, so the vertices of polygon i are rows offsets[i]:offsets[i + 1].
+
+import hashlib
+import math
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+
+import numpy as np
+
+EARTH_RADIUS = 6378137.0  # meters
+
+
+@dataclass
+class FootprintMetrics:
+    centroids: np.ndarray  # (k, 2) lat, lon
+    areas: np.ndarray  # (k,) square meters
+    bounds: np.ndarray  # (k, 4) minlat, minlon, maxlat, maxlon
+
+
+def polygon_metrics(points: Sequence[Sequence[float]]) -> tuple[float, float, float]:
+    """
+    Centroid latitude, longitude and area of a single polygon of (lat, lon) points, with the same rules
+    as `footprint_metrics`. Plain Python, as NumPy's per-call overhead dominates for one small polygon.
+    """
+    n = len(points)
+    if n == 0:
+        return math.nan, math.nan, 0.0
+
+    lat0, lon0 = points[0]
+    area2 = cx = cy = sx = sy = 0.0
+    for i in range(n):
+        y, x = points[i][0] - lat0, points[i][1] - lon0
+        y1, x1 = points[(i + 1) % n][0] - lat0, points[(i + 1) % n][1] - lon0
+        cross = x * y1 - x1 * y
+        area2 += cross
+        cx += (x + x1) * cross
+        cy += (y + y1) * cross
+        sx += x
+        sy += y
+
+    if n < 3 or area2 == 0:
+        return lat0 + sy / n, lon0 + sx / n, 0.0
+    lat, lon = lat0 + cy / (3 * area2), lon0 + cx / (3 * area2)
+    scale = math.radians(1.0) ** 2 * EARTH_RADIUS**2 * math.cos(math.radians(lat))
+    return lat, lon, abs(area2) / 2 * scale
+
+
+def ragged_coordinates(geometries: Iterable[Sequence]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Packs geometries, either (n, 2) arrays or sequences of objects with lat/lon,
+    into a single (n, 2) coordinates array and its offsets.
+    """
+    arrays = [
+        np.asarray(g, dtype=np.float64).reshape(-1, 2)
+        if hasattr(g, "__array__")
+        else np.array([(c.lat, c.lon) for c in g], dtype=np.float64).reshape(-1, 2)
+        for g in geometries
+    ]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([len(a) for a in arrays], out=offsets[1:])
+    coords = np.concatenate(arrays) if arrays else np.empty((0, 2), dtype=np.float64)
+    return coords, offsets
+
+
+def footprint_metrics(coords: np.ndarray, offsets: np.ndarray) -> FootprintMetrics:
+    """
+    Computes the centroid, area and bounds of every polygon with the shoelace formula.
+    Centroids are area-weighted in (lat, lon) degrees, as shapely computes them, and areas are projected
+    to square meters around each polygon. Polygons with less than 3 vertices or no area fall back to the
+    mean of their vertices; polygons without vertices get NaN.
+    """
+    k = len(offsets) - 1
+    lengths = np.diff(offsets)
+    ids = np.repeat(np.arange(k), lengths)
+    coords = np.asarray(coords, dtype=np.float64)
+
+    # next vertex of each vertex, wrapping around to close every ring
+    nxt = np.arange(len(coords)) + 1
+    nonempty = lengths > 0
+    nxt[offsets[1:][nonempty] - 1] = offsets[:-1][nonempty]
+
+    # relative to the first vertex of each polygon, to keep the cross products well conditioned
+    origin = coords[offsets[:-1][nonempty]]
+    local = coords - np.repeat(origin, lengths[nonempty], axis=0)
+    y, x = local[:, 0], local[:, 1]
+    cross = x * y[nxt] - x[nxt] * y
+
+    area2 = np.bincount(ids, weights=cross, minlength=k)
+    cx = np.bincount(ids, weights=(x + x[nxt]) * cross, minlength=k)
+    cy = np.bincount(ids, weights=(y + y[nxt]) * cross, minlength=k)
+
+    counts = np.maximum(lengths, 1)
+    mean = np.stack(
+        [np.bincount(ids, weights=y, minlength=k) / counts, np.bincount(ids, weights=x, minlength=k) / counts], axis=1
+    )
+    polygonal = (lengths >= 3) & (area2 != 0)
+    safe = np.where(polygonal, area2, 1.0)
+    centroids = np.where(polygonal[:, None], np.stack([cy / (3 * safe), cx / (3 * safe)], axis=1), mean)
+    centroids[nonempty] += origin
+    centroids[~nonempty] = np.nan
+
+    # equirectangular projection around each polygon is accurate enough at building scale
+    lat = np.radians(centroids[:, 0])
+    scale = np.radians(1.0) ** 2 * EARTH_RADIUS**2 * np.cos(np.where(nonempty, lat, 0.0))
+    areas = np.where(polygonal, np.abs(area2) / 2 * scale, 0.0)
+
+    bounds = np.full((k, 4), np.nan)
+    if nonempty.any():
+        starts = offsets[:-1][nonempty]
+        bounds[nonempty, :2] = np.minimum.reduceat(coords, starts, axis=0)
+        bounds[nonempty, 2:] = np.maximum.reduceat(coords, starts, axis=0)
+
+    return FootprintMetrics(centroids=centroids, areas=areas, bounds=bounds)
+
+
+def footprint_hash(coords: np.ndarray) -> str:
+    """
+    Fingerprint of a footprint's vertices, rounded to the 7 decimal places OpenStreetMap stores,
+    so the same footprint hashes the same whichever stage format it was read back from.
+    """
+    rounded = np.round(np.asarray(coords, dtype=np.float64), 7) + 0.0  # + 0.0 turns -0.0 into 0.0
+    return hashlib.blake2b(rounded.tobytes(), digest_size=16).hexdigest()
@@ -1,7 +1,34 @@
 import folium
+import numpy as np
+import shapely
+from folium.plugins import FastMarkerCluster
+
+from src.geometry import ragged_coordinates
+from src.solar_insight import ORIENTATIONS, SolarPanelArray
 
 DEFAULT_N_PANELS = 15
 
+# what placeBuildings reads, so columnar buildings stages decode nothing else,
+# with the centroid and area so buildings don't recompute them from the geometry
+BUILDING_MAP_FIELDS = ("building_id", "geometry", "centroid", "area")
+
+# what clusterSolarPanels reads from a solar stage
+SOLAR_MAP_FIELDS = ("solar_potential.solar_panels",)
+
+# colors markers client side, as FastMarkerCluster only ships the raw rows to the page
+PANEL_MARKER_CALLBACK = """
+function (row) {
+    var color = row[2] > 700 ? "green" : row[2] > 650 ? "orange" : "red";
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 3, color: color, fill: true, fillColor: color, fillOpacity: 0.7
+    });
+    marker.bindPopup(
+        "Yearly Energy: " + row[2] + " kWh<br>Orientation: " + row[3] + "<br>Segment: " + row[4]
+    );
+    return marker;
+}
+"""
+
 
 class Map:
     m = None
@@ -11,7 +38,17 @@ class Map:
             location=[center_lat, center_lon], zoom_start=18, max_zoon=100
         )
 
-    def placeSolarPanels(self, solar_panels: dict, limit=DEFAULT_N_PANELS):
+    def placeSolarPanels(self, solar_panels: list[dict], limit=None, cluster=False):
+        """
+        Places Solar API panels, the first `limit` of them: DEFAULT_N_PANELS markers by default,
+        or every panel when clustered.
+        """
+        if cluster:
+            panels = solar_panels if limit is None else solar_panels[:limit]
+            self.clusterSolarPanels([SolarPanelArray.from_api(panels)])
+            return
+
+        limit = DEFAULT_N_PANELS if limit is None else limit
         count = 0
         for panel in solar_panels:
             if count >= limit:
@@ -40,6 +77,28 @@ class Map:
 
             count += 1
 
+    def clusterSolarPanels(self, solar_panels):
+        """
+        Adds every panel of the SolarPanelArrays as one clustered layer built in the browser,
+        rather than a marker object per panel in the HTML.
+        """
+        arrays = [panels.array for panels in solar_panels if len(panels) > 0]
+        if not arrays:
+            return
+        panels = np.concatenate(arrays)
+        panels = panels[~np.isnan(panels["lat"]) & ~np.isnan(panels["lon"])]
+        rows = [
+            [lat, lon, energy, ORIENTATIONS[orientation], segment]
+            for lat, lon, energy, orientation, segment in zip(
+                panels["lat"].tolist(),
+                panels["lon"].tolist(),
+                np.round(panels["yearly_energy_dc_kwh"], 1).tolist(),
+                panels["orientation"].tolist(),
+                panels["segment_index"].tolist(),
+            )
+        ]
+        FastMarkerCluster(rows, callback=PANEL_MARKER_CALLBACK).add_to(self.m)
+
     def addPoint(self, lat, lon):
         folium.CircleMarker(
             location=[lat, lon],
@@ -52,5 +111,42 @@ class Map:
             locations=bbox, color="blue", fill=True, fill_opacity=0.5
         ).add_to(self.m)
 
+    def placeBuildings(self, buildings, tolerance=None):
+        """
+        Adds every building footprint as a single GeoJSON layer, instead of a Polygon per building.
+        Footprints are simplified with Douglas-Peucker within `tolerance` degrees, if given.
+        """
+        buildings = list(buildings)
+        coords, offsets = ragged_coordinates(b.geometry for b in buildings)
+        lengths = np.diff(offsets)
+        # rings need at least 3 vertices, thinner footprints are left out of the map
+        polygonal = np.repeat(lengths >= 3, lengths)
+        ring_ids = np.repeat(np.cumsum(lengths >= 3) - 1, lengths)[polygonal]
+        if len(ring_ids) == 0:
+            return
+
+        polygons = shapely.polygons(shapely.linearrings(coords[polygonal][:, ::-1], indices=ring_ids))
+        if tolerance:
+            polygons = shapely.simplify(polygons, tolerance, preserve_topology=True)
+
+        # GeoJSON (lon, lat) rings, rounded to ~10 cm so the page doesn't carry 15 digits per coordinate
+        vertices, index = shapely.get_coordinates(polygons, return_index=True)
+        rings = np.split(np.round(vertices, 6), np.searchsorted(index, np.arange(1, len(polygons))))
+        ids = [b.building_id for b, n in zip(buildings, lengths) if n >= 3]
+        features = [
+            {
+                "type": "Feature",
+                "properties": {"id": building_id},
+                "geometry": {"type": "Polygon", "coordinates": [ring.tolist()]},
+            }
+            for building_id, ring in zip(ids, rings)
+            if len(ring) > 0
+        ]
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": features},
+            style_function=lambda feature: {"color": "blue", "fillOpacity": 0.5, "weight": 1},
+            tooltip=folium.GeoJsonTooltip(fields=["id"]),
+        ).add_to(self.m)
+
     def save(self, filename):
         self.m.save(filename)
@@ -0,0 +1,174 @@
+# Building ways from a local OpenStreetMap extract, .osm XML or .osm.pbf, without the Overpass API.
+#
+# Extracts are streamed in a single pass. Nodes around the region go into an on-disk SQLite coordinate index,
+# so memory stays bounded whatever the extract size, and the index is reused by later runs over the same
+# extract and region. Extracts list nodes before ways, so building ways are resolved against the index as
+# they are read and yielded as the same elements the Overpass API returns.
+
+import json
+import logging
+import os
+import sqlite3
+from collections.abc import Iterable, Iterator
+from xml.etree import ElementTree
+
+from src.overpass import BBox
+
+NODE, WAY = "node", "way"
+NODE_MARGIN = 0.01  # degrees indexed around the region, so buildings crossing its border keep every node
+BATCH_SIZE = 10000
+
+
+def inside(bbox: BBox, lat: float, lon: float) -> bool:
+    south, west, north, east = bbox
+    return south <= lat <= north and west <= lon <= east
+
+
+def read_osm_xml(path: str, nodes: bool = True) -> Iterator[tuple]:
+    """(NODE, id, lat, lon) and building (WAY, id, node ids, tags) of an .osm XML extract, parsed incrementally."""
+    events = ElementTree.iterparse(path, events=("start", "end"))
+    _, root = next(events)
+    depth = 0  # below root
+    for event, elem in events:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 0:
+            # tags and node references, read with their way
+            continue
+        if elem.tag == "node":
+            if nodes:
+                yield NODE, int(elem.get("id")), float(elem.get("lat")), float(elem.get("lon"))
+        elif elem.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+            if "building" in tags:
+                yield WAY, int(elem.get("id")), [int(nd.get("ref")) for nd in elem.iter("nd")], tags
+        # drop every parsed top-level element, relations included, so the tree never holds more than the current one
+        root.clear()
+
+
+def read_osm_pbf(path: str, nodes: bool = True) -> Iterator[tuple]:
+    """Same as `read_osm_xml` for .osm.pbf extracts, which need pyosmium."""
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError("Reading .osm.pbf extracts needs pyosmium, install it with `pip install osmium`") from e
+
+    entities = osmium.osm.NODE | osmium.osm.WAY if nodes else osmium.osm.WAY
+    for obj in osmium.FileProcessor(path, entities):
+        if obj.is_node():
+            if obj.location.valid():
+                yield NODE, obj.id, obj.location.lat, obj.location.lon
+        elif "building" in obj.tags:
+            yield WAY, obj.id, [node.ref for node in obj.nodes], {tag.k: tag.v for tag in obj.tags}
+
+
+class NodeIndex:
+    """
+    On-disk index of node coordinates, tagged with the extract and region it was built from,
+    so runs over the same extract and a region within the indexed one skip reading its nodes.
+    """
+
+    def __init__(self, path: str):
+        self.__db = sqlite3.connect(path)
+        self.__db.execute("CREATE TABLE IF NOT EXISTS source (description TEXT)")
+        self.__db.execute("CREATE TABLE IF NOT EXISTS nodes (id INTEGER PRIMARY KEY, lat REAL, lon REAL)")
+        self.__db.commit()
+
+    def covers(self, extract: dict, region: BBox) -> bool:
+        row = self.__db.execute("SELECT description FROM source").fetchone()
+        if row is None:
+            return False
+        source = json.loads(row[0])
+        south, west, north, east = source.pop("region")
+        return (
+            source == extract and south <= region[0] and west <= region[1] and north >= region[2] and east >= region[3]
+        )
+
+    def reset(self) -> None:
+        self.__db.execute("DELETE FROM source")
+        self.__db.execute("DELETE FROM nodes")
+        self.__db.commit()
+
+    def add(self, nodes: list[tuple[int, float, float]]) -> None:
+        self.__db.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)", nodes)
+
+    def complete(self, extract: dict, region: BBox) -> None:
+        """Marks the index as holding every node of the extract within region."""
+        self.__db.execute("INSERT INTO source VALUES (?)", (json.dumps({**extract, "region": region}),))
+        self.__db.commit()
+
+    def lookup(self, ids: Iterable[int]) -> dict[int, tuple[float, float]]:
+        rows = self.__db.execute(
+            "SELECT id, lat, lon FROM nodes WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(list(ids)),)
+        )
+        return {node_id: (lat, lon) for node_id, lat, lon in rows}
+
+    def close(self) -> None:
+        self.__db.close()
+
+
+def resolve_ways(index: NodeIndex, ways: list[tuple], bbox: BBox) -> Iterator[dict]:
+    """Overpass-style elements of the ways with a node within bbox, with their geometry from the index."""
+    coordinates = index.lookup({ref for _, refs, _ in ways for ref in refs})
+    for way_id, refs, tags in ways:
+        points = [coordinates.get(ref) for ref in refs]
+        # ways outside the indexed region, or referencing nodes missing from the extract
+        if None in points or not any(inside(bbox, lat, lon) for lat, lon in points):
+            continue
+        yield {
+            "type": WAY,
+            "id": way_id,
+            "nodes": refs,
+            "geometry": [{"lat": lat, "lon": lon} for lat, lon in points],
+            "tags": tags,
+        }
+
+
+def extract_buildings(path: str, bbox: BBox, node_index: str | None = None) -> Iterator[dict]:
+    """
+    Building ways within bbox from a local .osm or .osm.pbf extract, as Overpass API elements.
+    The node coordinate index is kept in `node_index`, by default next to the extract.
+    """
+    stat = os.stat(path)
+    extract = {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    south, west, north, east = bbox
+    region = (south - NODE_MARGIN, west - NODE_MARGIN, north + NODE_MARGIN, east + NODE_MARGIN)
+
+    index = NodeIndex(node_index or path + ".nodes.sqlite")
+    try:
+        indexing = not index.covers(extract, region)
+        if indexing:
+            logging.info("Indexing nodes of %s", path)
+            index.reset()
+        else:
+            logging.info("Reusing node index of %s", path)
+
+        read = read_osm_pbf if path.endswith(".pbf") else read_osm_xml
+        nodes, ways = [], []
+        for kind, element_id, *element in read(path, nodes=indexing):
+            if kind == NODE:
+                if inside(region, *element):
+                    nodes.append((element_id, *element))
+                    if len(nodes) >= BATCH_SIZE:
+                        index.add(nodes)
+                        nodes = []
+                continue
+
+            if indexing:
+                # every node comes before the first way
+                index.add(nodes)
+                index.complete(extract, region)
+                indexing, nodes = False, []
+            ways.append((element_id, *element))
+            if len(ways) >= BATCH_SIZE:
+                yield from resolve_ways(index, ways, bbox)
+                ways = []
+
+        if indexing:
+            index.add(nodes)
+            index.complete(extract, region)
+        yield from resolve_ways(index, ways, bbox)
+    finally:
+        index.close()
@@ -0,0 +1,79 @@
+# Sharded building queries to the Overpass API.
+#
+# A large region is split into a quadtree of shards, each fetched with its own query and parsed
+# incrementally, so no single query is big enough to time out or to hold the whole region in memory.
+
+import json
+import re
+from collections.abc import Iterator
+
+import ijson
+import requests
+
+BBox = tuple[float, float, float, float]  # south, west, north, east
+
+REMARK = re.compile(rb'"remark"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+class OverpassError(Exception):
+    """The query failed midway, e.g. it ran out of time or memory on the server."""
+
+
+def split_bbox(bbox: BBox) -> list[BBox]:
+    """Splits a bounding box into its four quadrants."""
+    south, west, north, east = bbox
+    lat, lon = (south + north) / 2, (west + east) / 2
+    return [(south, west, lat, lon), (south, lon, lat, east), (lat, west, north, lon), (lat, lon, north, east)]
+
+
+def shard_bbox(bbox: BBox, shard_size: float) -> list[BBox]:
+    """Quadtree leaves of `bbox` whose sides are at most `shard_size` degrees."""
+    south, west, north, east = bbox
+    if north - south <= shard_size and east - west <= shard_size:
+        return [bbox]
+    return [leaf for quadrant in split_bbox(bbox) for leaf in shard_bbox(quadrant, shard_size)]
+
+
+def buildings_query(bbox: BBox, timeout: int) -> str:
+    return f"""
+        [out:json][timeout:{timeout}];
+        (
+        way["building"]({",".join(str(x) for x in bbox)});
+        );
+        out geom;
+        """
+
+
+def remark_error(content: bytes) -> str | None:
+    """The error remark at the end of an Overpass response body, if the query failed."""
+    match = REMARK.search(content[-(1 << 16) :])
+    if match is None:
+        return None
+    remark = json.loads(match.group(1))
+    return remark if "error" in remark else None
+
+
+def stream_elements(
+    rsp: requests.Response, chunk_size: int = 1 << 16, body: list[bytes] | None = None
+) -> Iterator[dict]:
+    """
+    Yields the elements of an Overpass JSON response as they are parsed, without loading the whole body.
+    Overpass reports queries that fail midway in a "remark" after the elements, with a 200 status,
+    so that is checked once the body is read and raised as an OverpassError.
+    The chunks read are appended to `body` if given, to cache the response once it is known to be complete.
+    """
+    elements = ijson.sendable_list()
+    parser = ijson.items_coro(elements, "elements.item", use_float=True)
+    tail = b""
+    for chunk in rsp.iter_content(chunk_size):
+        if body is not None:
+            body.append(chunk)
+        parser.send(chunk)
+        yield from elements
+        del elements[:]
+        tail = tail[-chunk_size:] + chunk
+    parser.close()
+    yield from elements
+
+    if (error := remark_error(tail)) is not None:
+        raise OverpassError(error)
@@ -1,32 +1,93 @@
-from typing import List
+from collections import defaultdict
+from collections.abc import Callable, Container, Iterable, Iterator, Sequence
 
 import requests
 import json
+import ijson
+import numpy as np
 from json import JSONEncoder
 
 from dataclasses import dataclass, asdict, is_dataclass
 from datetime import datetime
 import logging
+import os
+import threading
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
-from functools import cmp_to_key
-
-from src.building_insight import BuildingInsight, Bounds, Coordinate
+from src.building_insight import BuildingInsight, Bounds, Coordinate, CoordinateArray
 from src.panel_insight import PanelInsight
-from src.solar_insight import SolarInsight, SolarPotential
+from src.solar_insight import SOLAR_POTENTIAL_FIELDS, SolarInsight, SolarPotential
 from src.address_insight import AddressInsight
 
-from src.encoder import dump_stage_result
-from src.decorator import rate_limiter
+from src.encoder import dump_stage_result, iter_stage_result, StageCheckpoint
+from src.decorator import TokenBucket
+from src.cache import ResponseCache
+from src.geocode import GeocodeCache
+from src.concurrency import AdaptiveConcurrency, imap_unordered
 from src.map import Map
+from src.tiles import tile_grid
+from src.osm_extract import extract_buildings
+from src.overpass import BBox, OverpassError, buildings_query, shard_bbox, split_bbox, stream_elements
+from src.geometry import footprint_hash, footprint_metrics
+from src.spatial import BoxIndex, BuildingIndex, NO_BUILDING
+from src.ranking import DEFAULT_WEIGHTS, key_columns, rank_order, scores
+
+
+DEFAULT_RATE_LIMITS = {
+    "detection": {"calls": 300, "period": 60},
+    "solar": {"calls": 60, "period": 60},
+    "geocode": {"calls": 300, "period": 60},
+}
+
+DEFAULT_CONCURRENCY = {
+    "overpass": {"initial": 2, "maximum": 2},  # Overpass allows a couple of concurrent queries per IP
+    "detection": {"initial": 2},  # up to panel_detection_concurrency
+    "solar": {"initial": 1, "maximum": 4},
+    "geocode": {"initial": 2, "maximum": 8},
+}
+
+DEFAULT_OVERPASS = {
+    "url": "https://overpass-api.de/api/interpreter",
+    "shard_size": 0.05,  # degrees, largest side of a shard
+    "timeout": 180,  # seconds, per shard query
+    "max_splits": 3,  # times a failing shard is split again before giving up
+}
+
+
+def geocode_ok(rsp: requests.Response) -> bool:
+    """Whether a Geocoding API response holds results, it reports quota and key errors with an HTTP 200 status."""
+    if rsp.status_code != 200:
+        return False
+    try:
+        return rsp.json().get("status") == "OK"
+    except (json.JSONDecodeError, AttributeError):
+        return False
 
 
 @dataclass
 class Config:
     google_cloud_key: str
     panel_detection_service: str
-    bot_corner: List[float]
-    top_corner: List[float]
+    bot_corner: list[float]
+    top_corner: list[float]
     confidence_threshold: float
+    panel_detection_concurrency: int = 1
+    panel_detection_mode: str = "building"  # "building" or "grid"
+    panel_detection_tile_overlap: float = 0.0
+    cache: dict | None = None  # ResponseCache options, responses are not cached if missing
+    rate_limits: dict | None = None  # per API overrides of DEFAULT_RATE_LIMITS
+    rate_limit_dir: str | None = None  # share rate limits with other processes through files in this directory
+    concurrency: dict | None = None  # per API overrides of DEFAULT_CONCURRENCY
+    geometry_dtype: str = "float64"  # "float32" halves building geometry memory, but snaps coordinates to ~0.4 m
+    rank_weights: dict | None = None  # ranking criterion -> weight, see src/ranking.py CRITERIA
+    solar_fields: list[str] | None = None  # SolarPotential fields kept from the Solar API, all if missing
+    overpass: dict | None = None  # overrides of DEFAULT_OVERPASS
+    osm_extract: str | None = None  # local .osm or .osm.pbf extract read instead of querying Overpass
+    osm_node_index: str | None = None  # node coordinate index of the extract, next to it if missing
+    map_simplify: float | None = 0.000005  # degrees footprints are simplified within on maps, about 50 cm
+    geocode_cache: dict | None = None  # GeocodeCache options, addresses are only shared within a run if missing
+    solar_skip_known_buildings: bool = False  # reuse the Solar API result of a building box holding the centroid
 
 
 class SolarPipeline:
@@ -34,7 +95,33 @@ class SolarPipeline:
         for key, value in config.__dict__.items():
             setattr(self, key, value)
 
-    def fetch_buildings(self, filename="buildings.json") -> List[BuildingInsight]:
+        self.response_cache = ResponseCache(**(self.cache or {}))
+        self.geocode_cache = GeocodeCache(**(self.geocode_cache or {}))
+
+        if unknown := set(self.solar_fields or ()) - set(SOLAR_POTENTIAL_FIELDS):
+            raise ValueError(f"Unknown solar_fields {sorted(unknown)}, expected some of {list(SOLAR_POTENTIAL_FIELDS)}")
+
+    def token_bucket(self, api: str) -> TokenBucket:
+        """Token bucket rate limit for the given API, configured by `rate_limits` in config.yaml."""
+        limits = {**DEFAULT_RATE_LIMITS[api], **(self.rate_limits or {}).get(api, {})}
+        state_file = None
+        if self.rate_limit_dir:
+            os.makedirs(self.rate_limit_dir, exist_ok=True)
+            state_file = os.path.join(self.rate_limit_dir, f"{api}.bucket")
+        return TokenBucket(**limits, state_file=state_file)
+
+    def adaptive_concurrency(self, api: str) -> AdaptiveConcurrency:
+        """
+        AIMD limit on concurrent requests to the given API, configured by `concurrency` in config.yaml,
+        taking a token of the API's rate limit for every attempt if it has one.
+        """
+        options = {**DEFAULT_CONCURRENCY[api], **(self.concurrency or {}).get(api, {})}
+        if api == "detection":
+            options.setdefault("maximum", self.panel_detection_concurrency)
+        rate_limit = self.token_bucket(api) if api in DEFAULT_RATE_LIMITS else None
+        return AdaptiveConcurrency(api, **options, rate_limit=rate_limit)
+
+    def fetch_buildings(self, filename="buildings.json") -> list[BuildingInsight]:
         """
         Fetches buildings from OpenStreetMap using Overpass API within the given bounding box.
         :param filename: Optional filename to save the response
@@ -43,156 +130,397 @@ class SolarPipeline:
         logging.info("Running buildings stage")
 
         bbox = (*self.bot_corner, *self.top_corner)
-        query = f"""
-        [out:json];
-        (
-        way["building"]({",".join(str(x) for x in bbox)});
-        );
-        out geom;
-        """
-
-        logging.info("Requesting Overpass API for buildings insights")
-        resp = requests.get("https://overpass-api.de/api/interpreter", params={"data": query})
-        try:
-            resp.raise_for_status()
-        except requests.exceptions.HTTPError:
-            logging.error("Failed requesting Overpass API: %d Error:\n %s", resp.status_code, resp.text)
-            raise ValueError(f"Failed requesting Overpass API: Error {resp.status_code}\n {resp.text}")
-
-        if resp.status_code != 200:
-            logging.error("Non 200 return code from Overpass API: %d Error:\n %s", resp.status_code, resp.text)
-            raise ValueError(f"Non 200 return code from Overpass API: Error {resp.status_code}\n {resp.text}")
-
-        try:
-            data = resp.json()
-        except json.JSONDecodeError as e:
-            logging.error("Failed to decode Overpass API JSON response:\n %s", e)
-            raise ValueError(f"Failed to decode Overpass API JSON response:\n {e}")
-
-        buildings = []
-        for el in data["elements"]:
-            if "nodes" in el:
-                b = BuildingInsight(
-                    building_id=el.get("id", ""),
-                    bounds=Bounds(**el.get("bounds", {"minlat": 0, "minlon": 0, "maxlat": 0, "maxlon": 0})),
-                    geometry=[Coordinate(**c) for c in el.get("geometry", [])],
-                    tags=el.get("tags", {}),
-                )
-                buildings.append(b)
+        if self.osm_extract:
+            logging.info("Reading buildings from the %s extract", self.osm_extract)
+            ways = extract_buildings(self.osm_extract, bbox, self.osm_node_index)
+        else:
+            ways = self.overpass_buildings(bbox)
+        buildings = self.make_buildings(ways)
+        # shards complete in any order
+        buildings.sort(key=lambda b: b.building_id)
 
         if filename:
             logging.info("Saving buildings insights to %s", filename)
             dump_stage_result("buildings", filename, buildings)
 
-        m = Map(self.top_corner[0], self.top_corner[1])
-        for b in buildings:
-            m.placeBoundingBox([(c.lat, c.lon) for c in b.geometry])
-        m.save("buildings.html")
-        logging.info("Saved map with buildings to buildings.html")
-
         return buildings
 
-    def filter_solar_panels(self, buildings: List[BuildingInsight], filename="panels.json") -> List[PanelInsight]:
+    def render_map(
+        self,
+        buildings: Iterable[BuildingInsight],
+        filename="buildings.html",
+        solar_insights: Iterable[SolarInsight] | None = None,
+    ) -> None:
+        """
+        Saves an interactive map of the building footprints, as one GeoJSON layer
+        simplified within `map_simplify` degrees, with the panels of `solar_insights` clustered over it if given.
+        """
+        logging.info("Rendering buildings map")
+        m = Map((self.bot_corner[0] + self.top_corner[0]) / 2, (self.bot_corner[1] + self.top_corner[1]) / 2)
+        m.placeBuildings(buildings, self.map_simplify)
+        if solar_insights is not None:
+            m.clusterSolarPanels(s.solar_potential.solar_panels for s in solar_insights)
+        m.save(filename)
+        logging.info("Saved map with buildings to %s", filename)
+
+    def overpass_buildings(self, bbox: BBox) -> Iterator[dict]:
+        """
+        Building ways within bbox from the Overpass API.
+        The box is split into a quadtree of shards fetched concurrently, within the `overpass` concurrency limit,
+        and parsed as they stream in. Shards failing on the server are split again, and ways crossing
+        shard borders are only yielded once.
+        """
+        options = {**DEFAULT_OVERPASS, **(self.overpass or {})}
+        concurrency = self.adaptive_concurrency("overpass")
+
+        # cached by `read_shard` once the whole body is streamed and known to be complete
+        @self.response_cache.cached("overpass", cacheable=None)
+        @concurrency.streaming
+        def request_overpass(query: str) -> requests.Response:
+            return requests.get(options["url"], params={"data": query}, stream=True, timeout=options["timeout"] + 60)
+
+        def fetch_shard(shard: BBox) -> tuple[BBox, str, requests.Response | None]:
+            # only waits for the response headers, its body is streamed by `read_shard`
+            query = buildings_query(shard, options["timeout"])
+            try:
+                return shard, query, request_overpass(query)
+            except requests.exceptions.RequestException as e:
+                logging.warning("Failed requesting Overpass API for shard %s: %s", shard, e)
+                return shard, query, None
+
+        def read_shard(query: str, resp: requests.Response) -> Iterator[dict]:
+            # raises OverpassError once the body is read if the query failed on the server
+            with resp:
+                body = [] if self.response_cache.enabled else None
+                for el in stream_elements(resp, body=body):
+                    if "nodes" in el:
+                        yield el
+            if body is not None:
+                self.response_cache.store("overpass", (query,), resp, b"".join(body))
+
+        def discard(result: tuple[BBox, str, requests.Response | None]) -> None:
+            if result[2] is not None:
+                result[2].close()
+
+        shards = shard_bbox(bbox, options["shard_size"])
+        logging.info("Requesting Overpass API for buildings insights in %d shards", len(shards))
+        seen = set()
+        for splits in range(options["max_splits"] + 1):
+            failed = []
+            for shard, query, resp in imap_unordered(fetch_shard, shards, concurrency.maximum, discard):
+                if resp is None:
+                    failed.append(shard)
+                    continue
+                if resp.status_code == 504:
+                    logging.warning("Overpass API gateway timeout for shard %s", shard)
+                    resp.close()
+                    failed.append(shard)
+                    continue
+                if not resp.ok:
+                    with resp:
+                        logging.error("Failed requesting Overpass API: %d Error:\n %s", resp.status_code, resp.text)
+                    raise ValueError(f"Failed requesting Overpass API: Error {resp.status_code}\n {resp.text}")
+                try:
+                    # ways of a shard failing midway were yielded already, the `seen` ids skip them on retry
+                    for el in read_shard(query, resp):
+                        if el["id"] not in seen:
+                            seen.add(el["id"])
+                            yield el
+                except (OverpassError, requests.exceptions.RequestException) as e:
+                    logging.warning("Overpass API query failed for shard %s: %s", shard, e)
+                    failed.append(shard)
+                except ijson.JSONError as e:
+                    logging.error("Failed to decode Overpass API JSON response:\n %s", e)
+                    raise ValueError(f"Failed to decode Overpass API JSON response:\n {e}")
+
+            if len(failed) == 0:
+                break
+            if splits == options["max_splits"]:
+                raise ValueError(f"Overpass API queries failed for {len(failed)} shards after {splits} splits")
+            logging.info("Splitting %d failed shards", len(failed))
+            shards = [quadrant for shard in failed for quadrant in split_bbox(shard)]
+
+        self.response_cache.log_stats("overpass")
+
+    def make_buildings(self, ways: Iterable[dict]) -> list[BuildingInsight]:
+        """
+        BuildingInsights from Overpass-style way elements (id, geometry, optional bounds and tags).
+        Every footprint lives in one shared coordinates buffer, each building geometry is a view into it.
+        """
+        ids, bounds, tags, lengths, flat = [], [], [], [], array("d")
+        for el in ways:
+            geometry = el.get("geometry", [])
+            ids.append(el.get("id", ""))
+            bounds.append(el.get("bounds"))
+            tags.append(el.get("tags", {}))
+            lengths.append(len(geometry))
+            for c in geometry:
+                flat.extend((c["lat"], c["lon"]))
+
+        coords = np.asarray(flat, dtype=self.geometry_dtype).reshape(-1, 2)
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # centroids, areas and missing bounds of every footprint in one vectorized pass
+        metrics = footprint_metrics(coords, offsets)
+
+        return [
+            BuildingInsight(
+                building_id=ids[i],
+                bounds=Bounds(**bounds[i]) if bounds[i] else Bounds(*computed_bounds),
+                geometry=CoordinateArray(coords[offsets[i] : offsets[i + 1]]),
+                tags=tags[i],
+                centroid=Coordinate(lat=lat, lon=lon),
+                area=area,
+            )
+            for i, ((lat, lon), area, computed_bounds) in enumerate(
+                zip(metrics.centroids.tolist(), metrics.areas.tolist(), metrics.bounds.tolist())
+            )
+        ]
+
+    def diff_buildings(self, buildings: list[BuildingInsight], previous_file: str) -> set:
+        """
+        Compares the buildings with the buildings stage of a previous run by way id and footprint hash.
+        :param buildings: List of BuildingInsights
+        :param previous_file: buildings stage file of a previous run over the region
+        :return: building_ids whose footprint is unchanged, so the later stages can reuse their previous results
+        """
+        _, previous_buildings = iter_stage_result(previous_file, BuildingInsight)
+        previous = {b.building_id: footprint_hash(b.geometry.array) for b in previous_buildings}
+        current = {b.building_id: footprint_hash(b.geometry.array) for b in buildings}
+
+        unchanged = {i for i, h in current.items() if previous.get(i) == h}
+        logging.info(
+            "%d buildings unchanged since %s, %d new, %d modified and %d removed",
+            len(unchanged),
+            previous_file,
+            len(current.keys() - previous.keys()),
+            len(current.keys() & previous.keys()) - len(unchanged),
+            len(previous.keys() - current.keys()),
+        )
+        return unchanged
+
+    def filter_solar_panels(
+        self,
+        buildings: list[BuildingInsight],
+        filename="panels.json",
+        previous: str | None = None,
+        unchanged: Container = (),
+    ) -> list[PanelInsight]:
         """
         Filters buildings to only include those with solar panels.
         :param buildings: List of BuildingInsights
+        :param previous: panels stage file of a previous run, whose results are reused for the unchanged buildings
+        :param unchanged: building_ids unchanged since the previous run, see diff_buildings
         :return: List of PanelInsight
         """
         logging.info("Running panels stage")
-        # return buildings
-
-        def has_panel(detection: dict, building: BuildingInsight) -> bool:
-            # get center point of the detection
-            center_lat = 0
-            center_lon = 0
-            for corner in detection["corners"]:
-                center_lat += corner[0]
-                center_lon += corner[1]
-            center_lat /= len(detection["corners"])
-            center_lon /= len(detection["corners"])
-
-            # check if detection center is inside building bounds
-            if (building.bounds.minlat <= center_lat <= building.bounds.maxlat) and (
-                building.bounds.minlon <= center_lon <= building.bounds.maxlon
-            ):
-                return True
-            return False
-
-        @rate_limiter(calls=300, period=60)
-        def request_detection(b: BuildingInsight) -> requests.Response:
-            return requests.get(
-                f"{self.panel_detection_service}/predict_coordinates?lat={b.centroid.lat}&long={b.centroid.lon}"
-            )
 
-        panel_insights = []
-        for b in buildings:
-            # get solar panel detections for each building
-            rsp = request_detection(b)
+        with StageCheckpoint("panels", filename, PanelInsight, key=lambda p: p.building.building_id) as checkpoint:
+            if previous:
+                checkpoint.reuse(previous, unchanged)
+            for p in self.detect_solar_panels(buildings, skip=checkpoint):
+                checkpoint.add(p)
+            return checkpoint.finish(b.building_id for b in buildings)
+
+    def detect_solar_panels(self, buildings: list[BuildingInsight], skip: Container = ()) -> Iterator[PanelInsight]:
+        """
+        Requests the panel detection service for the buildings, yielding results as they complete.
+        :param buildings: List of BuildingInsights
+        :param skip: building_ids already processed
+        :return: Iterator of PanelInsight, in completion order
+        """
+        index = BuildingIndex(buildings)
+
+        def panel_buildings(detections: list) -> np.ndarray:
+            # indexes of the buildings whose footprint holds a confident detection
+            confident = [d for d in detections if d["confidence"] >= self.confidence_threshold]
+            assigned = index.assign(confident)
+            return np.unique(assigned[assigned != NO_BUILDING])
+
+        concurrency = self.adaptive_concurrency("detection")
+
+        @self.response_cache.cached("detection")
+        @concurrency
+        def request_detection(lat: float, lon: float) -> requests.Response:
+            return requests.get(f"{self.panel_detection_service}/predict_coordinates?lat={lat}&long={lon}")
+
+        def detect(lat: float, lon: float) -> dict | None:
+            # get solar panel detections for the tile centered at lat, lon
+            try:
+                rsp = request_detection(lat, lon)
+            except requests.exceptions.RequestException as e:
+                logging.error("Failed requesting panel detection service for %s %s:\n %s", lat, lon, e)
+                return None
             try:
                 rsp.raise_for_status()
-                rsp_json = rsp.json()
+                return rsp.json()
             except requests.exceptions.HTTPError as e:
                 logging.error(
                     "Failed requesting panel detection service for %s %s: %d Error:\n %s",
-                    b.centroid.lat,
-                    b.centroid.lon,
+                    lat,
+                    lon,
                     rsp.status_code,
                     e,
                 )
-                continue
+                return None
             except json.JSONDecodeError as e:
                 logging.error("Failed to decode panel detection service JSON response:\n %s", e)
-                continue
-
-            detection_image_url = rsp_json["image"]
-
-            w_panel = False
-            for detection in rsp_json["detections"]:
-                if detection["confidence"] < self.confidence_threshold:
-                    continue
-
-                if has_panel(detection, b):
-                    w_panel = True
-                    break
+                return None
 
-            panel_insights.append(
-                PanelInsight(
-                    building=b,
-                    has_panel=w_panel,
-                    detection_image_url=detection_image_url,
-                )
+        def detect_building(i: int) -> PanelInsight | None:
+            # get solar panel detections for each building
+            b = buildings[i]
+            rsp_json = detect(b.centroid.lat, b.centroid.lon)
+            if rsp_json is None:
+                return None
+
+            return PanelInsight(
+                building=b,
+                has_panel=i in panel_buildings(rsp_json["detections"]),
+                detection_image_url=rsp_json["image"],
             )
 
-        if filename:
-            logging.info("Saving panel buildings insights to %s", filename)
-            dump_stage_result("panels", filename, panel_insights)
-
-        return panel_insights
-
-    def fetch_solar_data(self, buildings: List[PanelInsight], filename="solar.json") -> List[PanelInsight]:
+        def detect_grid(executor: ThreadPoolExecutor) -> Iterator[PanelInsight]:
+            # cover the buildings with a grid of tiles, detect every tile exactly once
+            # and join the detections back to the buildings each tile overlaps
+            if len(pending) == 0:
+                return
+
+            grid = tile_grid(
+                Bounds(
+                    minlat=min(buildings[i].bounds.minlat for i in pending),
+                    minlon=min(buildings[i].bounds.minlon for i in pending),
+                    maxlat=max(buildings[i].bounds.maxlat for i in pending),
+                    maxlon=max(buildings[i].bounds.maxlon for i in pending),
+                ),
+                overlap=self.panel_detection_tile_overlap,
+            )
+            # every building waits for the tiles covering it, and the one its image is taken from
+            buildings_tiles, tile_buildings = {}, defaultdict(list)
+            for i in pending:
+                b = buildings[i]
+                buildings_tiles[i] = {*grid.tiles_overlapping(b.bounds), grid.tile_of(b.centroid.lat, b.centroid.lon)}
+                for t in buildings_tiles[i]:
+                    tile_buildings[t].append(i)
+            waiting = {i: len(building_tiles) for i, building_tiles in buildings_tiles.items()}
+            logging.info("Covering %d buildings with %d detection tiles", len(pending), len(tile_buildings))
+
+            def detect_tile(tile: tuple) -> dict | None:
+                center = grid.center(*tile)
+                return detect(center.lat, center.lon)
+
+            futures = {executor.submit(detect_tile, t): t for t in sorted(tile_buildings)}
+            images = {}  # image of each completed tile, None if its detection failed
+            w_panel = np.zeros(len(buildings), dtype=bool)
+            # buildings are yielded as soon as the last tile covering them completes
+            for future in as_completed(futures):
+                tile = futures.pop(future)
+                tile_detections = future.result()
+                images[tile] = None if tile_detections is None else tile_detections["image"]
+                if tile_detections is not None:
+                    w_panel[panel_buildings(tile_detections["detections"])] = True
+
+                for i in tile_buildings.pop(tile):
+                    waiting[i] -= 1
+                    if waiting[i] > 0:
+                        continue
+                    b = buildings[i]
+                    if any(images[t] is None for t in buildings_tiles.pop(i)):
+                        logging.error("Skipping building %s, a detection tile covering it failed", b.building_id)
+                        continue
+
+                    yield PanelInsight(
+                        building=b,
+                        has_panel=bool(w_panel[i]),
+                        detection_image_url=images[grid.tile_of(b.centroid.lat, b.centroid.lon)],
+                    )
+
+        pending = [i for i, b in enumerate(buildings) if b.building_id not in skip]
+        logging.info(
+            "Requesting panel detection service for %d buildings with up to %d concurrent requests",
+            len(pending),
+            concurrency.maximum,
+        )
+        with ThreadPoolExecutor(max_workers=concurrency.maximum) as executor:
+            if self.panel_detection_mode == "grid":
+                yield from detect_grid(executor)
+            else:
+                futures = [executor.submit(detect_building, i) for i in pending]
+                for future in as_completed(futures):
+                    if (p := future.result()) is not None:
+                        yield p
+
+        self.response_cache.log_stats("detection")
+
+    def fetch_solar_data(
+        self,
+        buildings: list[PanelInsight],
+        filename="solar.json",
+        previous: str | None = None,
+        unchanged: Container = (),
+    ) -> list[SolarInsight]:
         """
         Fetches solar data for each building with solar panels.
         :param buildings: List of PanelInsights
+        :param previous: solar stage file of a previous run, whose results are reused for the unchanged buildings
+        :param unchanged: building_ids unchanged since the previous run, see diff_buildings
         :return: List of SolarInsights
         """
         logging.info("Running solar stage")
-        # return buildings
 
-        @rate_limiter(calls=60, period=60)
-        def request_solar(b: PanelInsight) -> requests.Response:
+        with StageCheckpoint(
+            "solar", filename, SolarInsight, key=lambda s: s.panel_insight.building.building_id
+        ) as checkpoint:
+            if previous:
+                checkpoint.reuse(previous, unchanged)
+            for s in self.request_solar_data(buildings, skip=checkpoint):
+                checkpoint.add(s)
+            return checkpoint.finish(b.building.building_id for b in buildings)
+
+    def request_solar_data(self, buildings: Iterable[PanelInsight], skip: Container = ()) -> Iterator[SolarInsight]:
+        """
+        Requests the Google Solar API for each building without solar panels, as the buildings come in.
+        :param buildings: Iterable of PanelInsights
+        :param skip: building_ids already processed
+        :return: Iterator of SolarInsights
+        """
+        concurrency = self.adaptive_concurrency("solar")
+
+        @self.response_cache.cached("solar")
+        @concurrency
+        def request_solar(lat: float, lon: float) -> requests.Response:
             return requests.get(
                 "https://solar.googleapis.com/v1/buildingInsights:findClosest?"
-                f"location.latitude={b.building.centroid.lat}"
-                f"&location.longitude={b.building.centroid.lon}"
+                f"location.latitude={lat}"
+                f"&location.longitude={lon}"
                 f"&requiredQuality=MEDIUM&key={self.google_cloud_key}"
             )
 
-        solar_insights = []
-        for b in buildings:
-            if b.has_panel:
-                continue
+        # parsed results by Google building, shared in memory by the OSM buildings resolving to the same one,
+        # stage files still hold one copy per building
+        potentials = {}
+        known_buildings = BoxIndex()
+        counts = {"shared": 0, "skipped": 0}
+        lock = threading.Lock()
+
+        def fetch(b: PanelInsight) -> SolarInsight | None:
+            if self.solar_skip_known_buildings:
+                with lock:
+                    potential = known_buildings.find(b.building.centroid.lat, b.building.centroid.lon)
+                    counts["skipped"] += potential is not None
+                if potential is not None:
+                    return SolarInsight(panel_insight=b, solar_potential=potential)
 
-            rsp = request_solar(b)
+            try:
+                rsp = request_solar(b.building.centroid.lat, b.building.centroid.lon)
+            except requests.exceptions.RequestException as e:
+                logging.error(
+                    "Failed requesting Google Solar API for %s %s:\n %s",
+                    b.building.centroid.lat,
+                    b.building.centroid.lon,
+                    e,
+                )
+                return None
             try:
                 rsp.raise_for_status()
             except requests.exceptions.HTTPError:
@@ -203,59 +531,106 @@ class SolarPipeline:
                     rsp.status_code,
                     rsp.text,
                 )
-                continue
+                return None
 
             if rsp.status_code != 200:
                 logging.error("Non 200 return code from Google Solar API: %d Error:\n %s", rsp.status_code, rsp.text)
-                continue
+                return None
 
             try:
                 rsp_json = rsp.json()
             except json.JSONDecodeError as e:
                 logging.error("Failed to decode Google Solar API JSON response:\n %s", e)
-                continue
-
-            solar_insight = SolarInsight(
-                panel_insight=b,
-                solar_potential=SolarPotential.from_json(rsp_json),
-            )
-
-            solar_insights.append(solar_insight)
-
-        if filename:
-            logging.info("Saving solar data insights to %s", filename)
-            dump_stage_result("solar", filename, solar_insights)
-
-        return solar_insights
-
-    def rank(self, solar_insights: List[SolarInsight], filename="rank.json") -> List[SolarInsight]:
+                return None
+
+            name = rsp_json.get("name")
+            with lock:
+                potential = potentials.get(name)
+                counts["shared"] += potential is not None
+            if potential is None:
+                potential = SolarPotential.from_json(rsp_json, self.solar_fields)
+                if name is not None:
+                    with lock:
+                        if name not in potentials and potential.building_bounds is not None:
+                            known_buildings.add(potential.building_bounds, potential)
+                        potential = potentials.setdefault(name, potential)
+
+            return SolarInsight(panel_insight=b, solar_potential=potential)
+
+        pending = (b for b in buildings if not b.has_panel and b.building.building_id not in skip)
+        for solar_insight in imap_unordered(fetch, pending, concurrency.maximum):
+            if solar_insight is not None:
+                yield solar_insight
+
+        logging.info(
+            "Shared %d Solar API results between buildings resolving to the same Google building, skipped %d requests",
+            counts["shared"],
+            counts["skipped"],
+        )
+        self.response_cache.log_stats("solar")
+
+    def stream_solar_data(
+        self,
+        buildings: list[BuildingInsight],
+        panels_filename="panels.jsonl",
+        solar_filename="solar.jsonl",
+        previous_panels: str | None = None,
+        previous_solar: str | None = None,
+        unchanged: Container = (),
+    ) -> list[SolarInsight]:
         """
-        Ranks the solar insights based on the yearly energy DC kWh.
-        :param solar_insights: List of SolarInsights
-        :return: List of SolarInsights sorted by yearly energy DC kWh
+        Runs the panels and solar stages as one pipeline: each building is sent to the Solar API
+        as soon as its panel detection completes, while the remaining detections carry on.
+        :param buildings: List of BuildingInsights
+        :param previous_panels: panels stage file of a previous run, reused for the unchanged buildings
+        :param previous_solar: solar stage file of a previous run, reused for the unchanged buildings
+        :param unchanged: building_ids unchanged since the previous run, see diff_buildings
+        :return: List of SolarInsights
         """
-
-        def cmp_insights(insight1: SolarInsight, insight2: SolarInsight) -> int:
-            first = insight1.solar_potential.solar_panel_configs
-            second = insight2.solar_potential.solar_panel_configs
-            if len(first) == 0 and len(second) == 0:
-                return 0
-            if len(first) == 0:
-                return -1
-            if len(second) == 0:
-                return 1
-
-            energy1 = first[0].yearly_energy_dc_kwh
-            energy2 = second[0].yearly_energy_dc_kwh
-            if energy1 > energy2:
-                return 1
-            elif energy1 < energy2:
-                return -1
-            else:
-                return 0
+        logging.info("Running panels and solar stages")
+
+        with (
+            StageCheckpoint(
+                "panels", panels_filename, PanelInsight, key=lambda p: p.building.building_id
+            ) as panels_checkpoint,
+            StageCheckpoint(
+                "solar", solar_filename, SolarInsight, key=lambda s: s.panel_insight.building.building_id
+            ) as solar_checkpoint,
+        ):
+            if previous_panels:
+                panels_checkpoint.reuse(previous_panels, unchanged)
+            if previous_solar:
+                solar_checkpoint.reuse(previous_solar, unchanged)
+
+            def panels() -> Iterator[PanelInsight]:
+                # buildings resumed from the panels checkpoint flow downstream first
+                yield from list(panels_checkpoint.results.values())
+                for p in self.detect_solar_panels(buildings, skip=panels_checkpoint):
+                    panels_checkpoint.add(p)
+                    yield p
+
+            for s in self.request_solar_data(panels(), skip=solar_checkpoint):
+                solar_checkpoint.add(s)
+
+            panels_checkpoint.finish(b.building_id for b in buildings)
+            return solar_checkpoint.finish(b.building_id for b in buildings)
+
+    def rank(
+        self, solar_insights: Iterable[SolarInsight], filename="rank.json", top_k: int | None = None
+    ) -> list[SolarInsight]:
+        """
+        Ranks the solar insights by a weighted score of the criteria in `rank_weights`,
+        by default the yearly energy DC kWh of the smallest panel configuration.
+        :param solar_insights: SolarInsights, a StageTable is ranked from its columns and only its top rows decoded
+        :param top_k: Only keep the K best insights
+        :return: List of SolarInsights sorted by decreasing score
+        """
+        if not isinstance(solar_insights, Sequence):
+            solar_insights = list(solar_insights)
 
         logging.info("Ranking insights")
-        ranked_solar_insights = sorted(solar_insights, key=cmp_to_key(cmp_insights), reverse=True)
+        score = scores(key_columns(solar_insights), self.rank_weights or DEFAULT_WEIGHTS)
+        ranked_solar_insights = [solar_insights[i] for i in rank_order(score, top_k).tolist()]
 
         if filename:
             logging.info("Saving ranked solar data insights to %s", filename)
@@ -266,58 +641,142 @@ class SolarPipeline:
 
         return ranked_solar_insights
 
-    def get_addresses(self, solar_insights: List[SolarInsight], filename="addresses.json") -> List[AddressInsight]:
+    def get_addresses(
+        self,
+        solar_insights: list[SolarInsight],
+        filename="addresses.json",
+        previous: str | None = None,
+        unchanged: Container = (),
+    ) -> list[AddressInsight]:
         """
         Fetches addresses for each building using Google Maps API.
         :param solar_insights: List of SolarInsights
+        :param previous: addresses stage file of a previous run, whose results are reused for the unchanged buildings
+        :param unchanged: building_ids unchanged since the previous run, see diff_buildings
         :return: List of SolarInsights with addresses
         """
         logging.info("Running address stage")
-        # return solar_insights
 
-        @rate_limiter(calls=300, period=60)
+        with StageCheckpoint(
+            "addresses", filename, AddressInsight, key=lambda a: a.solar_insight.panel_insight.building.building_id
+        ) as checkpoint:
+            if previous:
+                checkpoint.reuse(previous, unchanged)
+            for a in self.request_addresses(solar_insights, skip=checkpoint):
+                checkpoint.add(a)
+            return checkpoint.finish(s.panel_insight.building.building_id for s in solar_insights)
+
+    def request_addresses(
+        self, solar_insights: Iterable[SolarInsight], skip: Container = ()
+    ) -> Iterator[AddressInsight]:
+        """
+        Reverse geocodes each building with the Google Maps Geocoding API, as the buildings come in.
+        :param solar_insights: Iterable of SolarInsights
+        :param skip: building_ids already processed
+        :return: Iterator of AddressInsights
+        """
+        concurrency = self.adaptive_concurrency("geocode")
+
+        @self.response_cache.cached("geocode", cacheable=geocode_ok)
+        @concurrency
         def request_geocode(lat: float, lon: float) -> requests.Response:
             return requests.get(
                 f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lon}&key={self.google_cloud_key}"
             )
 
-        addresses = []
-        for s in solar_insights:
-            rsp = request_geocode(s.panel_insight.building.centroid.lat, s.panel_insight.building.centroid.lon)
+        # addresses being resolved, by Google building and by snapped point,
+        # so buildings sharing either wait for the first request instead of making their own
+        in_flight = {}
+        counts = {"geocoded": 0}
+        lock = threading.Lock()
+
+        def once(key, resolve: Callable[[], str | None]) -> str | None:
+            with lock:
+                first = key not in in_flight
+                shared = in_flight.setdefault(key, Future())
+            if first:
+                try:
+                    shared.set_result(resolve())
+                except BaseException as e:
+                    # request errors are already handled by `reverse_geocode`, anything else is a bug,
+                    # raised here and in the buildings waiting on the key rather than leaving them blocked
+                    shared.set_exception(e)
+                    raise
+            return shared.result()
+
+        def fetch(s: SolarInsight) -> AddressInsight | None:
+            if (name := s.solar_potential.building_name) is not None:
+                address = once(("building", name), lambda: locate(s))
+            else:
+                address = locate(s)
+            return None if address is None else AddressInsight(solar_insight=s, address=address)
+
+        def locate(s: SolarInsight) -> str | None:
+            lat, lon = s.panel_insight.building.centroid.lat, s.panel_insight.building.centroid.lon
+            if (address := self.geocode_cache.nearest(lat, lon)) is not None:
+                return address
+            lat, lon = self.geocode_cache.snap(lat, lon)
+            return once(("point", lat, lon), lambda: reverse_geocode(lat, lon))
+
+        def reverse_geocode(lat: float, lon: float) -> str | None:
+            with lock:
+                counts["geocoded"] += 1
+            try:
+                rsp = request_geocode(lat, lon)
+            except requests.exceptions.RequestException as e:
+                logging.error("Failed requesting Google Maps Geocode API for %s %s:\n %s", lat, lon, e)
+                return None
             try:
                 rsp.raise_for_status()
             except requests.exceptions.HTTPError:
                 logging.error(
                     "Failed requesting Google Maps Geocode API for %s %s: %d Error:\n %s",
-                    s.panel_insight.building.centroid.lat,
-                    s.panel_insight.building.centroid.lon,
+                    lat,
+                    lon,
                     rsp.status_code,
                     rsp.text,
                 )
-                continue
+                return None
 
             if rsp.status_code != 200:
                 logging.error("Non 200 return code from Google Solar API: %d Error:\n %s", rsp.status_code, rsp.text)
-                continue
+                return None
 
             try:
                 rsp_json = rsp.json()
             except json.JSONDecodeError as e:
                 logging.error("Failed to decode Google Solar API JSON response:\n %s", e)
-                continue
-
-            if (
-                "results" not in rsp_json
-                or len(rsp_json["results"]) == 0
-                or "formatted_address" not in rsp_json["results"][0]
-            ):
-                addresses.append(AddressInsight(solar_insight=s, address=""))
-                continue
+                return None
 
-            addresses.append(AddressInsight(solar_insight=s, address=rsp_json["results"][0]["formatted_address"]))
-
-        if filename:
-            logging.info("Saving address data insights to %s", filename)
-            dump_stage_result("addresses", filename, addresses)
-
-        return addresses
+            # quota and key errors come with a 200 status too, no address is checkpointed for them
+            # so the building is geocoded again by the next run
+            status = rsp_json.get("status")
+            if status not in ("OK", "ZERO_RESULTS"):
+                logging.error(
+                    "Google Maps Geocode API failed for %s %s: %s %s",
+                    lat,
+                    lon,
+                    status,
+                    rsp_json.get("error_message", ""),
+                )
+                return None
+            # points without an address keep an empty one, and are not reused for the buildings around them
+            if len(rsp_json.get("results", [])) == 0 or "formatted_address" not in rsp_json["results"][0]:
+                return ""
+
+            address = rsp_json["results"][0]["formatted_address"]
+            self.geocode_cache.add(lat, lon, address)
+            return address
+
+        pending = (s for s in solar_insights if s.panel_insight.building.building_id not in skip)
+        for address_insight in imap_unordered(fetch, pending, concurrency.maximum):
+            if address_insight is not None:
+                yield address_insight
+
+        self.response_cache.log_stats("geocode")
+        logging.info(
+            "Geocode cache: %d addresses reused from within %s m, %d points geocoded",
+            self.geocode_cache.hits,
+            self.geocode_cache.radius,
+            counts["geocoded"],
+        )
@@ -0,0 +1,134 @@
+# Multi-criteria ranking of solar insights on vectorized key columns.
+
+from collections.abc import Sequence
+
+import numpy as np
+
+from src.columnar import NULL, OFFSETS, StageTable
+from src.solar_insight import SolarInsight
+
+CRITERIA = (
+    "energy",  # yearly DC energy of the smallest panel configuration, the original ranking
+    "max_energy",  # yearly DC energy of the largest panel configuration
+    "energy_per_panel",  # max_energy per panel of the largest configuration
+    "energy_per_area",  # max_energy per m² of max_array_area_meters_2
+    "sunshine_hours",  # max_sunshine_hours_year
+    "carbon_offset",  # kg of CO2 offset per year by max_energy
+)
+
+DEFAULT_WEIGHTS = {"energy": 1.0}
+
+
+def float_column(values: list) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def table_column(table: StageTable, path: str) -> np.ndarray:
+    """Numeric column of a stage table as floats, NaN where the value is missing."""
+    if path not in table.columns:
+        # not a numeric column, e.g. values of mixed types stored as JSON
+        raise KeyError(path)
+    column = np.asarray(table.column(path), dtype=np.float64)
+    if path + NULL in table.columns:
+        column = np.where(table.column(path + NULL), np.nan, column)
+    return column
+
+
+def table_keys(table: StageTable) -> dict[str, np.ndarray]:
+    """Criteria inputs read straight from the memory-mapped columns, without decoding any row."""
+    configs = "solar_potential.solar_panel_configs"
+    offsets = np.asarray(table.column(configs + OFFSETS))
+    has_configs = np.diff(offsets) > 0
+    first, last = offsets[:-1][has_configs], offsets[1:][has_configs] - 1
+
+    def config_column(field: str, rows: np.ndarray) -> np.ndarray:
+        column = np.full(len(offsets) - 1, np.nan)
+        column[has_configs] = table_column(table, f"{configs}[].{field}")[rows]
+        return column
+
+    return {
+        "first_energy": config_column("yearly_energy_dc_kwh", first),
+        "last_energy": config_column("yearly_energy_dc_kwh", last),
+        "last_panels": config_column("panels_count", last),
+        "area": table_column(table, "solar_potential.max_array_area_meters_2"),
+        "sunshine_hours": table_column(table, "solar_potential.max_sunshine_hours_year"),
+        "carbon_factor": table_column(table, "solar_potential.carbon_offset_kg"),
+    }
+
+
+def raw_keys(solar_insights: Sequence[SolarInsight]) -> dict[str, np.ndarray]:
+    """Per insight inputs of the criteria: first and last panel configuration, roof area and sunshine, carbon factor."""
+    if isinstance(solar_insights, StageTable):
+        try:
+            return table_keys(solar_insights)
+        except KeyError:
+            pass  # decode the rows instead
+
+    potentials = [s.solar_potential for s in solar_insights]
+    first = [p.solar_panel_configs[0] if p.solar_panel_configs else None for p in potentials]
+    last = [p.solar_panel_configs[-1] if p.solar_panel_configs else None for p in potentials]
+    return {
+        "first_energy": float_column([c and c.yearly_energy_dc_kwh for c in first]),
+        "last_energy": float_column([c and c.yearly_energy_dc_kwh for c in last]),
+        "last_panels": float_column([c and c.panels_count for c in last]),
+        "area": float_column([p.max_array_area_meters_2 for p in potentials]),
+        "sunshine_hours": float_column([p.max_sunshine_hours_year for p in potentials]),
+        "carbon_factor": float_column([p.carbon_offset_kg for p in potentials]),
+    }
+
+
+def key_columns(solar_insights: Sequence[SolarInsight]) -> dict[str, np.ndarray]:
+    """Every ranking criterion as a float array, NaN where an insight lacks the data."""
+    raw = raw_keys(solar_insights)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "energy": raw["first_energy"],
+            "max_energy": raw["last_energy"],
+            "energy_per_panel": raw["last_energy"] / raw["last_panels"],
+            "energy_per_area": raw["last_energy"] / raw["area"],
+            "sunshine_hours": raw["sunshine_hours"],
+            # carbon_offset_kg holds the API carbon offset factor, in kg per MWh
+            "carbon_offset": raw["last_energy"] / 1000 * raw["carbon_factor"],
+        }
+
+
+def scores(keys: dict[str, np.ndarray], weights: dict[str, float]) -> np.ndarray:
+    """
+    Weighted sum of the criteria, each scaled to [0, 1] over the insights that have it.
+    Missing criteria count as 0, and insights missing every weighted criterion score -inf.
+    """
+    unknown = set(weights) - set(CRITERIA)
+    if unknown:
+        raise ValueError(f"Unknown ranking criteria {sorted(unknown)}, expected some of {list(CRITERIA)}")
+
+    n = len(next(iter(keys.values())))
+    total = np.zeros(n)
+    available = np.zeros(n, dtype=bool)
+    for name, weight in weights.items():
+        column = np.where(np.isfinite(keys[name]), keys[name], np.nan)
+        finite = ~np.isnan(column)
+        if not finite.any():
+            continue
+        low, high = np.nanmin(column), np.nanmax(column)
+        scaled = (column - low) / (high - low) if high > low else np.ones(n)
+        total += weight * np.where(finite, scaled, 0.0)
+        available |= finite
+    return np.where(available, total, -np.inf)
+
+
+def rank_order(score: np.ndarray, top_k: int | None = None) -> np.ndarray:
+    """
+    Indices by decreasing score, ties keeping their input order.
+    With top_k only the best K are selected, with a partial selection instead of a full sort.
+    NaN scores rank last, tied with -inf.
+    """
+    score = np.where(np.isnan(score), -np.inf, score)
+    if top_k is not None and top_k < len(score):
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.argpartition(-score, top_k - 1)[:top_k]
+        # ties with the K-th score may straddle the cut, keep the earliest ones like a full sort would
+        threshold = score[candidates].min()
+        candidates = np.concatenate([np.flatnonzero(score > threshold), np.flatnonzero(score == threshold)])[:top_k]
+        return candidates[np.lexsort((candidates, -score[candidates]))]
+    return np.argsort(-score, kind="stable")
@@ -1,5 +1,11 @@
-from dataclasses import dataclass
-from src.building_insight import Coordinate
+import math
+from collections.abc import Container, Sequence
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+from src.building_insight import Bounds, Coordinate
+from src.encoder import register_decoder, register_encoder
 from src.panel_insight import PanelInsight
 
 # https://developers.google.com/maps/documentation/solar/reference/rest/v1/buildingInsights/findClosest#SolarPotential
@@ -29,6 +35,135 @@ class SolarPanel:
     segment_index: int
 
 
+# unknown orientations are stored as ""
+ORIENTATIONS = ("", "LANDSCAPE", "PORTRAIT", "SOLAR_PANEL_ORIENTATION_UNSPECIFIED")
+
+SOLAR_PANEL_DTYPE = np.dtype(
+    [
+        ("lat", np.float64),
+        ("lon", np.float64),
+        ("yearly_energy_dc_kwh", np.float64),
+        ("orientation", np.int8),  # index into ORIENTATIONS
+        ("segment_index", np.int32),  # -1 if missing
+    ]
+)
+
+
+def none_if_nan(v: float) -> float | None:
+    return None if math.isnan(v) else v
+
+
+class SolarPanelArray(Sequence):
+    """
+    Sequence of SolarPanels backed by a structured array with one record per panel,
+    as a building can have thousands of them.
+    SolarPanel objects are only created when items are accessed.
+    """
+
+    __slots__ = ("array",)
+
+    def __init__(self, panels=()):
+        """Wraps a SOLAR_PANEL_DTYPE array, or packs SolarPanels or their JSON stage dicts."""
+        if isinstance(panels, SolarPanelArray):
+            panels = panels.array
+        elif not isinstance(panels, np.ndarray):
+            panels = [
+                SolarPanelArray.record(
+                    p["center"]["lat"],
+                    p["center"]["lon"],
+                    p["yearly_energy_dc_kwh"],
+                    p["orientation"],
+                    p["segment_index"],
+                )
+                if isinstance(p, dict)
+                else SolarPanelArray.record(
+                    p.center.lat, p.center.lon, p.yearly_energy_dc_kwh, p.orientation, p.segment_index
+                )
+                for p in panels
+            ]
+        self.array = np.asarray(panels, dtype=SOLAR_PANEL_DTYPE)
+
+    @staticmethod
+    def record(lat, lon, yearly_energy_dc_kwh, orientation, segment_index) -> tuple:
+        return (
+            np.nan if lat is None else lat,
+            np.nan if lon is None else lon,
+            np.nan if yearly_energy_dc_kwh is None else yearly_energy_dc_kwh,
+            ORIENTATIONS.index(orientation) if orientation in ORIENTATIONS else 0,
+            -1 if segment_index is None else segment_index,
+        )
+
+    @staticmethod
+    def from_api(solar_panels: list[dict]) -> "SolarPanelArray":
+        return SolarPanelArray(
+            np.array(
+                [
+                    SolarPanelArray.record(
+                        sp.get("center", {}).get("latitude"),
+                        sp.get("center", {}).get("longitude"),
+                        sp.get("yearlyEnergyDcKwh"),
+                        sp.get("orientation", ""),
+                        sp.get("segmentIndex"),
+                    )
+                    for sp in solar_panels
+                ],
+                dtype=SOLAR_PANEL_DTYPE,
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return SolarPanelArray(self.array[i])
+        return self.panel(*self.array[i].item())
+
+    def __iter__(self):
+        for record in self.array.tolist():
+            yield self.panel(*record)
+
+    @staticmethod
+    def panel(lat, lon, yearly_energy_dc_kwh, orientation, segment_index) -> SolarPanel:
+        return SolarPanel(
+            center=Coordinate(lat=none_if_nan(lat), lon=none_if_nan(lon)),
+            yearly_energy_dc_kwh=none_if_nan(yearly_energy_dc_kwh),
+            orientation=ORIENTATIONS[orientation],
+            segment_index=None if segment_index < 0 else segment_index,
+        )
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, SolarPanelArray):
+            # byte comparison so missing (NaN) values compare equal
+            return self.array.shape == other.array.shape and self.array.tobytes() == other.array.tobytes()
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"SolarPanelArray({len(self)} panels)"
+
+    def to_json(self) -> list[dict]:
+        return [
+            {
+                "center": {"lat": p.center.lat, "lon": p.center.lon},
+                "yearly_energy_dc_kwh": p.yearly_energy_dc_kwh,
+                "orientation": p.orientation,
+                "segment_index": p.segment_index,
+            }
+            for p in self
+        ]
+
+
+register_encoder(SolarPanelArray, SolarPanelArray.to_json)
+register_decoder(SolarPanelArray, SolarPanelArray)
+
+
 @dataclass
 class SizeAndSunshineStats:
     area: float
@@ -56,57 +191,51 @@ class SolarPotential:
     carbon_offset_kg: float
     whole_roof_stats: SizeAndSunshineStats
     roof_segments_stats: list[RoofSegmentStats]
-    solar_panels: list[SolarPanel]
+    solar_panels: SolarPanelArray
     solar_panel_configs: list[SolarPanelConfig]
+    # the Google building the response is for, adjacent OSM buildings often resolve to the same one
+    building_name: str | None = None
+    building_center: Coordinate | None = None
+    building_bounds: Bounds | None = None
 
     @staticmethod
-    def from_json(json_data):
-        # should probably look for a library that can do this automaticall
-        return SolarPotential(
-            max_panels=json_data.get("solarPotential", {}).get("maxArrayPanelsCount", None),
-            panel_capacity=json_data.get("solarPotential", {}).get("panelCapacityWatts", None),
-            panel_height_meters=json_data.get("solarPotential", {}).get("panelHeightMeters", None),
-            panel_width_meters=json_data.get("solarPotential", {}).get("panelWidthMeters", None),
-            panel_lifetime_years=json_data.get("solarPotential", {}).get("panelLifetimeYears", None),
-            max_array_area_meters_2=json_data.get("solarPotential", {}).get("maxArrayAreaMeters2", None),
-            max_sunshine_hours_year=json_data.get("solarPotential", {}).get("maxSunshineHoursYear", None),
-            carbon_offset_kg=json_data.get("solarPotential", {}).get("carbonOffsetFactorKgPerMwh", None),
-            whole_roof_stats=SizeAndSunshineStats(
-                area=json_data.get("solarPotential", {}).get("wholeRoofStats", {}).get("areaMeters2", None),
-                sunshine_quantiles=[
-                    q
-                    for q in json_data.get("solarPotential", {}).get("wholeRoofStats", {}).get("sunshineQuantiles", [])
-                ],
-            ),
-            roof_segments_stats=[
+    def from_json(json_data, only: Container[str] | None = None):
+        """
+        :param json_data: buildingInsights.findClosest response
+        :param only: SolarPotential fields to keep, the others are left empty; all of them by default.
+            The building identity fields are always kept.
+        """
+        potential = json_data.get("solarPotential", {})
+
+        def stats(data: dict) -> SizeAndSunshineStats:
+            return SizeAndSunshineStats(
+                area=data.get("areaMeters2", None), sunshine_quantiles=list(data.get("sunshineQuantiles", []))
+            )
+
+        parsers = {
+            "max_panels": lambda: potential.get("maxArrayPanelsCount", None),
+            "panel_capacity": lambda: potential.get("panelCapacityWatts", None),
+            "panel_height_meters": lambda: potential.get("panelHeightMeters", None),
+            "panel_width_meters": lambda: potential.get("panelWidthMeters", None),
+            "panel_lifetime_years": lambda: potential.get("panelLifetimeYears", None),
+            "max_array_area_meters_2": lambda: potential.get("maxArrayAreaMeters2", None),
+            "max_sunshine_hours_year": lambda: potential.get("maxSunshineHoursYear", None),
+            "carbon_offset_kg": lambda: potential.get("carbonOffsetFactorKgPerMwh", None),
+            "whole_roof_stats": lambda: stats(potential.get("wholeRoofStats", {})),
+            "roof_segments_stats": lambda: [
                 RoofSegmentStats(
                     center=Coordinate(
                         lat=rs.get("center", {}).get("latitude", None), lon=rs.get("center", {}).get("longitude", None)
                     ),
-                    stats=SizeAndSunshineStats(
-                        area=rs.get("stats", {}).get("areaMeters2", None),
-                        sunshine_quantiles=[q for q in rs.get("stats", {}).get("sunshineQuantiles", [])],
-                    ),
+                    stats=stats(rs.get("stats", {})),
                     pitch_degrees=rs.get("pitchDegrees", None),
                     azimuth_degrees=rs.get("azimuthDegrees", None),
-                    panel_height_at_center_meters=rs.get(
-                        "panelHeightAtCenterMeters",
-                    ),
+                    panel_height_at_center_meters=rs.get("panelHeightAtCenterMeters", None),
                 )
-                for rs in json_data.get("solarPotential", {}).get("roofSegmentStats", [])
+                for rs in potential.get("roofSegmentStats", [])
             ],
-            solar_panels=[
-                SolarPanel(
-                    center=Coordinate(
-                        lat=sp.get("center", {}).get("latitude", None), lon=sp.get("center", {}).get("longitude", None)
-                    ),
-                    yearly_energy_dc_kwh=sp.get("yearlyEnergyDcKwh", None),
-                    orientation=sp.get("orientation", ""),
-                    segment_index=sp.get("segmentIndex", None),
-                )
-                for sp in json_data.get("solarPotential", {}).get("solarPanels", [])
-            ],
-            solar_panel_configs=[
+            "solar_panels": lambda: SolarPanelArray.from_api(potential.get("solarPanels", [])),
+            "solar_panel_configs": lambda: [
                 SolarPanelConfig(
                     panels_count=spc.get("panelsCount", None),
                     yearly_energy_dc_kwh=spc.get("yearlyEnergyDcKwh", None),
@@ -121,11 +250,30 @@ class SolarPotential:
                         for rss in spc.get("roofSegmentSummaries", [])
                     ],
                 )
-                for spc in json_data.get("solarPotential", {}).get("solarPanelConfigs", [])
+                for spc in potential.get("solarPanelConfigs", [])
             ],
+        }
+        empty = {"roof_segments_stats": [], "solar_panels": SolarPanelArray(), "solar_panel_configs": []}
+
+        center, box = json_data.get("center"), json_data.get("boundingBox")
+        return SolarPotential(
+            **{name: parse() if only is None or name in only else empty.get(name) for name, parse in parsers.items()},
+            building_name=json_data.get("name", None),
+            building_center=Coordinate(lat=center["latitude"], lon=center["longitude"]) if center else None,
+            building_bounds=Bounds(
+                minlat=box["sw"]["latitude"],
+                minlon=box["sw"]["longitude"],
+                maxlat=box["ne"]["latitude"],
+                maxlon=box["ne"]["longitude"],
+            )
+            if box
+            else None,
         )
 
 
+SOLAR_POTENTIAL_FIELDS = tuple(f.name for f in fields(SolarPotential))
+
+
 @dataclass
 class SolarInsight:
     panel_insight: PanelInsight
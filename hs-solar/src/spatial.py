@@ -0,0 +1,94 @@
+# Spatial join between panel detections and building footprints.
+
+import math
+from collections import defaultdict
+from typing import Any
+
+import numpy as np
+import shapely
+from shapely import STRtree
+from shapely.geometry import Polygon, box
+
+from src.building_insight import Bounds, BuildingInsight
+
+NO_BUILDING = -1
+
+
+def footprint(building: BuildingInsight) -> Polygon:
+    """Building footprint polygon in (lon, lat), falling back to its bounds for degenerate geometries."""
+    if len(building.geometry) >= 3:
+        return Polygon(np.asarray(building.geometry)[:, ::-1])
+    return box(building.bounds.minlon, building.bounds.minlat, building.bounds.maxlon, building.bounds.maxlat)
+
+
+class BuildingIndex:
+    """
+    R-tree over building footprints.
+    Detections are assigned to the building whose footprint contains their center or,
+    when no footprint does, to the building their box overlaps the most.
+    """
+
+    def __init__(self, buildings: list[BuildingInsight]):
+        self.buildings = buildings
+        self.footprints = np.array([footprint(b) for b in buildings], dtype=object)
+        self.tree = STRtree(self.footprints)
+
+    def assign(self, detections: list[dict]) -> np.ndarray:
+        """
+        Matches detections to buildings.
+        :param detections: Detections from the panel detection service, with lat/lon "corners"
+        :return: Index into `buildings` for each detection, NO_BUILDING if it lies on no building
+        """
+        assigned = np.full(len(detections), NO_BUILDING, dtype=np.int64)
+        if len(detections) == 0 or len(self.buildings) == 0:
+            return assigned
+
+        corners = [np.asarray(d["corners"], dtype=np.float64) for d in detections]
+        centers = np.array([c.mean(axis=0) for c in corners])
+        det_idx, bld_idx = self.tree.query(shapely.points(centers[:, 1], centers[:, 0]), predicate="within")
+        assigned[det_idx] = bld_idx
+
+        missing = np.flatnonzero(assigned == NO_BUILDING)
+        if len(missing) == 0:
+            return assigned
+
+        mins = np.array([corners[i].min(axis=0) for i in missing])
+        maxs = np.array([corners[i].max(axis=0) for i in missing])
+        boxes = shapely.box(mins[:, 1], mins[:, 0], maxs[:, 1], maxs[:, 0])
+        box_idx, bld_idx = self.tree.query(boxes, predicate="intersects")
+        if len(box_idx) == 0:
+            return assigned
+
+        overlap = shapely.area(shapely.intersection(boxes[box_idx], self.footprints[bld_idx]))
+        box_idx, bld_idx, overlap = box_idx[overlap > 0], bld_idx[overlap > 0], overlap[overlap > 0]
+        # sort by overlap so the largest one per detection is written last
+        order = np.argsort(overlap, kind="stable")
+        assigned[missing[box_idx[order]]] = bld_idx[order]
+        return assigned
+
+
+class BoxIndex:
+    """
+    Grid over bounding boxes that can grow while it is queried, unlike the R-tree of BuildingIndex.
+    Each box is listed in every `cell_size` degrees cell it overlaps.
+    """
+
+    def __init__(self, cell_size: float = 0.001):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+
+    def cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def add(self, bounds: Bounds, value: Any) -> None:
+        (i0, j0), (i1, j1) = self.cell(bounds.minlat, bounds.minlon), self.cell(bounds.maxlat, bounds.maxlon)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                self.cells[(i, j)].append((bounds, value))
+
+    def find(self, lat: float, lon: float) -> Any | None:
+        """Value of a box containing the point, None if there is none."""
+        for b, value in self.cells.get(self.cell(lat, lon), ()):
+            if b.minlat <= lat <= b.maxlat and b.minlon <= lon <= b.maxlon:
+                return value
+        return None
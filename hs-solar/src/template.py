@@ -1,7 +1,22 @@
+import csv
+import functools
+import os
+from collections.abc import Iterable
+from itertools import islice
+
 from jinja2 import Template
+
 from src.address_insight import AddressInsight
 from src.pipeline import Config
 
+# what the templates read, so columnar addresses stages decode nothing else, e.g. the solar panels
+TEMPLATE_FIELDS = (
+    "address",
+    "solar_insight.panel_insight.building.centroid",
+    "solar_insight.panel_insight.detection_image_url",
+    "solar_insight.solar_potential.solar_panel_configs[:1]",
+)
+
 template_str = """
 <!DOCTYPE html>
 <html>
@@ -49,22 +64,74 @@ template_str = """
         {% endfor %}
         </tbody>
     </table>
+    {% if prev_page or next_page %}
+    <p>
+        {% if prev_page %}<a href="{{ prev_page }}">Previous</a>{% endif %}
+        {% if next_page %}<a href="{{ next_page }}">Next</a>{% endif %}
+    </p>
+    {% endif %}
 </body>
 </html>
 """
 
 
-def render_ranking_template(config: Config, address_insights: list[AddressInsight], html_file: str) -> str:
-    template = Template(template_str)
-    output = template.render(config=config, address_insights=address_insights)
+@functools.cache
+def ranking_template() -> Template:
+    # compiled once per process
+    return Template(template_str)
+
 
-    with open(html_file, "w", encoding="utf-8") as f:
-        f.write(output)
+def render_ranking_template(
+    config: Config, address_insights: Iterable[AddressInsight], html_file: str, page_size: int | None = None
+) -> str:
+    """
+    Streams the ranking into html_file as it renders, so only the current rows are held in memory.
+    With page_size, the ranking is split into pages of that many rows linked to each other:
+    html_file, then html_file with -2, -3... before its extension.
+    """
+    template = ranking_template()
+    if page_size is None:
+        with open(html_file, "w", encoding="utf-8") as f:
+            f.writelines(template.generate(config=config, address_insights=address_insights))
+        return
+
+    root, ext = os.path.splitext(html_file)
+
+    def page_file(page: int) -> str:
+        return html_file if page == 1 else f"{root}-{page}{ext}"
+
+    rows = iter(address_insights)
+    page, page_rows = 1, list(islice(rows, page_size))
+    while True:
+        # read the next page ahead, to know whether this one links to it
+        next_rows = list(islice(rows, page_size))
+        with open(page_file(page), "w", encoding="utf-8") as f:
+            f.writelines(
+                template.generate(
+                    config=config,
+                    address_insights=page_rows,
+                    prev_page=os.path.basename(page_file(page - 1)) if page > 1 else None,
+                    next_page=os.path.basename(page_file(page + 1)) if next_rows else None,
+                )
+            )
+        if not next_rows:
+            return
+        page, page_rows = page + 1, next_rows
 
 
-def render_csv_template(config: Config, address_insights: list[AddressInsight], csv_file: str) -> str:
-    with open(csv_file, "w", encoding="utf-8") as f:
-        f.write("Address,Latitude,Longitude,Configuration Panel Count,Yearly Energy DC (kWh),Aerial Detection Image\n")
+def render_csv_template(config: Config, address_insights: Iterable[AddressInsight], csv_file: str) -> str:
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(
+            [
+                "Address",
+                "Latitude",
+                "Longitude",
+                "Configuration Panel Count",
+                "Yearly Energy DC (kWh)",
+                "Aerial Detection Image",
+            ]
+        )
         for addr in address_insights:
             lat = addr.solar_insight.panel_insight.building.centroid.lat
             lon = addr.solar_insight.panel_insight.building.centroid.lon
@@ -76,6 +143,13 @@ def render_csv_template(config: Config, address_insights: list[AddressInsight],
                 panels_count = "N/A"
                 yearly_energy_dc_kwh = "N/A"
             detection_image_url = addr.solar_insight.panel_insight.detection_image_url.lstrip("results/")
-            f.write(
-                f"{addr.address},{lat},{lon},{panels_count},{yearly_energy_dc_kwh},{config.panel_detection_service}/{detection_image_url}\n"
+            writer.writerow(
+                [
+                    addr.address,
+                    lat,
+                    lon,
+                    panels_count,
+                    yearly_energy_dc_kwh,
+                    f"{config.panel_detection_service}/{detection_image_url}",
+                ]
             )
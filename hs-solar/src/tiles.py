@@ -0,0 +1,102 @@
+# Web Mercator helpers to cover a region with the satellite tiles the panel detection service fetches.
+# The projection math mirrors solar-panel-detection/panel-detection/app/utils.py, which converts
+# detections inside one of those tiles back into coordinates.
+
+import math
+from dataclasses import dataclass
+
+from src.building_insight import Bounds, Coordinate
+
+EARTH_RADIUS = 6378137
+ORIGIN_SHIFT = 2 * math.pi * EARTH_RADIUS / 2.0
+TILE_ZOOM = 20  # zoom level requested by the detection service
+TILE_SIZE = 416  # the detection service requests 416x416 images from google maps
+
+
+def latlon_to_meters(lat: float, lon: float) -> tuple[float, float]:
+    mx = lon * ORIGIN_SHIFT / 180.0
+    my = math.log(math.tan((90 + lat) * math.pi / 360.0)) * EARTH_RADIUS
+    return mx, my
+
+
+def meters_to_latlon(mx: float, my: float) -> tuple[float, float]:
+    lon = (mx / ORIGIN_SHIFT) * 180.0
+    lat = (2 * math.atan(math.exp(my / EARTH_RADIUS)) - math.pi / 2) * (180.0 / math.pi)
+    return lat, lon
+
+
+def resolution(zoom: int) -> float:
+    # resolution (meters/pixel) at zoom level
+    return (2 * math.pi * EARTH_RADIUS) / (256 * 2**zoom)
+
+
+@dataclass
+class TileGrid:
+    """
+    Grid of square tiles laid from the top-left corner of a region, in Web Mercator meters.
+    Tile (row, col) spans `size` meters and consecutive tiles start `step` meters apart.
+    """
+
+    min_mx: float
+    max_my: float
+    size: float
+    step: float
+    rows: int
+    cols: int
+
+    def center(self, row: int, col: int) -> Coordinate:
+        lat, lon = meters_to_latlon(
+            self.min_mx + col * self.step + self.size / 2,
+            self.max_my - row * self.step - self.size / 2,
+        )
+        return Coordinate(lat=lat, lon=lon)
+
+    def tile_of(self, lat: float, lon: float) -> tuple[int, int]:
+        """Tile whose center is closest to the given point."""
+        mx, my = latlon_to_meters(lat, lon)
+        col = round((mx - self.min_mx - self.size / 2) / self.step)
+        row = round((self.max_my - my - self.size / 2) / self.step)
+        return min(max(row, 0), self.rows - 1), min(max(col, 0), self.cols - 1)
+
+    def tiles_overlapping(self, bounds: Bounds) -> list[tuple[int, int]]:
+        """Tiles whose footprint intersects the given bounds."""
+        min_mx, min_my = latlon_to_meters(bounds.minlat, bounds.minlon)
+        max_mx, max_my = latlon_to_meters(bounds.maxlat, bounds.maxlon)
+
+        first_col = max(math.ceil((min_mx - self.min_mx - self.size) / self.step), 0)
+        last_col = min(math.floor((max_mx - self.min_mx) / self.step), self.cols - 1)
+        first_row = max(math.ceil((self.max_my - self.size - max_my) / self.step), 0)
+        last_row = min(math.floor((self.max_my - min_my) / self.step), self.rows - 1)
+
+        return [(r, c) for r in range(first_row, last_row + 1) for c in range(first_col, last_col + 1)]
+
+
+def tile_grid(bounds: Bounds, overlap: float = 0.0, zoom: int = TILE_ZOOM, tile_size: int = TILE_SIZE) -> TileGrid:
+    """
+    Covers the given bounds with detection tiles.
+    :param bounds: Region to cover
+    :param overlap: Fraction of a tile shared with its neighbours, in [0, 1)
+    :return: TileGrid covering the whole region
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError(f"Tile overlap must be in [0, 1), got {overlap}")
+
+    min_mx, min_my = latlon_to_meters(bounds.minlat, bounds.minlon)
+    max_mx, max_my = latlon_to_meters(bounds.maxlat, bounds.maxlon)
+
+    size = tile_size * resolution(zoom)
+    step = size * (1 - overlap)
+
+    def count(extent: float) -> int:
+        if extent <= size:
+            return 1
+        return math.ceil((extent - size) / step) + 1
+
+    return TileGrid(
+        min_mx=min_mx,
+        max_my=max_my,
+        size=size,
+        step=step,
+        rows=count(max_my - min_my),
+        cols=count(max_mx - min_mx),
+    )
@@ -0,0 +1,99 @@
+# Compares loading a solar stage file with the cached decoders of src/encoder.py against the
+# previous reflective from_dict, which inspected the dataclass fields for every object.
+# Run from the hs-solar directory: python -m tests.bench_encoder [buildings] [panels per building]
+
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import is_dataclass
+
+from src.building_insight import Bounds, BuildingInsight, Coordinate
+from src.encoder import DataclassJSONEncoder, decoder_for, dump_stage_result
+from src.panel_insight import PanelInsight
+from src.solar_insight import (
+    RoofSegmentStats,
+    RoofSegmentSummary,
+    SizeAndSunshineStats,
+    SolarInsight,
+    SolarPanel,
+    SolarPanelConfig,
+    SolarPotential,
+)
+
+
+def legacy_from_dict(cls, data):
+    fieldtypes = {f.name: f.type for f in cls.__dataclass_fields__.values()}
+    kwargs = {}
+    for k, v in data.items():
+        if is_dataclass(fieldtypes[k]):
+            kwargs[k] = legacy_from_dict(fieldtypes[k], v)
+        elif isinstance(v, list) and hasattr(fieldtypes[k], "__args__"):
+            subtype = fieldtypes[k].__args__[0]
+            if is_dataclass(subtype):
+                kwargs[k] = [legacy_from_dict(subtype, i) for i in v]
+            else:
+                kwargs[k] = v
+        else:
+            kwargs[k] = v
+    return cls(**kwargs)
+
+
+def solar_insight(i: int, panels: int) -> SolarInsight:
+    geometry = [Coordinate(38.7 + j * 1e-5, -9.1 + j * 1e-5) for j in range(8)]
+    building = BuildingInsight(i, Bounds(38.7, -9.1, 38.71, -9.09), geometry, {"building": "yes"})
+    stats = SizeAndSunshineStats(120.5, [float(q) for q in range(11)])
+    return SolarInsight(
+        panel_insight=PanelInsight(building, False, f"http://localhost/results/{i}"),
+        solar_potential=SolarPotential(
+            max_panels=panels,
+            panel_capacity=400.0,
+            panel_height_meters=1.879,
+            panel_width_meters=1.045,
+            panel_lifetime_years=20,
+            max_array_area_meters_2=panels * 1.96,
+            max_sunshine_hours_year=1700.2,
+            carbon_offset_kg=428.9,
+            whole_roof_stats=stats,
+            roof_segments_stats=[RoofSegmentStats(Coordinate(38.7, -9.1), stats, 22.4, 250.2, 60.1) for _ in range(4)],
+            solar_panels=[
+                SolarPanel(Coordinate(38.7 + j * 1e-6, -9.1), 512.3, "LANDSCAPE", j % 4) for j in range(panels)
+            ],
+            solar_panel_configs=[
+                SolarPanelConfig(n, n * 512, [RoofSegmentSummary(n, n * 512.3, 22.4, 250.2, 0)])
+                for n in range(4, panels + 1)
+            ],
+        ),
+    )
+
+
+def timed(name: str, f) -> float:
+    start = time.perf_counter()
+    result = f()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>16}: {elapsed:.2f}s")
+    return result
+
+
+def main():
+    buildings = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    panels = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "solar.json")
+        dump_stage_result("solar", path, [solar_insight(i, panels) for i in range(buildings)])
+        print(f"{buildings} buildings, {buildings * panels} solar panels, {os.path.getsize(path) / 1024**2:.0f} MB")
+
+        with open(path) as f:
+            records = timed("json.load", lambda: json.load(f)["result"])
+
+    legacy = timed("legacy from_dict", lambda: [legacy_from_dict(SolarInsight, r) for r in records])
+    decode = decoder_for(SolarInsight)
+    cached = timed("cached decoder", lambda: [decode(r) for r in records])
+    # the legacy decoder leaves Optional dataclasses and registered types as dicts, so compare what they encode to
+    assert json.dumps(legacy, cls=DataclassJSONEncoder) == json.dumps(cached, cls=DataclassJSONEncoder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import json
+import time
+
+import requests
+
+from src.cache import ResponseCache
+from src.pipeline import geocode_ok
+
+
+def response(status_code: int, body: dict) -> requests.Response:
+    rsp = requests.Response()
+    rsp.status_code = status_code
+    rsp.headers["Content-Type"] = "application/json"
+    rsp._content = json.dumps(body).encode()
+    return rsp
+
+
+def counting(cache: ResponseCache, api: str, responses: list, **cached):
+    calls = []
+
+    @cache.cached(api, **cached)
+    def request(lat: float, lon: float) -> requests.Response:
+        calls.append((lat, lon))
+        return responses[min(len(calls), len(responses)) - 1]
+
+    return request, calls
+
+
+def test_responses_are_reused_for_nearby_coordinates(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), coordinate_precision=4)
+    request, calls = counting(cache, "solar", [response(200, {"name": "a"})])
+
+    assert request(38.71234, -9.13871).json() == {"name": "a"}
+    rsp = request(38.71231, -9.13869)
+
+    assert rsp.json() == {"name": "a"}
+    assert rsp.from_cache
+    assert len(calls) == 1
+    assert (cache.hits["solar"], cache.misses["solar"]) == (1, 1)
+
+
+def test_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    request, _ = counting(ResponseCache(path), "solar", [response(200, {"name": "a"})])
+    request(38.7, -9.1)
+
+    request, calls = counting(ResponseCache(path), "solar", [response(200, {"name": "b"})])
+    assert request(38.7, -9.1).json() == {"name": "a"}
+    assert len(calls) == 0
+
+
+def test_errors_are_not_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    request, calls = counting(cache, "solar", [response(500, {}), response(200, {"name": "a"})])
+
+    assert request(38.7, -9.1).status_code == 500
+    assert request(38.7, -9.1).status_code == 200
+    assert request(38.7, -9.1).status_code == 200
+    assert len(calls) == 2
+
+
+def test_expired_entries_are_requested_again(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl={"solar": 0.05})
+    request, calls = counting(cache, "solar", [response(200, {"name": "a"})])
+
+    request(38.7, -9.1)
+    time.sleep(0.1)
+    request(38.7, -9.1)
+    assert len(calls) == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    body = {"data": "x" * 100}
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=2 * len(json.dumps(body)))
+    request, calls = counting(cache, "solar", [response(200, body)])
+
+    request(1.0, 1.0)
+    request(2.0, 2.0)
+    request(1.0, 1.0)  # now more recently used than the second one
+    request(3.0, 3.0)
+    assert len(calls) == 3
+
+    request(1.0, 1.0)
+    assert len(calls) == 3
+    request(2.0, 2.0)
+    assert len(calls) == 4
+
+
+def test_geocode_errors_with_a_200_status_are_not_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    results = {"status": "OK", "results": [{"formatted_address": "Rua A, Lisboa"}]}
+    request, calls = counting(
+        cache,
+        "geocode",
+        [
+            response(200, {"status": "OVER_QUERY_LIMIT", "results": []}),
+            response(200, {"status": "REQUEST_DENIED", "results": []}),
+            response(200, {"status": "ZERO_RESULTS", "results": []}),
+            response(200, results),
+        ],
+        cacheable=geocode_ok,
+    )
+
+    for _ in range(5):
+        request(38.7, -9.1)
+    assert len(calls) == 4
+    assert request(38.7, -9.1).json() == results
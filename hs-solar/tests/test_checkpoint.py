@@ -0,0 +1,116 @@
+import json
+
+import requests
+
+from src.address_insight import AddressInsight
+from src.building_insight import Bounds, BuildingInsight, Coordinate
+from src.encoder import StageCheckpoint, load_stage_result
+from src.panel_insight import PanelInsight
+from src.pipeline import Config, SolarPipeline
+from src.solar_insight import SolarInsight, SolarPotential
+
+
+def solar_insight(building_id: int) -> SolarInsight:
+    # buildings about 100 m apart, so none of them shares an address
+    lat, lon = 38.7 + building_id * 0.001, -9.1
+    geometry = [Coordinate(lat, lon), Coordinate(lat + 1e-4, lon), Coordinate(lat, lon + 1e-4), Coordinate(lat, lon)]
+    building = BuildingInsight(
+        building_id, Bounds(lat, lon, lat + 1e-4, lon + 1e-4), geometry, {"building": "yes"}, Coordinate(lat, lon)
+    )
+    return SolarInsight(PanelInsight(building, False, ""), SolarPotential.from_json({}))
+
+
+def address_insight(building_id: int) -> AddressInsight:
+    return AddressInsight(f"Rua {building_id}, Lisboa", solar_insight(building_id))
+
+
+def checkpoint(path) -> StageCheckpoint:
+    return StageCheckpoint(
+        "addresses", str(path), AddressInsight, key=lambda a: a.solar_insight.panel_insight.building.building_id
+    )
+
+
+def test_interrupted_stage_is_resumed(tmp_path):
+    path = tmp_path / "addresses.jsonl"
+    with checkpoint(path) as c:
+        c.add(address_insight(2))
+        c.add(address_insight(0))
+    # a crash halfway through writing the next result
+    with open(path, "a") as f:
+        f.write('{"address": "Rua 1')
+
+    with checkpoint(path) as c:
+        assert 0 in c and 2 in c and 1 not in c
+        c.add(address_insight(1))
+        results = c.finish(range(4))
+
+    assert [a.address for a in results] == ["Rua 0, Lisboa", "Rua 1, Lisboa", "Rua 2, Lisboa"]
+    _, saved = load_stage_result(str(path), AddressInsight)
+    assert saved == results
+
+
+class FakeGeocoding:
+    """Answers reverse geocoding requests with `status`, or an address for OK."""
+
+    def __init__(self, status: str):
+        self.status = status
+        self.calls = 0
+
+    def __call__(self, url, **kwargs):
+        self.calls += 1
+        body = {"status": self.status, "results": []}
+        if self.status == "OK":
+            body["results"] = [{"formatted_address": f"Rua {self.calls}, Lisboa"}]
+        rsp = requests.Response()
+        rsp.status_code = 200
+        rsp._content = json.dumps(body).encode()
+        return rsp
+
+
+def test_failed_geocoding_is_not_checkpointed(tmp_path, monkeypatch):
+    pipeline = SolarPipeline(
+        Config(
+            google_cloud_key="",
+            panel_detection_service="",
+            bot_corner=[38.7, -9.1],
+            top_corner=[38.71, -9.09],
+            confidence_threshold=0.5,
+        )
+    )
+    solar_insights = [solar_insight(i) for i in range(3)]
+    path = str(tmp_path / "addresses.jsonl")
+
+    monkeypatch.setattr(requests, "get", FakeGeocoding("OVER_QUERY_LIMIT"))
+    assert pipeline.get_addresses(solar_insights, path) == []
+
+    geocoding = FakeGeocoding("OK")
+    monkeypatch.setattr(requests, "get", geocoding)
+    addresses = pipeline.get_addresses(solar_insights, path)
+
+    assert geocoding.calls == 3
+    assert all(a.address for a in addresses)
+    assert [a.solar_insight for a in addresses] == solar_insights
+
+
+def test_buildings_without_an_address_are_checkpointed(tmp_path, monkeypatch):
+    pipeline = SolarPipeline(
+        Config(
+            google_cloud_key="",
+            panel_detection_service="",
+            bot_corner=[38.7, -9.1],
+            top_corner=[38.71, -9.09],
+            confidence_threshold=0.5,
+        )
+    )
+    solar_insights = [solar_insight(i) for i in range(3)]
+    path = str(tmp_path / "addresses.jsonl")
+
+    geocoding = FakeGeocoding("ZERO_RESULTS")
+    monkeypatch.setattr(requests, "get", geocoding)
+    addresses = pipeline.get_addresses(solar_insights, path)
+    assert [a.address for a in addresses] == ["", "", ""]
+    assert [a.solar_insight for a in addresses] == solar_insights
+
+    # a resumed run keeps them rather than geocoding them again
+    assert pipeline.get_addresses(solar_insights, path) == addresses
+    assert geocoding.calls == 3
@@ -0,0 +1,118 @@
+from dataclasses import dataclass
+
+import pytest
+from folium.plugins import FastMarkerCluster
+
+from src.address_insight import AddressInsight
+from src.building_insight import BuildingInsight, Coordinate, CoordinateArray
+from src.columnar import StageTable
+from src.encoder import dump_stage_result, iter_stage_result, load_stage_result
+from src.map import BUILDING_MAP_FIELDS, SOLAR_MAP_FIELDS, Map
+from src.solar_insight import SolarInsight, SolarPanel, SolarPanelArray
+from src.template import TEMPLATE_FIELDS
+from tests.bench_encoder import solar_insight
+
+
+@dataclass
+class Route:
+    stops: list[Coordinate] | None
+    path: CoordinateArray | None = None
+    panels: SolarPanelArray | None = None
+
+
+@dataclass
+class Note:
+    extra: dict
+
+
+def addresses(n: int) -> list[AddressInsight]:
+    result = [AddressInsight(f"Rua {i}, Lisboa", solar_insight(i, 5)) for i in range(n)]
+    for a in result:
+        potential = a.solar_insight.solar_potential
+        potential.solar_panels = SolarPanelArray(potential.solar_panels)
+    return result
+
+
+def test_columnar_stages_roundtrip(tmp_path):
+    result = addresses(3)
+    for name in ("addresses.npz", "addresses.columns"):
+        path = str(tmp_path / name)
+        dump_stage_result("addresses", path, result)
+        assert load_stage_result(path, AddressInsight)[1] == result
+    assert StageTable(str(tmp_path / "addresses.columns"), AddressInsight)[-1] == result[-1]
+
+
+def test_projection_only_decodes_the_given_fields(tmp_path):
+    result = addresses(3)
+    for name in ("addresses.npz", "addresses.columns"):
+        path = str(tmp_path / name)
+        dump_stage_result("addresses", path, result)
+        _, projected = iter_stage_result(path, AddressInsight, TEMPLATE_FIELDS)
+
+        for full, row in zip(result, projected, strict=True):
+            assert row.address == full.address
+            building, potential = row.solar_insight.panel_insight.building, row.solar_insight.solar_potential
+            assert building.centroid == full.solar_insight.panel_insight.building.centroid
+            assert potential.solar_panel_configs == full.solar_insight.solar_potential.solar_panel_configs[:1]
+            assert len(building.geometry) == 0 and building.tags is None
+            assert len(potential.solar_panels) == 0 and potential.roof_segments_stats == []
+
+
+def test_json_stages_ignore_the_projection(tmp_path):
+    result = addresses(2)
+    path = str(tmp_path / "addresses.jsonl")
+    dump_stage_result("addresses", path, result)
+    assert list(iter_stage_result(path, AddressInsight, TEMPLATE_FIELDS)[1]) == result
+
+
+def test_map_projection_keeps_the_footprints(tmp_path):
+    buildings = [a.solar_insight.panel_insight.building for a in addresses(3)]
+    path = str(tmp_path / "buildings.columns")
+    dump_stage_result("buildings", path, buildings)
+    _, projected = iter_stage_result(path, BuildingInsight, BUILDING_MAP_FIELDS)
+    for full, row in zip(buildings, projected, strict=True):
+        assert (row.building_id, row.geometry, row.centroid, row.area) == (
+            full.building_id,
+            full.geometry,
+            full.centroid,
+            full.area,
+        )
+        assert row.tags is None
+
+
+def test_solar_map_projection_clusters_every_panel(tmp_path):
+    insights = [a.solar_insight for a in addresses(3)]
+    path = str(tmp_path / "solar.columns")
+    dump_stage_result("solar", path, insights)
+    _, projected = iter_stage_result(path, SolarInsight, SOLAR_MAP_FIELDS)
+
+    m = Map(38.7, -9.1)
+    m.clusterSolarPanels(s.solar_potential.solar_panels for s in projected)
+    (cluster,) = [c for c in m.m._children.values() if isinstance(c, FastMarkerCluster)]
+    panels = [p for s in insights for p in s.solar_potential.solar_panels]
+    assert len(cluster.data) == len(panels) == 15
+    assert cluster.data[0][:2] == [panels[0].center.lat, panels[0].center.lon]
+
+
+def test_optional_lists_and_arrays_keep_their_nones(tmp_path):
+    line = CoordinateArray([Coordinate(1.0, 2.0), Coordinate(3.0, 4.0)])
+    routes = [Route([Coordinate(1.0, 2.0)], line), Route(None), Route([], CoordinateArray())]
+    for name in ("routes.npz", "routes.columns"):
+        path = str(tmp_path / name)
+        dump_stage_result("routes", path, routes)
+        assert load_stage_result(path, Route)[1] == routes
+
+
+def test_array_fields_coerce_their_values(tmp_path):
+    panels = [SolarPanel(Coordinate(1.0, 2.0), 700.0, "LANDSCAPE", 0), SolarPanel(Coordinate(3.0, 4.0), 650.0, "", 1)]
+    path = str(tmp_path / "routes.npz")
+    # lists of panels and of lat/lon dicts rather than the array types the fields hold
+    dump_stage_result("routes", path, [Route([], [{"lat": 1.0, "lon": 2.0}], panels)])
+    (route,) = load_stage_result(path, Route)[1]
+    assert route.path == CoordinateArray([Coordinate(1.0, 2.0)])
+    assert list(route.panels) == panels
+
+
+def test_dataclasses_without_a_column_are_rejected(tmp_path):
+    with pytest.raises(TypeError, match="extra"):
+        dump_stage_result("notes", str(tmp_path / "notes.npz"), [Note({"a": 1}), Note(Coordinate(1.0, 2.0))])
@@ -0,0 +1,142 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from src.concurrency import AdaptiveConcurrency, imap_unordered
+from src.decorator import TokenBucket
+
+
+def response(status_code: int) -> requests.Response:
+    rsp = requests.Response()
+    rsp.status_code = status_code
+    rsp.raw = io.BytesIO(b"")
+    return rsp
+
+
+def test_connection_errors_are_retried():
+    calls = []
+
+    @AdaptiveConcurrency("test", backoff=0)
+    def request():
+        calls.append(1)
+        if len(calls) < 3:
+            raise requests.exceptions.ConnectionError("reset")
+        return response(200)
+
+    assert request().status_code == 200
+    assert len(calls) == 3
+
+
+def test_connection_errors_are_raised_after_max_retries():
+    @AdaptiveConcurrency("test", max_retries=2, backoff=0)
+    def request():
+        raise requests.exceptions.ConnectionError("reset")
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        request()
+
+
+def test_overloaded_responses_are_retried_and_halve_the_limit():
+    concurrency = AdaptiveConcurrency("test", initial=8, maximum=8, backoff=0)
+    statuses = iter([429, 503, 200])
+
+    @concurrency
+    def request():
+        return response(next(statuses))
+
+    assert request().status_code == 200
+    assert int(concurrency.limit) < 8
+
+
+def test_rate_limit_waits_are_not_latency():
+    # every call but the first waits ~50 ms for a token, far longer than the request itself
+    concurrency = AdaptiveConcurrency("test", initial=4, maximum=4, rate_limit=TokenBucket(calls=20, period=1))
+
+    @concurrency
+    def request():
+        time.sleep(0.01)
+        return response(200)
+
+    for _ in range(10):
+        request()
+    assert int(concurrency.limit) == 4
+
+
+class CountingBucket(TokenBucket):
+    def __init__(self):
+        super().__init__(calls=1000, period=1, burst=1000)
+        self.taken = 0
+
+    def wait(self) -> None:
+        self.taken += 1
+        super().wait()
+
+
+def test_retries_take_a_rate_limit_token():
+    bucket = CountingBucket()
+    statuses = iter([429, 503, 200])
+
+    @AdaptiveConcurrency("test", backoff=0, rate_limit=bucket)
+    def request():
+        if bucket.taken == 1:
+            raise requests.exceptions.ConnectionError("reset")
+        return response(next(statuses))
+
+    assert request().status_code == 200
+    # a connection error, two overloaded responses and the successful one
+    assert bucket.taken == 4
+
+
+def test_imap_unordered_yields_every_result():
+    assert sorted(imap_unordered(lambda x: x * x, iter(range(20)), 3)) == [x * x for x in range(20)]
+
+
+def test_imap_unordered_yields_results_while_inputs_stream_in():
+    log = []
+
+    def inputs():
+        for i in range(5):
+            log.append(("in", i))
+            yield i
+            time.sleep(0.05)
+
+    # the window of 8 inputs is never full, results still come out before the last input
+    for result in imap_unordered(lambda x: x, inputs(), 4):
+        log.append(("out", result))
+    assert log.index(("out", 0)) < log.index(("in", 4))
+
+
+def test_streamed_responses_hold_their_slot_until_closed():
+    concurrency = AdaptiveConcurrency("test", initial=1, maximum=1)
+
+    @concurrency.streaming
+    def request():
+        return response(200)
+
+    first = request()
+    with ThreadPoolExecutor(1) as executor:
+        second = executor.submit(request)
+        time.sleep(0.05)
+        assert not second.done()
+        first.close()
+        assert second.result(timeout=1).status_code == 200
+
+
+def test_imap_unordered_discards_results_left_when_stopped_early():
+    # results hold one of two slots until consumed or discarded, like streamed responses
+    slots = threading.Semaphore(2)
+
+    def hold(x):
+        slots.acquire()
+        return x
+
+    results = imap_unordered(hold, iter(range(20)), 3, lambda x: slots.release())
+    next(results)
+    stop = threading.Thread(target=results.close)
+    stop.start()
+    stop.join(timeout=5)
+    assert not stop.is_alive()
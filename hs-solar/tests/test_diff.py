@@ -0,0 +1,65 @@
+import requests
+
+from src.address_insight import AddressInsight
+from src.building_insight import BuildingInsight, Coordinate, CoordinateArray
+from src.encoder import dump_stage_result, load_stage_result
+from src.pipeline import Config, SolarPipeline
+from tests.test_checkpoint import FakeGeocoding, address_insight, solar_insight
+
+
+def pipeline() -> SolarPipeline:
+    return SolarPipeline(
+        Config(
+            google_cloud_key="",
+            panel_detection_service="",
+            bot_corner=[38.7, -9.1],
+            top_corner=[38.71, -9.09],
+            confidence_threshold=0.5,
+        )
+    )
+
+
+def buildings(ids) -> list[BuildingInsight]:
+    return [solar_insight(i).panel_insight.building for i in ids]
+
+
+def moved(building: BuildingInsight) -> BuildingInsight:
+    geometry = [Coordinate(c.lat + 1e-5, c.lon) for c in building.geometry]
+    return BuildingInsight(building.building_id, building.bounds, geometry, building.tags)
+
+
+def test_diff_buildings_by_id_and_footprint(tmp_path):
+    previous = str(tmp_path / "buildings.json")
+    dump_stage_result("buildings", previous, buildings(range(4)))
+
+    # building 3 was removed, 1 modified and 4 added
+    current = buildings([0, 1, 2, 4])
+    current[1] = moved(current[1])
+    assert pipeline().diff_buildings(current, previous) == {0, 2}
+
+
+def test_diff_ignores_noise_below_osm_precision(tmp_path):
+    previous = str(tmp_path / "buildings.columns")
+    dump_stage_result("buildings", previous, buildings(range(2)))
+
+    current = buildings(range(2))
+    for b in current:
+        b.geometry = CoordinateArray(b.geometry.array + 1e-9)
+    assert pipeline().diff_buildings(current, previous) == {0, 1}
+
+
+def test_unchanged_buildings_reuse_their_previous_addresses(tmp_path, monkeypatch):
+    previous = str(tmp_path / "previous.jsonl")
+    dump_stage_result("addresses", previous, [address_insight(i) for i in range(3)])
+
+    geocoding = FakeGeocoding("OK")
+    monkeypatch.setattr(requests, "get", geocoding)
+    solar_insights = [solar_insight(i) for i in range(4)]
+    path = str(tmp_path / "addresses.jsonl")
+    addresses = pipeline().get_addresses(solar_insights, path, previous, unchanged={0, 2})
+
+    # building 1 changed and 3 is new, so only they are geocoded again
+    assert geocoding.calls == 2
+    assert [a.solar_insight for a in addresses] == solar_insights
+    assert [addresses[0].address, addresses[2].address] == ["Rua 0, Lisboa", "Rua 2, Lisboa"]
+    assert load_stage_result(path, AddressInsight)[1] == addresses
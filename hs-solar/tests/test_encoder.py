@@ -0,0 +1,88 @@
+import json
+from dataclasses import asdict, dataclass
+
+from src.building_insight import Coordinate
+from src.encoder import DataclassJSONEncoder, decoder_for, dump_stage_result, load_stage_result, register_decoder
+from src.solar_insight import SolarInsight, SolarPanelArray
+from tests.bench_encoder import legacy_from_dict, solar_insight
+
+
+@dataclass
+class Point:
+    x: float
+    y: float | None = None
+
+
+@dataclass
+class Shape:
+    name: str
+    center: Point
+    points: list[Point]
+    weights: list[float]
+    label: str | None = None
+
+
+@dataclass
+class Marker:
+    at: Point | None = None
+    shapes: list[Shape] | None = None
+
+
+class Celsius(float):
+    pass
+
+
+@dataclass
+class Reading:
+    temperature: Celsius
+    history: list[Celsius]
+
+
+def roundtrip(value) -> dict:
+    return json.loads(json.dumps(value, cls=DataclassJSONEncoder))
+
+
+def shape(label: str | None) -> Shape:
+    return Shape("roof", Point(1.0), [Point(1.0, 2.0), Point(3.0)], [0.5, 0.25], label)
+
+
+def test_decoder_matches_the_legacy_decoder():
+    for value in (shape(None), shape("south")):
+        data = roundtrip(value)
+        assert decoder_for(Shape)(data) == legacy_from_dict(Shape, data) == value
+
+
+def test_decoder_matches_the_legacy_decoder_on_solar_insights():
+    records = [roundtrip(solar_insight(i, panels)) for i, panels in enumerate((0, 1, 7))]
+    decoded = [decoder_for(SolarInsight)(r) for r in records]
+    # the legacy decoder leaves Optional dataclasses and registered types as dicts, so compare what they encode to
+    assert [roundtrip(s) for s in decoded] == [roundtrip(legacy_from_dict(SolarInsight, r)) for r in records] == records
+    assert all(isinstance(s.solar_potential.solar_panels, SolarPanelArray) for s in decoded)
+    assert all(isinstance(s.panel_insight.building.centroid, Coordinate) for s in decoded)
+
+
+def test_optional_dataclasses_are_decoded():
+    # the legacy decoder left these as dicts
+    for value in (Marker(), Marker(Point(1.0, 2.0), [shape("south")]), Marker(None, [])):
+        assert decoder_for(Marker)(roundtrip(value)) == value
+
+
+def test_registered_decoders_take_precedence():
+    data = roundtrip(Reading(Celsius(21.5), [Celsius(20.0)]))
+    assert type(decoder_for(Reading)(data).temperature) is float
+
+    register_decoder(Celsius, Celsius)
+    reading = decoder_for(Reading)(data)
+    assert type(reading.temperature) is Celsius
+    assert all(type(t) is Celsius for t in reading.history)
+
+
+def test_stage_files_roundtrip(tmp_path):
+    insights = [solar_insight(i, 3) for i in range(3)]
+    for name in ("solar.json", "solar.jsonl"):
+        path = str(tmp_path / name)
+        dump_stage_result("solar", path, insights)
+        metadata, loaded = load_stage_result(path, SolarInsight)
+        assert metadata["name"] == "solar"
+        assert loaded == insights
+        assert [asdict(s.panel_insight) for s in loaded] == [asdict(s.panel_insight) for s in insights]
@@ -0,0 +1,87 @@
+import logging
+import math
+import sqlite3
+
+import requests
+
+from src.geocode import METERS_PER_DEGREE, GeocodeCache
+from src.pipeline import Config, SolarPipeline
+from tests.test_checkpoint import FakeGeocoding, solar_insight
+
+
+def offset(lat: float, lon: float, north: float, east: float) -> tuple[float, float]:
+    """Point `north` and `east` metres away."""
+    return lat + north / METERS_PER_DEGREE, lon + east / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+
+
+def test_nearest_address_within_radius():
+    cache = GeocodeCache(radius=25, snap=0)
+    cache.add(38.7, -9.1, "Rua A, Lisboa")
+    cache.add(*offset(38.7, -9.1, 0, 40), "Rua B, Lisboa")
+
+    assert cache.nearest(*offset(38.7, -9.1, 10, 5)) == "Rua A, Lisboa"
+    assert cache.nearest(*offset(38.7, -9.1, 0, 30)) == "Rua B, Lisboa"
+    assert cache.nearest(*offset(38.7, -9.1, 0, -30)) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_addresses_across_grid_cells():
+    # the cache indexes points by 0.001 degree cells, neighbours in the next cell are found too
+    cache = GeocodeCache(radius=25, snap=0)
+    cache.add(38.70099, -9.10001, "Rua A, Lisboa")
+    assert cache.nearest(38.70101, -9.09999) == "Rua A, Lisboa"
+
+
+def test_snap_grid_is_square_in_metres():
+    cache = GeocodeCache(snap=10)
+    lat, lon = cache.snap(38.71234, -9.13871)
+    assert abs(lat - 38.71234) * METERS_PER_DEGREE <= 5
+    assert abs(lon + 9.13871) * METERS_PER_DEGREE * math.cos(math.radians(lat)) <= 5
+    assert cache.snap(*offset(lat, lon, 2, -2)) == (lat, lon)
+
+
+def test_addresses_persist_and_expire(tmp_path):
+    path = str(tmp_path / "geocode.sqlite")
+    GeocodeCache(path).add(38.7, -9.1, "Rua A, Lisboa")
+    assert GeocodeCache(path).nearest(38.7, -9.1) == "Rua A, Lisboa"
+
+    with sqlite3.connect(path) as db:
+        db.execute("UPDATE addresses SET created_at = created_at - 100")
+    assert GeocodeCache(path, max_age=1000).nearest(38.7, -9.1) == "Rua A, Lisboa"
+    assert GeocodeCache(path, max_age=10).nearest(38.7, -9.1) is None
+    # dropped from the file too
+    assert GeocodeCache(path).nearest(38.7, -9.1) is None
+
+
+def test_caches_from_before_max_age_are_upgraded(tmp_path):
+    path = str(tmp_path / "geocode.sqlite")
+    with sqlite3.connect(path) as db:
+        db.execute("CREATE TABLE addresses (cell_lat INTEGER, cell_lon INTEGER, lat REAL, lon REAL, address TEXT)")
+        db.execute("INSERT INTO addresses VALUES (38700, -9100, 38.7, -9.1, 'Rua A, Lisboa')")
+
+    assert GeocodeCache(path).nearest(38.7, -9.1) == "Rua A, Lisboa"
+    assert GeocodeCache(path, max_age=10).nearest(38.7, -9.1) is None
+
+
+def test_log_counts_geocoded_points(monkeypatch, caplog):
+    pipeline = SolarPipeline(
+        Config(
+            google_cloud_key="",
+            panel_detection_service="",
+            bot_corner=[38.7, -9.1],
+            top_corner=[38.71, -9.09],
+            confidence_threshold=0.5,
+        )
+    )
+    # two buildings 100 m apart, then one on the same point as the first
+    solar_insights = [solar_insight(0), solar_insight(1), solar_insight(0)]
+    geocoding = FakeGeocoding("OVER_QUERY_LIMIT")
+    monkeypatch.setattr(requests, "get", geocoding)
+
+    with caplog.at_level(logging.INFO):
+        list(pipeline.request_addresses(solar_insights))
+
+    # three spatial cache misses, but the last building shares the request made for the first
+    assert pipeline.geocode_cache.misses == 3
+    assert "0 addresses reused from within 25.0 m, 2 points geocoded" in caplog.text
+    assert geocoding.calls == 2
@@ -0,0 +1,68 @@
+import math
+
+import numpy as np
+import pytest
+from shapely.geometry import Polygon
+
+from src.building_insight import Coordinate, CoordinateArray
+from src.geometry import EARTH_RADIUS, footprint_hash, footprint_metrics, polygon_metrics, ragged_coordinates
+
+POLYGONS = [
+    # closed square, 1e-4 degrees a side
+    [(38.7, -9.1), (38.7001, -9.1), (38.7001, -9.0999), (38.7, -9.0999), (38.7, -9.1)],
+    # open L-shaped ring, wound the other way
+    [(38.71, -9.1), (38.71, -9.0998), (38.7101, -9.0998), (38.7101, -9.0999), (38.7102, -9.0999), (38.7102, -9.1)],
+    # triangle across the antimeridian side of the equator
+    [(-0.0001, 179.9998), (0.0001, 179.9998), (0.0, 179.9999)],
+]
+
+
+def test_centroids_match_shapely():
+    metrics = footprint_metrics(*ragged_coordinates(np.array(p) for p in POLYGONS))
+    for points, centroid in zip(POLYGONS, metrics.centroids):
+        expected = Polygon([(lon, lat) for lat, lon in points]).centroid
+        assert centroid == pytest.approx([expected.y, expected.x], abs=1e-12)
+
+
+def test_areas_and_bounds():
+    metrics = footprint_metrics(*ragged_coordinates(np.array(p) for p in POLYGONS))
+    side = math.radians(1e-4) * EARTH_RADIUS
+    assert metrics.areas[0] == pytest.approx(side * side * math.cos(math.radians(38.70005)), rel=1e-9)
+    # the L is three squares of the same size
+    assert metrics.areas[1] == pytest.approx(3 * side * side * math.cos(math.radians(38.7101)), rel=1e-3)
+    np.testing.assert_allclose(metrics.bounds[0], [38.7, -9.1, 38.7001, -9.0999])
+    np.testing.assert_allclose(metrics.bounds[2], [-0.0001, 179.9998, 0.0001, 179.9999])
+
+
+def test_degenerate_and_empty_polygons():
+    polygons = [[(38.7, -9.1), (38.7002, -9.1)], [(38.7, -9.1)] * 4, []]
+    metrics = footprint_metrics(*ragged_coordinates(np.array(p).reshape(-1, 2) for p in polygons))
+    # the mean of their vertices, without any area
+    assert metrics.centroids[0] == pytest.approx([38.7001, -9.1])
+    assert metrics.centroids[1] == pytest.approx([38.7, -9.1])
+    assert np.isnan(metrics.centroids[2]).all() and np.isnan(metrics.bounds[2]).all()
+    assert metrics.areas.tolist() == [0.0, 0.0, 0.0]
+
+
+def test_polygon_metrics_match_the_vectorized_ones():
+    polygons = POLYGONS + [[(38.7, -9.1), (38.7002, -9.1)], []]
+    metrics = footprint_metrics(*ragged_coordinates(np.array(p).reshape(-1, 2) for p in polygons))
+    for points, centroid, area in zip(polygons, metrics.centroids, metrics.areas):
+        lat, lon, single_area = polygon_metrics(points)
+        np.testing.assert_allclose([lat, lon, single_area], [*centroid, area], rtol=1e-12)
+
+
+def test_ragged_coordinates_packs_arrays_and_coordinates():
+    coords, offsets = ragged_coordinates(
+        [CoordinateArray(np.array(POLYGONS[2])), [Coordinate(1.0, 2.0), Coordinate(3.0, 4.0)], []]
+    )
+    assert offsets.tolist() == [0, 3, 5, 5]
+    assert coords[3:].tolist() == [[1.0, 2.0], [3.0, 4.0]]
+    assert ragged_coordinates([])[0].shape == (0, 2)
+
+
+def test_footprint_hash_ignores_noise_below_osm_precision():
+    square = np.array(POLYGONS[0])
+    assert footprint_hash(square) == footprint_hash(square + 1e-9)
+    assert footprint_hash(np.array([[0.0, -0.0]])) == footprint_hash(np.array([[0.0, 0.0]]))
+    assert footprint_hash(square) != footprint_hash(square + 1e-6)
@@ -0,0 +1,116 @@
+from xml.etree import ElementTree
+
+import pytest
+
+from src import osm_extract
+from src.osm_extract import NODE, WAY, extract_buildings, read_osm_xml
+
+BBOX = (38.70, -9.15, 38.72, -9.13)
+
+OSM = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <bounds minlat="38.6" minlon="-9.3" maxlat="38.8" maxlon="-9.0"/>
+  <node id="1" lat="38.710" lon="-9.140"/>
+  <node id="2" lat="38.711" lon="-9.140"/>
+  <node id="3" lat="38.711" lon="-9.139"/>
+  <node id="4" lat="38.720" lon="-9.130"/>
+  <node id="5" lat="38.725" lon="-9.125"/>
+  <node id="6" lat="38.725" lon="-9.130"/>
+  <node id="7" lat="38.750" lon="-9.100"/>
+  <node id="8" lat="38.751" lon="-9.100"/>
+  <node id="9" lat="38.751" lon="-9.099"/>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="1"/>
+    <tag k="building" v="yes"/>
+  </way>
+  <way id="11">
+    <nd ref="1"/><nd ref="2"/>
+    <tag k="highway" v="footway"/>
+  </way>
+  <way id="12">
+    <nd ref="4"/><nd ref="5"/><nd ref="6"/><nd ref="4"/>
+    <tag k="building" v="house"/>
+  </way>
+  <way id="13">
+    <nd ref="7"/><nd ref="8"/><nd ref="9"/><nd ref="7"/>
+    <tag k="building" v="yes"/>
+  </way>
+  <relation id="20">
+    <member type="way" ref="10" role="outer"/>
+    <tag k="type" v="multipolygon"/>
+  </relation>
+  <relation id="21">
+    <member type="way" ref="12" role="outer"/>
+    <tag k="type" v="multipolygon"/>
+  </relation>
+</osm>
+"""
+
+
+@pytest.fixture
+def extract(tmp_path):
+    path = tmp_path / "region.osm"
+    path.write_text(OSM)
+    return str(path)
+
+
+def test_read_osm_xml_yields_nodes_and_building_ways(extract):
+    elements = list(read_osm_xml(extract))
+    assert [e[1] for e in elements if e[0] == NODE] == list(range(1, 10))
+    assert [(e[1], e[2], e[3]["building"]) for e in elements if e[0] == WAY] == [
+        (10, [1, 2, 3, 1], "yes"),
+        (12, [4, 5, 6, 4], "house"),
+        (13, [7, 8, 9, 7], "yes"),
+    ]
+    assert [e[1] for e in read_osm_xml(extract, nodes=False)] == [10, 12, 13]
+
+
+def test_read_osm_xml_keeps_no_parsed_element(tmp_path, monkeypatch):
+    # relations after the last way, over many of the chunks the parser reads at a time
+    relations = "".join(
+        f'<relation id="{i}"><member type="way" ref="10" role="outer"/><tag k="type" v="multipolygon"/></relation>'
+        for i in range(100, 2100)
+    )
+    extract = tmp_path / "relations.osm"
+    extract.write_text(OSM.replace("</osm>", relations + "</osm>"))
+
+    roots = []
+    iterparse = ElementTree.iterparse
+
+    def capture_root(*args, **kwargs):
+        events = iterparse(*args, **kwargs)
+        event, root = next(events)
+        roots.append(root)
+        yield event, root
+        yield from events
+
+    monkeypatch.setattr(osm_extract.ElementTree, "iterparse", capture_root)
+    list(read_osm_xml(str(extract)))
+    assert len(roots[0]) == 0
+
+
+def test_extract_buildings_within_the_region(extract, tmp_path):
+    buildings = list(extract_buildings(extract, BBOX, str(tmp_path / "nodes.sqlite")))
+
+    # the way crossing the region border is kept, the one outside of it is not
+    assert [b["id"] for b in buildings] == [10, 12]
+    assert buildings[0]["nodes"] == [1, 2, 3, 1]
+    assert buildings[0]["geometry"][1] == {"lat": 38.711, "lon": -9.140}
+    assert buildings[1]["tags"] == {"building": "house"}
+
+
+def test_node_index_is_reused_for_regions_within_it(extract, tmp_path, monkeypatch):
+    node_index = str(tmp_path / "nodes.sqlite")
+    list(extract_buildings(extract, BBOX, node_index))
+
+    reads = []
+    read_osm_xml = osm_extract.read_osm_xml
+    monkeypatch.setattr(
+        osm_extract, "read_osm_xml", lambda path, nodes: reads.append(nodes) or read_osm_xml(path, nodes)
+    )
+
+    within = (38.705, -9.145, 38.715, -9.135)
+    assert [b["id"] for b in extract_buildings(extract, within, node_index)] == [10]
+    assert [b["id"] for b in extract_buildings(extract, (38.70, -9.15, 38.76, -9.09), node_index)] == [10, 12, 13]
+    # the larger region indexes the nodes again
+    assert reads == [False, True]
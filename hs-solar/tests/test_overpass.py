@@ -0,0 +1,103 @@
+import io
+import json
+import re
+
+import pytest
+import requests
+
+from src.overpass import OverpassError, shard_bbox, stream_elements
+from src.pipeline import Config, SolarPipeline
+
+# ways by the point they lie at, the last one is on the border of the four quadrants of the region
+WAYS = {1: (0.01, 0.01), 2: (0.01, 0.04), 3: (0.04, 0.01), 4: (0.04, 0.04), 5: (0.025, 0.025)}
+
+
+def way(way_id: int) -> dict:
+    lat, lon = WAYS[way_id]
+    square = [(lat, lon), (lat + 0.0001, lon), (lat + 0.0001, lon + 0.0001), (lat, lon + 0.0001), (lat, lon)]
+    return {
+        "type": "way",
+        "id": way_id,
+        "nodes": list(range(len(square))),
+        "geometry": [{"lat": lat, "lon": lon} for lat, lon in square],
+        "tags": {"building": "yes"},
+    }
+
+
+def overpass_response(elements: list, remark: str | None = None) -> requests.Response:
+    body = {"version": 0.6, "elements": elements}
+    if remark is not None:
+        body["remark"] = remark
+    rsp = requests.Response()
+    rsp.status_code = 200
+    rsp.raw = io.BytesIO(json.dumps(body).encode())
+    return rsp
+
+
+class FakeOverpass:
+    """Answers building queries, failing midway for shards larger than `max_size` degrees."""
+
+    def __init__(self, max_size: float):
+        self.max_size = max_size
+        self.queries = []
+
+    def __call__(self, url, params, **kwargs):
+        south, west, north, east = map(float, re.search(r"\((.*?)\)", params["data"]).group(1).split(","))
+        self.queries.append((south, west, north, east))
+        elements = [way(way_id) for way_id, (lat, lon) in WAYS.items() if south <= lat <= north and west <= lon <= east]
+        if north - south > self.max_size:
+            return overpass_response(elements[:1], 'runtime error: Query ran out of memory in "query" at line 4.')
+        return overpass_response(elements)
+
+
+def pipeline(tmp_path, **overpass) -> SolarPipeline:
+    return SolarPipeline(
+        Config(
+            google_cloud_key="",
+            panel_detection_service="",
+            bot_corner=[0.0, 0.0],
+            top_corner=[0.05, 0.05],
+            confidence_threshold=0.5,
+            cache={"path": str(tmp_path / "cache.sqlite")},
+            overpass={"shard_size": 0.05, **overpass},
+        )
+    )
+
+
+def test_shard_bbox_covers_the_region_with_small_shards():
+    shards = shard_bbox((0.0, 0.0, 0.5, 1.0), 0.25)
+    assert len(shards) == 16
+    assert all(north - south <= 0.25 and east - west <= 0.25 for south, west, north, east in shards)
+    assert sum((north - south) * (east - west) for south, west, north, east in shards) == pytest.approx(0.5)
+
+
+def test_stream_elements_raises_failed_queries_and_records_the_body():
+    body = []
+    elements = stream_elements(overpass_response([way(1)], "runtime error: Query timed out"), chunk_size=64, body=body)
+    with pytest.raises(OverpassError):
+        list(elements)
+    assert json.loads(b"".join(body))["elements"] == [way(1)]
+
+
+def test_failed_shards_are_split_and_ways_yielded_once(tmp_path, monkeypatch):
+    overpass = FakeOverpass(max_size=0.03)
+    monkeypatch.setattr(requests, "get", overpass)
+
+    ways = list(pipeline(tmp_path).overpass_buildings((0.0, 0.0, 0.05, 0.05)))
+
+    assert sorted(el["id"] for el in ways) == sorted(WAYS)
+    # the region, then its four quadrants
+    assert len(overpass.queries) == 5
+
+
+def test_only_complete_responses_are_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(requests, "get", FakeOverpass(max_size=0.03))
+    list(pipeline(tmp_path).overpass_buildings((0.0, 0.0, 0.05, 0.05)))
+
+    overpass = FakeOverpass(max_size=0.03)
+    monkeypatch.setattr(requests, "get", overpass)
+    ways = list(pipeline(tmp_path).overpass_buildings((0.0, 0.0, 0.05, 0.05)))
+
+    assert sorted(el["id"] for el in ways) == sorted(WAYS)
+    # the failed region query again, the quadrants from the cache
+    assert overpass.queries == [(0.0, 0.0, 0.05, 0.05)]
@@ -0,0 +1,118 @@
+import math
+from functools import cmp_to_key
+
+import numpy as np
+import pytest
+
+from src.encoder import dump_stage_result, open_stage_result
+from src.pipeline import Config, SolarPipeline
+from src.ranking import key_columns, rank_order, raw_keys, scores, table_keys
+from src.solar_insight import RoofSegmentSummary, SolarInsight, SolarPanelConfig
+from tests.test_checkpoint import solar_insight
+
+
+def pipeline(**options) -> SolarPipeline:
+    return SolarPipeline(
+        Config(
+            google_cloud_key="",
+            panel_detection_service="",
+            bot_corner=[38.7, -9.1],
+            top_corner=[38.71, -9.09],
+            confidence_threshold=0.5,
+            **options,
+        )
+    )
+
+
+def ranked(building_id: int, *energies: float) -> SolarInsight:
+    s = solar_insight(building_id)
+    potential = s.solar_potential
+    potential.solar_panel_configs = [
+        SolarPanelConfig(4 * (n + 1), e, [RoofSegmentSummary(4 * (n + 1), e, 20.0, 180.0, 0)])
+        for n, e in enumerate(energies)
+    ]
+    potential.max_array_area_meters_2 = 10.0 * (building_id + 1)
+    potential.max_sunshine_hours_year = 1700.0
+    potential.carbon_offset_kg = 400.0
+    return s
+
+
+def legacy_rank(solar_insights: list[SolarInsight]) -> list[SolarInsight]:
+    # the comparator ranking replaced by the weighted criteria
+    def cmp_insights(insight1: SolarInsight, insight2: SolarInsight) -> int:
+        first = insight1.solar_potential.solar_panel_configs
+        second = insight2.solar_potential.solar_panel_configs
+        if len(first) == 0 and len(second) == 0:
+            return 0
+        if len(first) == 0:
+            return -1
+        if len(second) == 0:
+            return 1
+        energy1, energy2 = first[0].yearly_energy_dc_kwh, second[0].yearly_energy_dc_kwh
+        return (energy1 > energy2) - (energy1 < energy2)
+
+    return sorted(solar_insights, key=cmp_to_key(cmp_insights), reverse=True)
+
+
+INSIGHTS = [
+    ranked(0, 2000, 5000),
+    ranked(1),
+    ranked(2, 3000),
+    ranked(3, 2000, 4000),
+    ranked(4),
+    ranked(5, 1000),
+    ranked(6, 3000, 3500),
+]
+
+
+def ids(solar_insights) -> list[int]:
+    return [s.panel_insight.building.building_id for s in solar_insights]
+
+
+def test_default_weights_keep_the_legacy_order():
+    # empty configurations last, ties in input order
+    assert ids(pipeline().rank(INSIGHTS, None)) == ids(legacy_rank(INSIGHTS)) == [2, 6, 0, 3, 5, 1, 4]
+
+
+def test_weighted_criteria():
+    ranking = pipeline(rank_weights={"max_energy": 1.0}).rank(INSIGHTS, None)
+    assert ids(ranking) == [0, 3, 6, 2, 5, 1, 4]
+    with pytest.raises(ValueError):
+        pipeline(rank_weights={"height": 1.0}).rank(INSIGHTS, None)
+
+
+def test_top_k_keeps_the_earliest_ties():
+    score = np.array([1.0, 3.0, 2.0, 3.0, 3.0, 0.5])
+    assert rank_order(score, 2).tolist() == [1, 3]
+    assert rank_order(score, 4).tolist() == [1, 3, 4, 2]
+    assert rank_order(score, 0).tolist() == []
+    assert rank_order(score, 10).tolist() == rank_order(score).tolist() == [1, 3, 4, 2, 0, 5]
+    assert ids(pipeline().rank(INSIGHTS, None, top_k=3)) == [2, 6, 0]
+
+
+def test_top_k_with_missing_scores():
+    score = np.array([math.nan, 2.0, -math.inf, 1.0, math.nan])
+    # missing scores rank last, in input order, whether or not the cut reaches them
+    assert rank_order(score).tolist() == [1, 3, 0, 2, 4]
+    assert rank_order(score, 1).tolist() == [1]
+    assert rank_order(score, 3).tolist() == [1, 3, 0]
+    assert rank_order(score, 4).tolist() == [1, 3, 0, 2]
+
+    # insights missing every weighted criterion score -inf
+    keys = key_columns(INSIGHTS)
+    assert np.isneginf(scores(keys, {"energy": 1.0})[[1, 4]]).all()
+    assert ids(pipeline().rank(INSIGHTS, None, top_k=6)) == [2, 6, 0, 3, 5, 1]
+
+
+def test_columns_tables_are_ranked_from_their_columns(tmp_path):
+    path = str(tmp_path / "solar.columns")
+    dump_stage_result("solar", path, INSIGHTS)
+    _, table = open_stage_result(path, SolarInsight)
+
+    decoded = raw_keys(list(table))
+    for name, column in table_keys(table).items():
+        np.testing.assert_array_equal(column, decoded[name], err_msg=name)
+    for weights in ({"energy": 1.0}, {"energy_per_area": 1.0, "carbon_offset": 0.5}):
+        assert ids(pipeline(rank_weights=weights).rank(table, None, top_k=4)) == ids(
+            pipeline(rank_weights=weights).rank(INSIGHTS, None, top_k=4)
+        )
@@ -0,0 +1,67 @@
+from src.building_insight import Bounds, BuildingInsight, Coordinate
+from src.spatial import NO_BUILDING, BoxIndex, BuildingIndex
+
+
+def building(building_id: int, ring: list[tuple[float, float]]) -> BuildingInsight:
+    lats, lons = [lat for lat, _ in ring], [lon for _, lon in ring]
+    bounds = Bounds(min(lats), min(lons), max(lats), max(lons))
+    return BuildingInsight(building_id, bounds, [Coordinate(lat, lon) for lat, lon in ring], {})
+
+
+def detection(lat: float, lon: float, size: float = 1e-5) -> dict:
+    return {
+        "corners": [
+            [lat - size, lon - size],
+            [lat - size, lon + size],
+            [lat + size, lon + size],
+            [lat + size, lon - size],
+        ]
+    }
+
+
+# an L-shaped roof over (0, 0)-(2, 2) missing its (1, 1)-(2, 2) corner, in units of 1e-4 degrees
+L_SHAPE = [(0, 0), (0, 2), (1, 2), (1, 1), (2, 1), (2, 0), (0, 0)]
+# a small roof in the notch of the L, inside the L's bounds
+NOTCH = [(1.2, 1.2), (1.2, 1.8), (1.8, 1.8), (1.8, 1.2), (1.2, 1.2)]
+
+
+def scaled(ring: list[tuple[float, float]], lat: float = 38.7, lon: float = -9.1) -> list[tuple[float, float]]:
+    return [(lat + a * 1e-4, lon + b * 1e-4) for a, b in ring]
+
+
+def test_detections_go_to_the_footprint_holding_them():
+    index = BuildingIndex([building(1, scaled(L_SHAPE)), building(2, scaled(NOTCH))])
+    detections = [
+        detection(38.7 + 0.5e-4, -9.1 + 0.5e-4),  # on the L
+        detection(38.7 + 1.5e-4, -9.1 + 1.5e-4),  # in the notch, within the bounds of both
+        detection(38.7 + 1.9e-4, -9.1 + 1.95e-4),  # in the L's bounds but on neither roof
+        detection(38.8, -9.2),  # far away
+    ]
+    assert index.assign(detections).tolist() == [0, 1, NO_BUILDING, NO_BUILDING]
+
+
+def test_detections_off_every_footprint_go_to_the_largest_overlap():
+    index = BuildingIndex([building(1, scaled(L_SHAPE)), building(2, scaled(L_SHAPE, lon=-9.1 + 2.2e-4))])
+    # a box centered in the gap between both roofs, reaching further over the second one
+    assert index.assign([detection(38.7 + 0.5e-4, -9.1 + 2.15e-4, size=0.3e-4)]).tolist() == [1]
+
+
+def test_assign_without_detections_or_buildings():
+    assert len(BuildingIndex([building(1, scaled(L_SHAPE))]).assign([])) == 0
+    assert BuildingIndex([]).assign([detection(38.7, -9.1)]).tolist() == [NO_BUILDING]
+
+
+def test_degenerate_footprints_fall_back_to_their_bounds():
+    line = building(1, scaled([(0, 0), (1, 1)]))
+    line.bounds = Bounds(38.7, -9.1, 38.7001, -9.0999)
+    assert BuildingIndex([line]).assign([detection(38.7 + 0.5e-4, -9.1 + 0.2e-4)]).tolist() == [0]
+
+
+def test_box_index_finds_boxes_across_cells():
+    index = BoxIndex(cell_size=0.001)
+    index.add(Bounds(38.7005, -9.1005, 38.7015, -9.0995), "across")
+    index.add(Bounds(38.710, -9.100, 38.7101, -9.0999), "small")
+    assert index.find(38.7012, -9.0998) == "across"
+    assert index.find(38.7006, -9.1004) == "across"
+    assert index.find(38.71005, -9.09995) == "small"
+    assert index.find(38.705, -9.1) is None
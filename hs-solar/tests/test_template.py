@@ -0,0 +1,76 @@
+import csv
+import re
+
+from src.pipeline import Config
+from src.solar_insight import SolarPanelConfig
+from src.template import render_csv_template, render_ranking_template
+from tests.test_checkpoint import address_insight
+
+CONFIG = Config(
+    google_cloud_key="",
+    panel_detection_service="http://detection",
+    bot_corner=[38.7, -9.1],
+    top_corner=[38.71, -9.09],
+    confidence_threshold=0.5,
+)
+
+
+def addresses(n: int) -> list:
+    result = [address_insight(i) for i in range(n)]
+    for i, a in enumerate(result):
+        a.solar_insight.panel_insight.detection_image_url = f"results/{i}.png"
+    return result
+
+
+def rows(html: str) -> list[str]:
+    return re.findall(r"<td>(Rua \d+, Lisboa)</td>", html)
+
+
+def test_csv_quotes_addresses(tmp_path):
+    result = addresses(2)
+    result[0].address = 'Rua "Nova", 12, Lisboa'
+    result[1].solar_insight.solar_potential.solar_panel_configs = [SolarPanelConfig(8, 4100, [])]
+    path = tmp_path / "ranking.csv"
+    render_csv_template(CONFIG, iter(result), str(path))
+
+    with open(path, newline="", encoding="utf-8") as f:
+        header, *lines = list(csv.reader(f))
+    assert header[0] == "Address" and len(header) == 6
+    assert lines[0][0] == 'Rua "Nova", 12, Lisboa'
+    assert lines[0][3:] == ["N/A", "N/A", "http://detection/0.png"]
+    assert lines[1][3:5] == ["8", "4100"]
+
+
+def test_single_page(tmp_path):
+    path = tmp_path / "ranking.html"
+    render_ranking_template(CONFIG, iter(addresses(3)), str(path))
+    html = path.read_text()
+    assert rows(html) == ["Rua 0, Lisboa", "Rua 1, Lisboa", "Rua 2, Lisboa"]
+    assert "Next" not in html
+
+
+def test_pages_link_to_each_other(tmp_path):
+    render_ranking_template(CONFIG, iter(addresses(5)), str(tmp_path / "ranking.html"), page_size=2)
+    pages = [(tmp_path / name).read_text() for name in ("ranking.html", "ranking-2.html", "ranking-3.html")]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["ranking-2.html", "ranking-3.html", "ranking.html"]
+
+    assert [rows(p) for p in pages] == [
+        ["Rua 0, Lisboa", "Rua 1, Lisboa"],
+        ["Rua 2, Lisboa", "Rua 3, Lisboa"],
+        ["Rua 4, Lisboa"],
+    ]
+    assert '<a href="ranking-2.html">Next</a>' in pages[0] and "Previous" not in pages[0]
+    assert '<a href="ranking.html">Previous</a>' in pages[1] and '<a href="ranking-3.html">Next</a>' in pages[1]
+    assert '<a href="ranking-2.html">Previous</a>' in pages[2] and "Next" not in pages[2]
+
+
+def test_full_last_page_has_no_next_link(tmp_path):
+    render_ranking_template(CONFIG, iter(addresses(4)), str(tmp_path / "ranking.html"), page_size=2)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["ranking-2.html", "ranking.html"]
+    assert "Next" not in (tmp_path / "ranking-2.html").read_text()
+
+
+def test_empty_ranking_renders_one_page(tmp_path):
+    render_ranking_template(CONFIG, iter([]), str(tmp_path / "ranking.html"), page_size=2)
+    assert [p.name for p in tmp_path.iterdir()] == ["ranking.html"]
+    assert rows((tmp_path / "ranking.html").read_text()) == []
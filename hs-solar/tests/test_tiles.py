@@ -0,0 +1,121 @@
+import json
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from src.building_insight import Bounds, BuildingInsight, Coordinate
+from src.pipeline import Config, SolarPipeline
+from src.tiles import latlon_to_meters, meters_to_latlon, resolution, tile_grid
+
+
+def test_meters_roundtrip():
+    lat, lon = meters_to_latlon(*latlon_to_meters(38.7, -9.1))
+    assert lat == pytest.approx(38.7) and lon == pytest.approx(-9.1)
+
+
+def test_tile_grid_covers_the_region():
+    bounds = Bounds(38.7, -9.1, 38.703, -9.096)
+    grid = tile_grid(bounds, overlap=0.25)
+    assert grid.size == pytest.approx(416 * resolution(20))
+    assert grid.step == pytest.approx(grid.size * 0.75)
+
+    # every corner of the region falls in a tile of the grid
+    for lat, lon in ((38.7, -9.1), (38.703, -9.096), (38.7, -9.096), (38.703, -9.1)):
+        row, col = grid.tile_of(lat, lon)
+        center = grid.center(row, col)
+        cx, cy = latlon_to_meters(center.lat, center.lon)
+        mx, my = latlon_to_meters(lat, lon)
+        assert abs(mx - cx) <= grid.size / 2 + 1e-6 and abs(my - cy) <= grid.size / 2 + 1e-6
+
+
+def test_tiles_overlapping_a_building():
+    grid = tile_grid(Bounds(38.7, -9.1, 38.703, -9.096), overlap=0.5)
+    # a point lies in the two overlapping tiles on each axis, away from the grid edges
+    lat, lon = grid.center(2, 2).lat, grid.center(2, 2).lon
+    small = Bounds(lat - 1e-6, lon - 1e-6, lat + 1e-6, lon + 1e-6)
+    assert grid.tile_of(lat, lon) == (2, 2)
+    assert set(grid.tiles_overlapping(small)) >= {(2, 2)}
+    assert all(abs(r - 2) <= 1 and abs(c - 2) <= 1 for r, c in grid.tiles_overlapping(small))
+
+
+def test_tile_grid_rejects_full_overlap():
+    with pytest.raises(ValueError):
+        tile_grid(Bounds(38.7, -9.1, 38.703, -9.096), overlap=1.0)
+
+
+def building(building_id: int, lat: float, lon: float) -> BuildingInsight:
+    d = 5e-5
+    geometry = [Coordinate(lat, lon), Coordinate(lat + d, lon), Coordinate(lat + d, lon + d), Coordinate(lat, lon)]
+    return BuildingInsight(building_id, Bounds(lat, lon, lat + d, lon + d), geometry, {})
+
+
+class FakeDetection:
+    """Detection service seeing a panel on the first building only, and holding back tiles while `hold` is set."""
+
+    def __init__(self, panel: BuildingInsight, hold: Bounds | None = None):
+        self.panel = panel
+        self.hold = hold
+        self.release = threading.Event()
+        self.tiles = []
+        self.timed_out = False
+
+    def __call__(self, url, **kwargs):
+        query = parse_qs(urlparse(url).query)
+        lat, lon = float(query["lat"][0]), float(query["long"][0])
+        self.tiles.append((lat, lon))
+        if self.hold and self.hold.minlat <= lat <= self.hold.maxlat and self.hold.minlon <= lon <= self.hold.maxlon:
+            self.timed_out |= not self.release.wait(2)
+
+        c = self.panel.centroid
+        corners = [[c.lat - 1e-6, c.lon - 1e-6], [c.lat + 1e-6, c.lon + 1e-6]]
+        rsp = requests.Response()
+        rsp.status_code = 200
+        rsp._content = json.dumps(
+            {"detections": [{"corners": corners, "confidence": 0.99}], "image": f"{lat},{lon}"}
+        ).encode()
+        return rsp
+
+
+def grid_pipeline() -> SolarPipeline:
+    return SolarPipeline(
+        Config(
+            google_cloud_key="",
+            panel_detection_service="http://detection",
+            bot_corner=[38.7, -9.1],
+            top_corner=[38.71, -9.09],
+            confidence_threshold=0.5,
+            panel_detection_mode="grid",
+            # enough slots for the held tiles not to block the others
+            concurrency={"detection": {"initial": 8, "maximum": 8}},
+        )
+    )
+
+
+def test_grid_detection_joins_tiles_back_to_buildings(monkeypatch):
+    buildings = [building(0, 38.7, -9.1), building(1, 38.7005, -9.1), building(2, 38.7010, -9.1)]
+    detection = FakeDetection(buildings[0])
+    monkeypatch.setattr(requests, "get", detection)
+
+    panels = sorted(grid_pipeline().detect_solar_panels(buildings), key=lambda p: p.building.building_id)
+    assert [(p.building.building_id, p.has_panel) for p in panels] == [(0, True), (1, False), (2, False)]
+    # each tile is only requested once, whatever the number of buildings it covers
+    assert len(detection.tiles) == len(set(detection.tiles))
+
+
+def test_grid_detection_yields_buildings_as_their_tiles_complete(monkeypatch):
+    buildings = [building(0, 38.7, -9.1), building(1, 38.702, -9.1)]
+    # the tiles around the second building hang until released
+    detection = FakeDetection(buildings[0], hold=Bounds(38.7015, -9.101, 38.703, -9.099))
+    monkeypatch.setattr(requests, "get", detection)
+
+    panels = grid_pipeline().detect_solar_panels(buildings)
+    try:
+        first = next(panels)
+        assert first.building.building_id == 0 and first.has_panel
+        # yielded while the second building's tiles were still held
+        assert not detection.timed_out
+    finally:
+        detection.release.set()
+    assert [p.building.building_id for p in panels] == [1]
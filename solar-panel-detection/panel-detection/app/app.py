@@ -13,7 +13,12 @@ app = Flask(
 )
 app.config.from_object(AppConfig)
 
-model_service = ModelService(AppConfig.YOLO_PATH, AppConfig.STATIC_FOLDER)
+model_service = ModelService(
+    AppConfig.YOLO_PATH,
+    AppConfig.STATIC_FOLDER,
+    max_batch_size=AppConfig.MICRO_BATCH_SIZE,
+    max_batch_wait_ms=AppConfig.MICRO_BATCH_WAIT_MS,
+)
 maps_service = MapsService(AppConfig.MAPS_API_KEY)
 
 
@@ -60,6 +65,58 @@ def predict_coordinates():
     except Exception as e:
         abort(500, description=f"Internal server error: {str(e)}")
 
+    return {
+        "image": predictions["image"],
+        "detections": to_detections(predictions, lat, long),
+    }
+
+
+@app.route("/predict_batch", methods=["POST"])
+def predict_batch():
+    """Runs one batched prediction over a JSON list of coordinates or several uploaded images."""
+    coordinates = None
+    if "images" in request.files:
+        images = request.files.getlist("images")
+        if len(images) > AppConfig.MAX_BATCH_SIZE:
+            abort(400, description=f"Batch larger than {AppConfig.MAX_BATCH_SIZE} images")
+        images = [image_file.stream for image_file in images]
+    else:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("coordinates"), list):
+            abort(400, description="Missing 'coordinates' list or 'images' files in the request")
+        if len(body["coordinates"]) > AppConfig.MAX_BATCH_SIZE:
+            abort(400, description=f"Batch larger than {AppConfig.MAX_BATCH_SIZE} coordinates")
+
+        try:
+            coordinates = [(float(c["lat"]), float(c["long"])) for c in body["coordinates"]]
+        except (KeyError, TypeError, ValueError):
+            abort(400, description="Invalid or missing 'lat' or 'long' in 'coordinates'.")
+
+        try:
+            images = [maps_service.get_image(lat, long) for lat, long in coordinates]
+        except Exception as e:
+            abort(500, description=f"Could't complete request to Google Maps: {str(e)}")
+
+    try:
+        batch_predictions: list = model_service.predict_images(images)
+    except Exception as e:
+        abort(500, description=f"Internal server error: {str(e)}")
+
+    if coordinates is None:
+        return {"predictions": batch_predictions}
+
+    return {
+        "predictions": [
+            {
+                "image": predictions["image"],
+                "detections": to_detections(predictions, lat, long),
+            }
+            for predictions, (lat, long) in zip(batch_predictions, coordinates)
+        ]
+    }
+
+
+def to_detections(predictions: dict, lat: float, long: float) -> list:
     detections = []
     for res in predictions["results"]:
         top_x, top_y = res["bounding_box"][0], res["bounding_box"][1]
@@ -73,7 +130,7 @@ def predict_coordinates():
             },
         ]
 
-    return {"image": predictions["image"], "detections": detections}
+    return detections
 
 
 @app.route("/results/<uuid>")
@@ -6,3 +6,7 @@ class AppConfig:
     TEMPLATE_FOLDER = "templates/"
     YOLO_PATH = os.getenv("YOLO_PATH", "")
     MAPS_API_KEY = os.getenv("MAPS_API_KEY", "")
+    MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+    # micro-batching of concurrent single-image requests (1 disables it)
+    MICRO_BATCH_SIZE = int(os.getenv("MICRO_BATCH_SIZE", "1"))
+    MICRO_BATCH_WAIT_MS = float(os.getenv("MICRO_BATCH_WAIT_MS", "10"))
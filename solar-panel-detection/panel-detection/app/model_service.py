@@ -1,5 +1,9 @@
 import os
 import uuid
+import queue
+import threading
+import time
+from concurrent.futures import Future
 
 from PIL import Image, ImageOps
 from io import BytesIO
@@ -9,8 +13,16 @@ import numpy as np
 
 
 class ModelService:
-    def __init__(self, model_path: str, images_folder: str):
+    def __init__(
+        self,
+        model_path: str,
+        images_folder: str,
+        max_batch_size: int = 1,
+        max_batch_wait_ms: float = 0,
+    ):
         self.__model = YOLO(model_path)
+        # the YOLO predictor is not safe to call from several threads at once
+        self.__model_lock = threading.Lock()
         self.__imgs_folder = images_folder.rstrip("/") + "/results"
         if self.__imgs_folder.startswith("../"):
             self.__imgs_folder = self.__imgs_folder[3:]
@@ -18,39 +30,101 @@ class ModelService:
         if not os.path.exists(self.__imgs_folder):
             os.makedirs(self.__imgs_folder)
 
+        # micro-batching: concurrent predict_image calls are grouped into one forward pass
+        self.__max_batch_size = max_batch_size
+        self.__max_batch_wait = max_batch_wait_ms / 1000
+        self.__queue: queue.Queue = queue.Queue()
+        if self.__max_batch_size > 1:
+            threading.Thread(target=self.__batch_worker, daemon=True).start()
+
     def predict_image(self, image: BytesIO) -> dict:
+        img = self.__prepare(image)
+        if self.__max_batch_size <= 1:
+            return self.__predict([img])[0]
+
+        future = Future()
+        self.__queue.put((img, future))
+        return future.result()
+
+    def predict_images(self, images: list[BytesIO]) -> list[dict]:
+        """Runs a single batched forward pass over all images, returning one result per image in order."""
+        if len(images) == 0:
+            return []
+
+        return self.__predict([self.__prepare(image) for image in images])
+
+    def __batch_worker(self):
+        while True:
+            batch = [self.__queue.get()]
+            deadline = time.monotonic() + self.__max_batch_wait
+            while len(batch) < self.__max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.__queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                predictions = self.__predict([img for img, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+
+    @staticmethod
+    def __prepare(image: BytesIO) -> Image.Image:
         image = Image.open(image)
         img = ImageOps.fit(image, (416, 416), Image.LANCZOS)
-        img = img.convert("RGB")
+        return img.convert("RGB")
 
+    def __predict(self, imgs: list[Image.Image]) -> list[dict]:
         img_id = str(uuid.uuid4())
         if os.path.exists(self.__imgs_folder + "/" + img_id):
             os.remove(self.__imgs_folder + "/" + img_id)
 
-        results = self.__model.predict(
-            img, imgsz=416, save=True, project=self.__imgs_folder, name=img_id
-        )  # always one image, one result
+        with self.__model_lock:
+            results = self.__model.predict(
+                imgs, imgsz=416, save=True, project=self.__imgs_folder, name=img_id
+            )  # one result per image, saved as image<i>.jpg
+
+        if len(results) != len(imgs):
+            raise ValueError(
+                f"Expected {len(imgs)} results from prediction, got {len(results)}."
+            )
 
-        if len(results) == 0:
-            raise ValueError("No results from prediction.")
+        predictions: list = []
+        for i, result in enumerate(results):
+            result_response: list = []
 
-        result_response: list = []
+            boxes = (
+                result.boxes.xyxy.cpu().numpy().tolist()
+            )  # bounding boxes in (x1, y1, x2, y2) format
+            scores = result.boxes.conf.cpu().numpy().tolist()  # confidence scores
+            class_ids = result.boxes.cls.cpu().numpy().tolist()  # class indices
+            for box, score, class_id in zip(boxes, scores, class_ids):
+                result_response.append(
+                    {
+                        "label": result.names[int(class_id)],
+                        "score": score,
+                        "bounding_box": [*box],
+                    }
+                )
 
-        boxes = (
-            results[0].boxes.xyxy.cpu().numpy().tolist()
-        )  # bounding boxes in (x1, y1, x2, y2) format
-        scores = results[0].boxes.conf.cpu().numpy().tolist()  # confidence scores
-        class_ids = results[0].boxes.cls.cpu().numpy().tolist()  # class indices
-        for box, score, class_id in zip(boxes, scores, class_ids):
-            result_response.append(
+            predictions.append(
                 {
-                    "label": results[0].names[int(class_id)],
-                    "score": score,
-                    "bounding_box": [*box],
+                    "results": result_response,
+                    # the first image keeps the /results/<uuid> shortcut
+                    "image": (
+                        f"results/{img_id}"
+                        if i == 0
+                        else f"results/{img_id}/image{i}.jpg"
+                    ),
                 }
             )
 
-        return {
-            "results": result_response,
-            "image": f"results/{img_id}",
-        }
+        return predictions